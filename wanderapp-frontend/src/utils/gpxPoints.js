@@ -0,0 +1,28 @@
+// track_points für das Backend aus einer mit gpxparser gelesenen Datei.
+// gpxparser legt die Punkte aller <trkseg> eines <trk> zusammen; die Segmentgrenzen werden aus
+// gpx.xmlSource gezählt, damit Pausen und weitere Tage im Backend keine Distanz-Sprünge erzeugen.
+// Jeder Punkt bekommt den Index seines Segments über alle Tracks der Datei ('segment').
+
+export function gpxTrackPoints(gpx) {
+  const trkElements = gpx.xmlSource ? gpx.xmlSource.querySelectorAll('trk') : [];
+  const points = [];
+  let segment = 0;
+
+  gpx.tracks.forEach((track, t) => {
+    if (!track.points.length) return;
+    // Punktanzahl pro <trkseg>; ohne XML-Quelle gilt der ganze Track als ein Segment
+    const counts = trkElements[t]
+      ? Array.from(trkElements[t].querySelectorAll('trkseg'), (seg) => seg.querySelectorAll('trkpt').length)
+          .filter((count) => count > 0)
+      : [track.points.length];
+    let index = 0;
+    for (const count of counts) {
+      for (const p of track.points.slice(index, index + count)) {
+        points.push({ lat: p.lat, lon: p.lon, ele: p.ele, time: p.time ? p.time.toISOString() : null, segment });
+      }
+      index += count;
+      segment += 1;
+    }
+  });
+  return points;
+}
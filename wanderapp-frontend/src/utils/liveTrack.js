@@ -0,0 +1,60 @@
+// Live-Track-Stream des Backends (Server-Sent Events, api/live.py).
+// EventSource kann keinen Authorization-Header senden, daher fetch + ReadableStream mit JWT.
+// Der Server beendet Streams regelmässig (LIVE_STREAM_MAX_SECONDS); danach wird neu verbunden.
+
+const RECONNECT_DELAY_MS = 2000;
+
+function parseEvent(block) {
+  let event = 'message';
+  const data = [];
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data.push(line.slice(5).trimStart());
+  }
+  return data.length ? { event, data: JSON.parse(data.join('\n')) } : null;
+}
+
+// Abonniert /api/{path} und ruft onTrack(payload) für jedes 'track'-Event auf.
+// Gibt eine Funktion zum Beenden des Abos zurück.
+export function subscribeLiveTrack(path, onTrack) {
+  const controller = new AbortController();
+
+  const connect = async () => {
+    while (!controller.signal.aborted) {
+      try {
+        const response = await fetch(`/api/${path}`, {
+          headers: {
+            Accept: 'text/event-stream',
+            Authorization: `Bearer ${localStorage.getItem('accessToken')}`
+          },
+          signal: controller.signal
+        });
+        if (!response.ok) {
+          // 401/404: kein Live-Stream verfügbar, nicht endlos neu verbinden
+          if (response.status < 500) return;
+          throw new Error(`HTTP ${response.status}`);
+        }
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += value;
+          let end;
+          while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const parsed = parseEvent(buffer.slice(0, end));
+            buffer = buffer.slice(end + 2);
+            if (parsed?.event === 'track') onTrack(parsed.data);
+          }
+        }
+      } catch (err) {
+        if (controller.signal.aborted) return;
+      }
+      await new Promise(resolve => setTimeout(resolve, RECONNECT_DELAY_MS));
+    }
+  };
+
+  connect();
+  return () => controller.abort();
+}
@@ -0,0 +1,56 @@
+// Decoder für das binäre Track-Format des Backends (api/track_binary.py).
+// Header (16 Byte, little-endian): 'WTRK', uint8 Version, 3 Byte reserviert, uint32 Punktanzahl,
+// uint32 Anzahl Segment-Starts (Version 1: reserviert).
+// Danach: Float32 lon/lat interleaved (8 * n), Float32 Höhen (4 * n, NaN = unbekannt), Float32 Distanzen (4 * n),
+// Uint32 Punkt-Indizes, an denen ein neues GPX-Segment beginnt (4 * s).
+
+export const TRACK_MEDIA_TYPE = 'application/vnd.wanderapp.track';
+
+const HEADER_SIZE = 16;
+const VERSION = 2;
+
+export function decodeTrack(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+  const version = view.getUint8(4);
+  if (magic !== 'WTRK' || (version !== 1 && version !== VERSION)) {
+    throw new Error('Unbekanntes Track-Format');
+  }
+  const count = view.getUint32(8, true);
+  const segmentCount = version === 1 ? 0 : view.getUint32(12, true);
+  if (buffer.byteLength !== HEADER_SIZE + 16 * count + 4 * segmentCount) {
+    throw new Error('Unvollständige Track-Daten');
+  }
+
+  // Float32Array liest in Plattform-Byte-Order; alle gängigen Browser-Plattformen sind little-endian
+  const coords = new Float32Array(buffer, HEADER_SIZE, 2 * count);
+  const elevations = new Float32Array(buffer, HEADER_SIZE + 8 * count, count);
+  const distances = new Float32Array(buffer, HEADER_SIZE + 12 * count, count);
+  const segmentStarts = new Uint32Array(buffer, HEADER_SIZE + 16 * count, segmentCount);
+
+  const coordinates = new Array(count);
+  for (let i = 0; i < count; i++) {
+    coordinates[i] = [coords[2 * i], coords[2 * i + 1]];
+  }
+
+  return {
+    type: 'LineString',
+    coordinates,
+    elevations: Array.from(elevations, (e) => (Number.isNaN(e) ? null : e)),
+    distances: Array.from(distances),
+    segmentStarts: Array.from(segmentStarts),
+  };
+}
+
+// GeoJSON-Geometrie für die Karte: MultiLineString mit einer Linie pro Segment, damit zwischen
+// Segmenten (Pausen, weitere Tage) keine Verbindungslinie gezeichnet wird.
+export function trackGeometry(track) {
+  if (!track.segmentStarts?.length) {
+    return { type: 'LineString', coordinates: track.coordinates };
+  }
+  const bounds = [0, ...track.segmentStarts, track.coordinates.length];
+  return {
+    type: 'MultiLineString',
+    coordinates: bounds.slice(1).map((end, i) => track.coordinates.slice(bounds[i], end)),
+  };
+}
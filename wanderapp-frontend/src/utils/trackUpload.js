@@ -0,0 +1,14 @@
+// Speichern einer Etappe mit Track: bevorzugt nur das Vorschau-Token von /calculate-gpx/ senden.
+// Ist das Token abgelaufen (oder auf einem anderen Server-Prozess unbekannt), werden die Punkte
+// wie bisher mitgeschickt.
+
+export async function saveWithPreviewToken(save, payload, token, trackPoints) {
+  if (token) {
+    try {
+      return await save({ ...payload, track_token: token });
+    } catch (err) {
+      if (!err.response?.data?.track_token) throw err;
+    }
+  }
+  return save({ ...payload, track_points: trackPoints || [] });
+}
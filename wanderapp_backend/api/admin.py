@@ -211,12 +211,12 @@ class CommentAdmin(admin.ModelAdmin):
 # ===================================================================
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
-    list_display = ['preview_thumbnail', 'caption_display', 'stage', 'creator', 'dimensions', 'uploaded_at']
-    list_filter = ['uploaded_at', 'creator', 'stage__activity_type']
+    list_display = ['preview_thumbnail', 'caption_display', 'stage', 'creator', 'dimensions', 'processing_status', 'uploaded_at']
+    list_filter = ['uploaded_at', 'processing_status', 'creator', 'stage__activity_type']
     search_fields = ['caption']  # For autocomplete
     date_hierarchy = 'uploaded_at'
     autocomplete_fields = ['creator', 'stage']
-    readonly_fields = ['preview_image', 'original_width', 'original_height', 'uploaded_at', 'original', 'display', 'thumbnail', 'display_webp', 'thumbnail_webp']
+    readonly_fields = ['preview_image', 'original_width', 'original_height', 'uploaded_at', 'original', 'display', 'thumbnail', 'display_webp', 'thumbnail_webp', 'processing_status', 'processing_attempts', 'processing_error']
 
     fieldsets = (
         ('Photo Information', {
@@ -231,7 +231,7 @@ class PhotoAdmin(admin.ModelAdmin):
             'classes': ('collapse',),
         }),
         ('Metadata', {
-            'fields': ('uploaded_at',),
+            'fields': ('uploaded_at', 'processing_status', 'processing_attempts', 'processing_error'),
             'classes': ('collapse',)
         }),
     )
@@ -1,9 +1,95 @@
 # wanderapp_backend/api/filters.py
+import math
+
 import django_filters
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.core.exceptions import ValidationError
 from django.db import models
 from .models import Trip, User, Stage
 
-class TripFilter(django_filters.FilterSet):
+METERS_PER_DEGREE_LAT = 111320
+MAX_NEAR_RADIUS_M = 500000
+
+
+def _floats(value, count, label):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count or not all(math.isfinite(n) for n in numbers):
+        raise ValidationError(f"Expected {label}")
+    return numbers
+
+
+def _bbox_polygon(min_lon, min_lat, max_lon, max_lat):
+    bbox = Polygon.from_bbox((min_lon, min_lat, max_lon, max_lat))
+    bbox.srid = 4326
+    return bbox
+
+
+def parse_bbox(value):
+    """'minLon,minLat,maxLon,maxLat' -> Polygon (SRID 4326)."""
+    min_lon, min_lat, max_lon, max_lat = _floats(value, 4, 'minLon,minLat,maxLon,maxLat')
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValidationError("Invalid bbox")
+    return _bbox_polygon(min_lon, min_lat, max_lon, max_lat)
+
+
+def parse_point(value):
+    """'lat,lon' -> Point (SRID 4326)."""
+    lat, lon = _floats(value, 2, 'lat,lon')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValidationError("Invalid coordinates")
+    return Point(lon, lat, srid=4326)
+
+
+def radius_envelope(point, radius_m):
+    """Bounding box around point that contains every location within radius_m (index prefilter)."""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(min(abs(point.y) + dlat, 89.9)))
+    dlon = min(radius_m / (METERS_PER_DEGREE_LAT * cos_lat), 180)
+    return _bbox_polygon(
+        max(point.x - dlon, -180), max(point.y - dlat, -90),
+        min(point.x + dlon, 180), min(point.y + dlat, 90),
+    )
+
+
+class SpatialFilterMixin(django_filters.FilterSet):
+    """
+    ?bbox=minLon,minLat,maxLon,maxLat and ?near=lat,lon&radius_m=<meters> on the stage tracks.
+    Subclasses set the lookup paths of the GiST-indexed Stage.track_envelope and of the
+    track LineString (StageTrack.geometry).
+    """
+    track_envelope_field = None
+    track_geometry_field = None
+
+    bbox = django_filters.CharFilter(method='filter_bbox', validators=[parse_bbox], label="Bounding Box (minLon,minLat,maxLon,maxLat)")
+    near = django_filters.CharFilter(method='filter_near', validators=[parse_point], label="Near (lat,lon)")
+    radius_m = django_filters.NumberFilter(method='filter_radius', min_value=0, max_value=MAX_NEAR_RADIUS_M, label="Radius for near (m)")
+
+    def filter_bbox(self, queryset, name, value):
+        return queryset.filter(**{f'{self.track_envelope_field}__bboverlaps': parse_bbox(value)}).distinct()
+
+    def filter_near(self, queryset, name, value):
+        point = parse_point(value)
+        radius = self.form.cleaned_data.get('radius_m')
+        radius = float(radius) if radius is not None else 1000
+        # The envelope overlap uses the GiST index; the exact spheroid distance only runs on its hits
+        return queryset.filter(**{
+            f'{self.track_envelope_field}__bboverlaps': radius_envelope(point, radius),
+            f'{self.track_geometry_field}__distance_lte': (point, D(m=radius)),
+        }).distinct()
+
+    def filter_radius(self, queryset, name, value):
+        # Only a parameter of ?near=
+        return queryset
+
+
+class TripFilter(SpatialFilterMixin):
+    track_envelope_field = 'stages__track_envelope'
+    track_geometry_field = 'stages__packed_track__geometry'
+
     search = django_filters.CharFilter(method='filter_by_search', label="Text Search")
     from_date = django_filters.DateFilter(field_name='start_date', lookup_expr='gte', label='Start Date From')
     to_date = django_filters.DateFilter(field_name='end_date', lookup_expr='lte', label='End Date To')
@@ -48,7 +134,8 @@ class TripFilter(django_filters.FilterSet):
         fields = ['search', 'participants', 'from_date', 'to_date', 'activity_type', 'is_creator',
                  'surf_spot', 'surfboard_type', 'wave_height_min', 'wave_height_max',
                  'wave_quality_min', 'wave_quality_max', 'water_temp_min', 'water_temp_max', 'tide_stage', 'country_code',
-                 'distance_min', 'distance_max', 'elevation_min', 'elevation_max', 'duration_min', 'duration_max']
+                 'distance_min', 'distance_max', 'elevation_min', 'elevation_max', 'duration_min', 'duration_max',
+                 'bbox', 'near', 'radius_m']
 
     def filter_by_search(self, queryset, name, value):
         return queryset.filter(
@@ -110,4 +197,15 @@ class TripFilter(django_filters.FilterSet):
         return queryset.filter(
             models.Q(stages__manual_duration__lte=duration_hours) |
             models.Q(stages__manual_duration__isnull=True, stages__calculated_duration__lte=duration_hours)
-        ).distinct()
\ No newline at end of file
+        ).distinct()
+
+
+class StageFilter(SpatialFilterMixin):
+    track_envelope_field = 'track_envelope'
+    track_geometry_field = 'packed_track__geometry'
+
+    activity_type = django_filters.ChoiceFilter(choices=Stage.ACTIVITY_CHOICES, label="Activity Type")
+
+    class Meta:
+        model = Stage
+        fields = ['trip', 'activity_type', 'bbox', 'near', 'radius_m']
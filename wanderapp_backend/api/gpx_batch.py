@@ -0,0 +1,138 @@
+# api/gpx_batch.py
+"""
+Metrik-Vorschau für mehrere Tracks in einem Request (``POST /api/calculate-gpx/batch/``).
+
+GPX-Parsing und Metriken laufen parallel in einem Prozess-Pool. Die Worker werden mit ``spawn``
+gestartet (kein Fork des Webprozesses samt DB-Verbindungen und Threads) und einmal pro Prozess
+per ``django.setup()`` initialisiert; der Pool bleibt für weitere Requests bestehen.
+"""
+import io
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+
+from .gpx_import import GPXImportError, parse_gpx
+from .serializers import TrackPointCreateSerializer
+from .track_metrics import stage_metric_fields
+from .track_storage import PackedTrack
+
+MAX_BATCH_TRACKS = 50
+MAX_ZIP_UNCOMPRESSED_BYTES = 200 * 1024 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    pass
+
+
+def preview_metrics(track):
+    """Response fields of the metrics preview (calculate-gpx) for a PackedTrack."""
+    fields = stage_metric_fields(track.metrics())
+    duration = fields['calculated_duration']
+    total_seconds = int(duration.total_seconds()) if duration else None
+    return {
+        'length': fields['calculated_length_km'],
+        'elevationGain': fields['calculated_elevation_gain'],
+        'elevationLoss': fields['calculated_elevation_loss'],
+        'duration': total_seconds,
+        'durationFormatted': f"{total_seconds // 3600:02d}:{total_seconds % 3600 // 60:02d}" if total_seconds else '',
+        'segmentCount': len(track.segment_starts) + 1,
+    }
+
+
+def _track_preview(name, kind, payload):
+    """Runs in a pool worker: parses one track and returns its preview (or an error)."""
+    if kind == 'error':
+        return {'name': name, 'error': payload}
+    try:
+        track = parse_gpx(io.BytesIO(payload)) if kind == 'gpx' else PackedTrack(*payload[:4], segment_starts=payload[4])
+        if not len(track):
+            raise GPXImportError("No track points provided")
+        return {'name': name, 'pointCount': len(track), **preview_metrics(track)}
+    except (GPXImportError, ValueError, KeyError, TypeError) as e:
+        return {'name': name, 'error': str(e)}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'GPX_BATCH_WORKERS', None),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+    return _pool
+
+
+def zip_items(uploaded_zip):
+    """``(name, 'gpx', bytes)`` items for the .gpx members of an uploaded zip file."""
+    try:
+        archive = zipfile.ZipFile(uploaded_zip)
+    except zipfile.BadZipFile:
+        raise BatchError("Invalid zip file")
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith('.gpx') and '__MACOSX' not in info.filename
+    ]
+    if sum(info.file_size for info in members) > MAX_ZIP_UNCOMPRESSED_BYTES:
+        raise BatchError("Zip file too large")
+    return [(info.filename.rsplit('/', 1)[-1], 'gpx', archive.read(info)) for info in sorted(members, key=lambda i: i.filename)]
+
+
+def _first_error(errors):
+    """Readable summary of TrackPointCreateSerializer(many=True) errors."""
+    if isinstance(errors, dict):  # Not a list, or an empty one
+        return '; '.join(str(message) for messages in errors.values() for message in messages)
+    index, error = next((i, e) for i, e in enumerate(errors) if e)
+    return f"Point {index + 1}: " + '; '.join(f"{field}: {' '.join(map(str, messages))}" for field, messages in error.items())
+
+
+def points_item(name, points):
+    """
+    ``(name, 'points', columns)`` item for a track_points list, validated like calculate-gpx.
+    Invalid points give a ``(name, 'error', message)`` item, reported for that track only.
+    """
+    serializer = TrackPointCreateSerializer(data=points, many=True, allow_empty=False)
+    if not serializer.is_valid():
+        return name, 'error', f"No valid track points provided ({_first_error(serializer.errors)})"
+    track = PackedTrack.from_points(serializer.validated_data)
+    return name, 'points', (track.lon, track.lat, track.ele, track.time, track.segment_starts)
+
+
+def json_items(tracks):
+    """Items for the JSON body ``{"tracks": [{"name": ..., "track_points": [...]}, ...]}``."""
+    if not isinstance(tracks, list):
+        raise BatchError("'tracks' must be a list")
+    items = []
+    for i, track in enumerate(tracks):
+        name = f'Track {i + 1}'
+        if not isinstance(track, dict):
+            items.append((name, 'error', "Track must be an object with 'track_points'"))
+            continue
+        items.append(points_item(str(track.get('name') or name), track.get('track_points')))
+    return items
+
+
+def batch_previews(items):
+    """
+    Metrics previews for ``(name, kind, payload)`` items, computed concurrently in the process pool.
+    Results keep the order of ``items``; invalid tracks get an ``error`` instead of metrics.
+    """
+    if not items:
+        raise BatchError("No tracks provided")
+    if len(items) > MAX_BATCH_TRACKS:
+        raise BatchError(f"At most {MAX_BATCH_TRACKS} tracks per request")
+    if len(items) == 1:
+        # Not worth a round trip to the pool
+        return [_track_preview(*items[0])]
+    pool = _get_pool()
+    # Items that already failed validation are answered here
+    futures = [None if item[1] == 'error' else pool.submit(_track_preview, *item) for item in items]
+    return [_track_preview(*item) if future is None else future.result() for item, future in zip(items, futures)]
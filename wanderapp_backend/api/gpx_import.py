@@ -0,0 +1,78 @@
+# api/gpx_import.py
+"""
+Streaming GPX-Parser für Uploads.
+
+Die Datei wird mit ``iterparse`` Element für Element gelesen; jeder Trackpunkt landet direkt in
+kompakten ``array('d')``-Spalten und wird danach aus dem XML-Baum entfernt. Speicherbedarf wächst
+nur mit 32 Byte pro Punkt, nicht mit der Grösse des XML-Dokuments.
+"""
+from array import array
+from datetime import datetime, timezone as dt_timezone
+from xml.etree.ElementTree import ParseError, iterparse
+
+from .track_storage import PackedTrack
+
+POINT_TAGS = {'trkpt', 'rtept'}
+SEGMENT_TAGS = {'trkseg', 'rte'}  # Every track segment and every route is a segment of its own
+
+
+class GPXImportError(ValueError):
+    pass
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_time(text):
+    value = datetime.fromisoformat(text.strip())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value.timestamp()
+
+
+def parse_gpx(source):
+    """
+    Parses the track points (``trkpt``, or ``rtept`` for route-only files) of a GPX file
+    or file-like object into a PackedTrack. Segment boundaries of all ``trk``/``trkseg`` (and
+    ``rte``) elements are kept as segment starts. Raises GPXImportError for invalid files.
+    """
+    lon, lat, ele, time = array('d'), array('d'), array('d'), array('d')
+    segment_starts = []
+    nan = float('nan')
+    stack = []
+    try:
+        for event, elem in iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if lon and _local_name(elem.tag) in SEGMENT_TAGS and segment_starts[-1:] != [len(lon)]:
+                    segment_starts.append(len(lon))
+                continue
+            stack.pop()
+            if _local_name(elem.tag) not in POINT_TAGS:
+                continue
+
+            point_ele = point_time = nan
+            for child in elem:
+                name = _local_name(child.tag)
+                if name == 'ele' and child.text and child.text.strip():
+                    point_ele = float(child.text)
+                elif name == 'time' and child.text and child.text.strip():
+                    point_time = _parse_time(child.text)
+            lat.append(float(elem.attrib['lat']))
+            lon.append(float(elem.attrib['lon']))
+            ele.append(point_ele)
+            time.append(point_time)
+
+            # Detach the processed point so the tree never grows with the file
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+    except ParseError as e:
+        raise GPXImportError(f"Invalid GPX file: {e}")
+    except (KeyError, ValueError) as e:
+        raise GPXImportError(f"Invalid track point: {e}")
+
+    if not lon:
+        raise GPXImportError("GPX file contains no track points")
+    return PackedTrack(lon, lat, ele, time, segment_starts=segment_starts)
@@ -1,76 +1,338 @@
 # api/image_processing.py
-from PIL import Image, ImageOps, ImageCms
+"""
+Foto-Normalisierung und Derivate.
+
+Die Pillow-Arbeit (render_photo) ist eine reine Funktion von Bytes zu Bytes und läuft für mehrere
+Fotos parallel in einem Prozess-Pool (``spawn``, wie api.gpx_batch); Datenbank- und Storage-Zugriffe
+bleiben im aufrufenden Prozess. Ein Speicherbudget begrenzt, wie viele dekodierte Bilder gleichzeitig
+in den Workern liegen.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from io import BytesIO
+
+import django
+from django.conf import settings
 from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, ImageCms, features
+
 from .models import Photo
-import os
 
-def process_and_save_photo(uploaded_file, stage, user):
-    original_filename = uploaded_file.name
+# EXIF-Orientierungen, bei denen Breite und Höhe nach dem Drehen vertauscht sind
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Largest first: each derivative is resized from the previous one
+DERIVATIVES = {
+    "display": (1280, 1280),
+    "thumbnail": (640, 640),
+}
+
+# Encoder and options per file extension of the derivatives
+FORMATS = {
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", {"quality": 85, "method": 6}),
+}
+# AVIF nur, wenn Pillow mit libavif gebaut ist (nur für die Varianten auf Abruf, api.photo_variants)
+if features.check("avif"):
+    FORMATS["avif"] = ("AVIF", {"quality": 60, "speed": 6})
 
-    # Bild laden
-    img = Image.open(uploaded_file)
+# Decoded RGBA-sized buffers alive at once while rendering (decoded, transposed/converted, derivative copy)
+WORKING_COPIES = 3
 
-    # EXIF-orientiert physisch drehen
-    img = ImageOps.exif_transpose(img)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _oriented_size(img):
+    """Size of the image after exif_transpose(), read from the header without decoding the pixels."""
+    width, height = img.size
+    if img.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def store_uploaded_photo(uploaded_file, stage, user):
+    """
+    Creates the Photo row for an upload right away. The original is stored without metadata (EXIF/GPS,
+    XMP), since it is served publicly before the background job runs: JPEGs only lose their metadata
+    segments, other formats are re-encoded as JPEG here. The derivatives are left to
+    generate_derivatives() (processing_status PENDING).
+    """
+    data = uploaded_file.read()
+    base, _ext = os.path.splitext(os.path.basename(uploaded_file.name))
+    width, height, files = render_photo(data, base, derivatives=False)
+    filename, content = files.get("original", (os.path.basename(uploaded_file.name), data))
+
+    photo = Photo(stage=stage, creator=user, processing_status='PENDING')
+    photo.original.save(filename, ContentFile(content), save=False)
+    # ImageField liest die Masse beim Speichern aus der Datei, also ohne EXIF-Drehung
+    photo.original_width, photo.original_height = width, height
+    photo.save()
+    return photo
 
-    # Farbraum auf sRGB normalisieren (falls Profil vorhanden)
+
+def _fit(size, box):
+    """Size of an image of ``size`` after Image.thumbnail(box): fitted into ``box``, never enlarged."""
+    width, height = size
+    if width <= box[0] and height <= box[1]:
+        return width, height
+    scale = min(box[0] / width, box[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _keeps_encoded_original(img):
+    """
+    Plain RGB/grayscale JPEGs keep their encoded bytes as ``original`` (see _strip_jpeg_metadata())
+    and are only ever decoded at reduced scale; everything else is decoded once and re-encoded.
+    """
+    return img.format == "JPEG" and img.mode in ("RGB", "L")
+
+
+def _exif_orientation_segment(orientation):
+    """APP1 segment holding nothing but the EXIF orientation tag."""
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    payload = exif.tobytes()
+    return b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+def _strip_jpeg_metadata(data, orientation=1):
+    """
+    JPEG bytes without APP1-APP15 and COM segments (EXIF incl. GPS, XMP, ...); image data untouched.
+    The ICC profile (APP2 ``ICC_PROFILE``) is kept, the EXIF orientation is re-added on its own so
+    that browsers still display the image upright.
+    """
+    out = [data[:2]]
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            break
+        marker = data[i + 1]
+        if marker == 0xFF:  # Fill byte
+            i += 1
+            continue
+        if marker == 0xDA:  # Start of scan: the rest is image data
+            break
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        segment = data[i:i + 2 + length]
+        if marker == 0xE2 and segment[4:16] == b"ICC_PROFILE\x00":
+            out.append(segment)
+        elif not (0xE1 <= marker <= 0xEF or marker == 0xFE):
+            out.append(segment)
+            if marker == 0xE0 and orientation != 1:
+                # Nach JFIF (APP0), das laut Spezifikation das erste Segment bleibt
+                out.append(_exif_orientation_segment(orientation))
+                orientation = 1
+        i += 2 + length
+    if orientation != 1:
+        out.insert(1, _exif_orientation_segment(orientation))
+    out.append(data[i:])
+    return b"".join(out)
+
+
+def _to_srgb(img):
+    """Converts an image with an embedded ICC profile to sRGB; returns it unchanged if that fails."""
     icc = img.info.get("icc_profile")
-    if icc:
-        try:
-            srgb = ImageCms.createProfile("sRGB")
-            src = ImageCms.ImageCmsProfile(BytesIO(icc))
-            img = ImageCms.profileToProfile(img, src, srgb, outputMode="RGB")
-            icc = None  # Profil nach Konvertierung meist nicht mehr nötig
-        except Exception:
-            pass
+    if not icc:
+        return img
+    try:
+        srgb = ImageCms.createProfile("sRGB")
+        src = ImageCms.ImageCmsProfile(BytesIO(icc))
+        return ImageCms.profileToProfile(img, src, srgb, outputMode="RGB")
+    except Exception:
+        return img
 
+
+def _decode(img, box=None):
+    """
+    Decodes an opened image EXIF-rotated, in sRGB and as RGB/L. With ``box``, JPEGs are decoded in
+    draft mode at the smallest DCT scale that still covers ``box`` (after rotation).
+    """
+    if box is not None and img.format == "JPEG":
+        # Draft-Grösse gilt vor der Drehung
+        raw_box = box[::-1] if img.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS else box
+        img.draft(img.mode, _fit(img.size, raw_box))
+    img = _to_srgb(ImageOps.exif_transpose(img))
     if img.mode not in ("RGB", "L"):
         img = img.convert("RGB")
+    return img
 
-    # Korrekte Dimensionen (nach Rotation!)
-    correct_width, correct_height = img.size
-
-    # Photo-Objekt anlegen
-    photo = Photo.objects.create(
-        stage=stage,
-        creator=user,
-        original_width=correct_width,
-        original_height=correct_height,
-    )
-
-    base, _ext = os.path.splitext(original_filename)
-    # 1) "Original" als normalisierte JPEG-Version speichern (keine EXIF-Orientierung mehr)
-    buf_norm = BytesIO()
-    img.save(
-        buf_norm,
-        format="JPEG",
-        quality=90,
-        optimize=True,
-        progressive=True,
-        icc_profile=icc if icc else None
-    )
-    photo.original.save(f"{base}.jpg", ContentFile(buf_norm.getvalue()), save=False)
-
-    # 2) Derivate
-    DERIVATIVES = {
-        "display": (1280, 1280),
-        "thumbnail": (640, 640),
-    }
-
-    for name, size in DERIVATIVES.items():
-        im2 = img.copy()
-        im2.thumbnail(size, Image.Resampling.LANCZOS)
-
-        # JPEG
-        b_jpg = BytesIO()
-        im2.save(b_jpg, format="JPEG", quality=85, optimize=True, progressive=True)
-        getattr(photo, name).save(f"{base}_{name}.jpg", ContentFile(b_jpg.getvalue()), save=False)
-
-        # WebP
-        b_webp = BytesIO()
-        im2.save(b_webp, format="WEBP", quality=85, method=6)
-        getattr(photo, f"{name}_webp").save(f"{base}_{name}.webp", ContentFile(b_webp.getvalue()), save=False)
 
-    photo.save()
+def _resize(img, size):
+    if img.size == size:
+        return img
+    # reducing_gap wie bei Image.thumbnail(): ganzzahlige Vorverkleinerung (reduce) vor dem LANCZOS-Filter
+    return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+
+def _encode(img, fmt):
+    format, options = FORMATS[fmt]
+    buf = BytesIO()
+    img.save(buf, format=format, **options)
+    return buf.getvalue()
+
+
+def render_photo(data, base, derivatives=True):
+    """
+    Normalizes an image (EXIF rotation, sRGB, JPEG) and encodes the display/thumbnail derivatives
+    as JPEG and WebP (unless ``derivatives`` is False). Pure bytes-in/bytes-out, so it can run in a
+    pool worker. Returns ``(width, height, {field: (filename, bytes)})``; ``original`` is missing if
+    the input is already a clean JPEG.
+
+    Full-resolution pixels are touched at most once: JPEGs keep their encoded bytes as ``original``
+    (metadata stripped, orientation and ICC profile kept) and are decoded in draft mode at the
+    smallest DCT scale that still covers ``display``; rotation and color conversion then run on that
+    reduced image. Other formats are decoded once for a normalized JPEG original. ``display`` is
+    reduced from the decoded image, ``thumbnail`` from ``display``.
+    """
+    img = Image.open(BytesIO(data))
+    width, height = _oriented_size(img)
+    files = {}
+
+    if _keeps_encoded_original(img):
+        # 1) Original unverändert übernehmen, nur Metadaten (EXIF/GPS, XMP) entfernen; schon beim
+        # Upload bereinigte Originale bleiben, wie sie sind
+        original = _strip_jpeg_metadata(data, img.getexif().get(0x0112, 1))
+        if original != data:
+            files["original"] = (f"{base}.jpg", original)
+        if not derivatives:
+            return width, height, files
+        img = _decode(img, DERIVATIVES["display"])
+    else:
+        img = _decode(img)
+        # 1) "Original" als normalisierte JPEG-Version (keine EXIF-Orientierung mehr)
+        buf_norm = BytesIO()
+        img.save(buf_norm, format="JPEG", quality=90, optimize=True, progressive=True)
+        files["original"] = (f"{base}.jpg", buf_norm.getvalue())
+        # Korrekte Dimensionen (nach Rotation!)
+        width, height = img.size
+        if not derivatives:
+            return width, height, files
+
+    # 2) Derivate als Kaskade: jede Stufe wird aus der vorherigen verkleinert
+    source = img
+    for name, box in DERIVATIVES.items():
+        source = _resize(source, _fit((width, height), box))
+        files[name] = (f"{base}_{name}.jpg", _encode(source, "jpg"))
+        files[f"{name}_webp"] = (f"{base}_{name}.webp", _encode(source, "webp"))
+
+    return width, height, files
+
+
+def render_variant(data, box, fmt):
+    """
+    Encodes a single derivative of an image, fitted into ``box``, as ``fmt`` (a FORMATS key).
+    Used for the on-demand variants of api.photo_variants; works on processed and raw uploads alike.
+    """
+    img = Image.open(BytesIO(data))
+    size = _fit(_oriented_size(img), box)
+    return _encode(_resize(_decode(img, box), size), fmt)
+
+
+def _read_original(photo):
+    with photo.original.open('rb') as f:
+        data = f.read()
+    base, _ext = os.path.splitext(os.path.basename(photo.original.name))
+    return data, base
+
+
+def _save_rendered(photo, rendered):
+    """Writes the rendered files to storage and replaces the uploaded original (runs in the parent)."""
+    width, height, files = rendered
+    uploaded_name = photo.original.name
+    for field, (filename, content) in files.items():
+        getattr(photo, field).save(filename, ContentFile(content), save=False)
+    photo.original_width, photo.original_height = width, height
+    # Ein noch nicht bereinigtes Original wird durch das normalisierte JPEG ersetzt
+    if uploaded_name != photo.original.name:
+        photo.original.storage.delete(uploaded_name)
     return photo
+
+
+def _eager_derivatives():
+    # Ohne eager Derivate entstehen display/thumbnail nur noch auf Abruf (api.photo_variants)
+    return getattr(settings, 'PHOTO_EAGER_DERIVATIVES', True)
+
+
+def generate_derivatives(photo):
+    """Normalizes the stored original and generates the derivatives of one photo in this process."""
+    data, base = _read_original(photo)
+    return _save_rendered(photo, render_photo(data, base, _eager_derivatives()))
+
+
+def _memory_estimate(data, derivatives=True):
+    """Bytes the worker needs for an image: WORKING_COPIES RGBA buffers of its decoded size."""
+    with Image.open(BytesIO(data)) as img:
+        if _keeps_encoded_original(img):
+            if not derivatives:
+                return 0
+            img.draft(img.mode, _fit(img.size, DERIVATIVES["display"]))
+        width, height = img.size
+    return width * height * 4 * WORKING_COPIES
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'PHOTO_PROCESS_WORKERS', None),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+    return _pool
+
+
+def process_photos(photos):
+    """
+    Generates the derivatives of several photos: decoding and encoding run concurrently in the process
+    pool, storage writes happen here as results come in. At most PHOTO_PROCESS_MEMORY_MB of estimated
+    decoded image memory is in flight (a single larger image still runs alone).
+    Returns ``[(photo, error)]`` in input order, ``error`` being None on success.
+    """
+    if len(photos) < 2 or getattr(settings, 'PHOTO_PROCESS_WORKERS', None) == 0:
+        # Not worth a round trip to the pool
+        results = []
+        for photo in photos:
+            try:
+                results.append((generate_derivatives(photo), None))
+            except Exception as e:
+                results.append((photo, e))
+        return results
+
+    budget = getattr(settings, 'PHOTO_PROCESS_MEMORY_MB', 1024) * 1024 * 1024
+    derivatives = _eager_derivatives()
+    pool = _get_pool()
+    errors = {}
+    pending = {}  # future -> (photo, estimated bytes)
+    in_flight = 0
+
+    def collect(done):
+        nonlocal in_flight
+        for future in done:
+            photo, estimate = pending.pop(future)
+            in_flight -= estimate
+            try:
+                _save_rendered(photo, future.result())
+            except Exception as e:
+                errors[photo.pk] = e
+
+    for photo in photos:
+        try:
+            data, base = _read_original(photo)
+            estimate = _memory_estimate(data, derivatives)
+        except Exception as e:
+            errors[photo.pk] = e
+            continue
+        while pending and in_flight + estimate > budget:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending[pool.submit(render_photo, data, base, derivatives)] = (photo, estimate)
+        in_flight += estimate
+        del data
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        collect(done)
+    return [(photo, errors.get(photo.pk)) for photo in photos]
@@ -0,0 +1,131 @@
+# api/live.py
+"""
+Live-Track-Push (Server-Sent Events) für Etappen und Trips.
+
+Neue Punkte aus ``POST /api/stages/{id}/track/append/`` werden an die Gruppen ``stage:<id>`` und
+``trip:<id>`` veröffentlicht; jeder offene Stream hängt mit einer asyncio-Queue an seiner Gruppe.
+Der Channel Layer ist austauschbar (``settings.LIVE_CHANNEL_LAYER``): der Standard verteilt nur
+innerhalb eines Prozesses, d.h. alle Zuschauer einer Etappe müssen am selben ASGI-Worker hängen.
+"""
+import asyncio
+import json
+import threading
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+KEEPALIVE_SECONDS = 15
+
+
+class InProcessChannelLayer:
+    """
+    Group fan-out to the asyncio queues of the current process. ``publish`` may be called from
+    any thread (sync DRF views run in a thread pool under ASGI); delivery happens on each
+    subscriber's event loop. Slow subscribers lose their oldest messages instead of growing.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, group):
+        """New queue receiving the messages of ``group``; must be called inside the event loop."""
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            self._groups.setdefault(group, {})[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, group, queue):
+        with self._lock:
+            subscribers = self._groups.get(group, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._groups.pop(group, None)
+
+    def publish(self, group, message):
+        # One thread-safe wakeup per event loop, not per subscriber
+        by_loop = {}
+        with self._lock:
+            for queue, loop in self._groups.get(group, {}).items():
+                by_loop.setdefault(loop, []).append(queue)
+        for loop, queues in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._deliver, queues, message)
+            except RuntimeError:
+                # Event loop already closed (worker shutting down)
+                for queue in queues:
+                    self.unsubscribe(group, queue)
+
+    def subscriber_count(self, group):
+        with self._lock:
+            return len(self._groups.get(group, {}))
+
+    @staticmethod
+    def _deliver(queues, message):
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+@lru_cache(maxsize=None)
+def get_channel_layer():
+    return import_string(getattr(settings, 'LIVE_CHANNEL_LAYER', 'api.live.InProcessChannelLayer'))()
+
+
+def stage_group(stage_id):
+    return f'stage:{stage_id}'
+
+
+def trip_group(trip_id):
+    return f'trip:{trip_id}'
+
+
+def publish_track_update(stage, batch, state):
+    """Publishes appended points and the new stage totals to the stage and trip streams."""
+    ele = np.where(np.isnan(batch.ele), None, batch.ele)
+    time = np.where(np.isnan(batch.time), None, batch.time)
+    # Encoded once and shared by every subscriber
+    message = 'event: track\ndata: ' + json.dumps({
+        'stage': stage.id,
+        'trip': stage.trip_id,
+        'point_count': state['track_point_count'],
+        'points': [list(point) for point in zip(batch.lon.tolist(), batch.lat.tolist(), ele.tolist(), time.tolist())],
+        'calculated_length_km': stage.calculated_length_km,
+        'calculated_elevation_gain': stage.calculated_elevation_gain,
+        'calculated_elevation_loss': stage.calculated_elevation_loss,
+        'calculated_duration': stage.calculated_duration.total_seconds() if stage.calculated_duration else None,
+        'calculated_moving_time': stage.calculated_moving_time.total_seconds() if stage.calculated_moving_time else None,
+        'calculated_avg_speed_kmh': stage.calculated_avg_speed_kmh,
+    }) + '\n\n'
+    layer = get_channel_layer()
+    layer.publish(stage_group(stage.id), message)
+    layer.publish(trip_group(stage.trip_id), message)
+
+
+async def event_stream(group, max_seconds=None):
+    """
+    Async SSE generator for a StreamingHttpResponse. Ends after ``max_seconds`` so that streams of
+    disconnected clients are released; the client reconnects (``retry``) transparently.
+    """
+    if max_seconds is None:
+        max_seconds = getattr(settings, 'LIVE_STREAM_MAX_SECONDS', 300)
+    layer = get_channel_layer()
+    queue = layer.subscribe(group)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_seconds
+    try:
+        yield 'retry: 2000\n\n'
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                yield await asyncio.wait_for(queue.get(), timeout=min(KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+    finally:
+        layer.unsubscribe(group, queue)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Stage
+from api.track_storage import load_track, update_stage_geometry
+
+
+class Command(BaseCommand):
+    help = "Fills Stage.track_envelope/track_start/track_end from the stored stage tracks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', type=int, action='append', dest='stage_ids',
+                            help="Only backfill the given stage id (repeatable)")
+        parser.add_argument('--force', action='store_true',
+                            help="Recompute stages that already have an envelope")
+
+    def handle(self, *args, **options):
+        stages = Stage.objects.select_related('packed_track').order_by('pk')
+        if options['stage_ids']:
+            stages = stages.filter(pk__in=options['stage_ids'])
+        if not options['force']:
+            stages = stages.filter(track_envelope__isnull=True)
+
+        updated_count = 0
+        for stage in stages.iterator(chunk_size=100):
+            track = load_track(stage)
+            if track is None or not len(track):
+                continue
+            update_stage_geometry(stage, track)
+            updated_count += 1
+            self.stdout.write(f"Stage {stage.pk}: {len(track)} points")
+
+        self.stdout.write(self.style.SUCCESS(f"Updated track geometry of {updated_count} stage(s)"))
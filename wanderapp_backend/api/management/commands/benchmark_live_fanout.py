@@ -0,0 +1,79 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.live import InProcessChannelLayer
+
+GROUP = 'stage:benchmark'
+END = 'event: end\n\n'
+
+
+def _event(size):
+    """SSE message of about ``size`` bytes, shaped like publish_track_update() output."""
+    point = [8.123456, 46.123456, 1523.4, 1700000000.0]
+    payload = {'stage': 1, 'trip': 1, 'point_count': 1000, 'points': [point]}
+    message = 'event: track\ndata: ' + json.dumps(payload) + '\n\n'
+    while len(message) < size:
+        payload['points'].append(point)
+        message = 'event: track\ndata: ' + json.dumps(payload) + '\n\n'
+    return message
+
+
+def _publish(layer, message, events, rate):
+    """Publisher thread (like a sync DRF view): ``events`` messages at ``rate`` per second; returns seconds per publish."""
+    spent = 0.0
+    start = time.perf_counter()
+    for i in range(events):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        before = time.perf_counter()
+        layer.publish(GROUP, message)
+        spent += time.perf_counter() - before
+    layer.publish(GROUP, END)
+    return spent / events
+
+
+async def _viewer(queue):
+    received = 0
+    while (await queue.get()) is not END:
+        received += 1
+    return received
+
+
+async def _run(viewers, events, rate, message, queue_size):
+    layer = InProcessChannelLayer(queue_size)
+    queues = [layer.subscribe(GROUP) for _ in range(viewers)]
+    start = time.perf_counter()
+    publish_seconds, *received = await asyncio.gather(
+        asyncio.to_thread(_publish, layer, message, events, rate), *(_viewer(queue) for queue in queues),
+    )
+    return time.perf_counter() - start, publish_seconds, received
+
+
+class Command(BaseCommand):
+    help = "Measures fan-out of live track events (api.live.InProcessChannelLayer) to many SSE viewers on one event loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viewers', type=int, nargs='+', default=[1000, 2000])
+        parser.add_argument('--events', type=int, default=100)
+        parser.add_argument('--rate', type=float, default=50.0, help="Published events per second")
+        parser.add_argument('--message-bytes', type=int, default=600)
+        parser.add_argument('--queue-size', type=int, default=100, help="Per-viewer queue; full queues drop the oldest event")
+
+    def handle(self, *args, **options):
+        message = _event(options['message_bytes'])
+        events = options['events']
+        for viewers in options['viewers']:
+            seconds, publish_seconds, received = asyncio.run(
+                _run(viewers, events, options['rate'], message, options['queue_size'])
+            )
+            delivered = sum(received)
+            self.stdout.write(
+                f"{viewers} viewers x {events} events ({len(message)} bytes, {options['rate']:g}/s): "
+                f"{delivered}/{viewers * events} delivered, {min(received)} min per viewer, "
+                f"{seconds:.2f} s, {delivered / seconds:,.0f} deliveries/s, "
+                f"publish {publish_seconds * 1000:.2f} ms per event"
+            )
@@ -0,0 +1,70 @@
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+import django
+import numpy as np
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from api.image_processing import render_photo
+
+
+def _synthetic_photo(megapixels, orientation, format='JPEG'):
+    """Camera-like image (smooth gradients plus sensor noise) with the given EXIF orientation."""
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack((x / width, y / height, (x + y) / (width + height)), axis=-1) * 200
+    pixels = np.clip(base + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buf = BytesIO()
+    if format == 'JPEG':
+        Image.fromarray(pixels).save(buf, format=format, quality=92, exif=exif)
+    else:
+        Image.fromarray(pixels).save(buf, format=format, exif=exif)
+    return buf.getvalue()
+
+
+def _measure(data):
+    """Runs in a fresh worker process: render time and peak RSS (MB) of one render_photo() call."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    render_photo(data, 'benchmark')
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return seconds, before / 1024, peak / 1024
+
+
+class Command(BaseCommand):
+    help = "Measures time and peak RSS of the photo pipeline (api.image_processing.render_photo) per synthetic photo"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=float, default=24.0)
+        parser.add_argument('--runs', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # JPEGs take the draft-decode path (rotation on the reduced image), PNGs are decoded in full
+        cases = (
+            ('upright JPEG (draft decode)', 1, 'JPEG'),
+            ('rotated JPEG (draft decode)', 6, 'JPEG'),
+            ('rotated PNG (full decode)', 6, 'PNG'),
+        )
+        context = multiprocessing.get_context('spawn')
+        for label, orientation, format in cases:
+            data = _synthetic_photo(options['megapixels'], orientation, format)
+            results = []
+            for _ in range(options['runs']):
+                # One process per run so that ru_maxrss is the peak of this single photo
+                with context.Pool(1, initializer=django.setup) as pool:
+                    results.append(pool.apply(_measure, (data,)))
+            seconds = sorted(r[0] for r in results)[len(results) // 2]
+            baseline = min(r[1] for r in results)
+            peak = max(r[2] for r in results)
+            self.stdout.write(
+                f"{label}: {options['megapixels']:g} MP, {len(data) / 1e6:.1f} MB file, "
+                f"median {seconds:.2f} s, peak RSS {peak:.0f} MB (+{peak - baseline:.0f} MB over idle worker)"
+            )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Stage, StageTrack, TrackPoint
+from api.track_storage import load_legacy_track, save_track, write_packed_track
+
+
+class Command(BaseCommand):
+    help = "Migrates legacy TrackPoint rows of existing stages into packed StageTrack rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', type=int, action='append', dest='stage_ids',
+                            help="Only migrate the given stage id (repeatable)")
+        parser.add_argument('--force', action='store_true',
+                            help="Re-pack stages that already have a packed track")
+        parser.add_argument('--keep-points', action='store_true',
+                            help="Keep the legacy TrackPoint rows after packing")
+
+    def handle(self, *args, **options):
+        stages = Stage.objects.filter(
+            pk__in=TrackPoint.objects.values('stage_id').distinct()
+        ).order_by('pk')
+        if options['stage_ids']:
+            stages = stages.filter(pk__in=options['stage_ids'])
+        if not options['force']:
+            stages = stages.exclude(pk__in=StageTrack.objects.values('stage_id'))
+
+        packed_count = 0
+        for stage in stages.iterator(chunk_size=100):
+            track = load_legacy_track(stage)
+            if options['keep_points']:
+                write_packed_track(stage, track)
+            else:
+                save_track(stage, track)
+            packed_count += 1
+            self.stdout.write(f"Stage {stage.pk}: packed {len(track)} points")
+
+        self.stdout.write(self.style.SUCCESS(f"Packed {packed_count} stage track(s)"))
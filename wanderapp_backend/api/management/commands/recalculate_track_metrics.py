@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Stage
+from api.track_metrics import stage_metric_fields
+from api.track_sections import replace_track_sections
+from api.track_storage import load_track
+
+
+class Command(BaseCommand):
+    help = "Recomputes the calculated_* metrics (incl. moving time and speeds) and the splits/climbs of stages from their stored tracks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', type=int, action='append', dest='stage_ids',
+                            help="Only recalculate the given stage id (repeatable)")
+        parser.add_argument('--force', action='store_true',
+                            help="Recalculate stages that already have a moving time")
+
+    def handle(self, *args, **options):
+        stages = Stage.objects.select_related('packed_track').order_by('pk')
+        if options['stage_ids']:
+            stages = stages.filter(pk__in=options['stage_ids'])
+        if not options['force']:
+            stages = stages.filter(calculated_moving_time__isnull=True)
+
+        updated_count = 0
+        for stage in stages.iterator(chunk_size=100):
+            track = load_track(stage)
+            if track is None or not len(track):
+                continue
+            fields = stage_metric_fields(track.metrics())
+            Stage.objects.filter(pk=stage.pk).update(**fields)
+            replace_track_sections(stage, track)
+            updated_count += 1
+            self.stdout.write(f"Stage {stage.pk}: {len(track)} points")
+
+        self.stdout.write(self.style.SUCCESS(f"Recalculated metrics of {updated_count} stage(s)"))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.photo_jobs import run_pending_photos
+
+
+class Command(BaseCommand):
+    help = "Generates the derivatives of uploaded photos; runs until stopped unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Process the currently pending photos and exit")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Seconds to wait between polls when nothing is pending")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_photos()
+            if count:
+                self.stdout.write(f"Processed {count} photo(s)")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.track_jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = "Processes queued track jobs (GPX/track point ingestion); runs until stopped unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Process the currently runnable jobs and exit")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Seconds to wait between polls when the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending_jobs()
+            if count:
+                self.stdout.write(f"Processed {count} track job(s)")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:12
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_stage_water_quality'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StageTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('coordinates', models.BinaryField(help_text='Interleaved lon/lat pairs (float64, little-endian)')),
+                ('elevations', models.BinaryField(help_text='Elevation in meters per point (float64, NaN = unknown)')),
+                ('timestamps', models.BinaryField(help_text='Unix timestamp in seconds per point (float64, NaN = unknown)')),
+                ('geometry', django.contrib.gis.db.models.fields.LineStringField(blank=True, null=True, srid=4326)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('stage', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='packed_track', to='api.stage')),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import numpy as np
+
+# Frozen copy of api.track_metrics.cumulative_distances at the time of this migration (single-segment
+# tracks only); the backfill must not change when the application code does.
+EARTH_RADIUS_M = 6371000
+
+
+def cumulative_distances(lon, lat):
+    distances = np.zeros(len(lon), dtype=np.float64)
+    if len(lon) > 1:
+        lon = np.radians(lon)
+        lat = np.radians(lat)
+        dlon = np.diff(lon)
+        dlat = np.diff(lat)
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+        np.cumsum(2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))), out=distances[1:])
+    return distances
+
+
+def populate_distances(apps, schema_editor):
+    """
+    Precompute cumulative distances for tracks packed before the distances column existed.
+    """
+    StageTrack = apps.get_model('api', 'StageTrack')
+
+    for packed in StageTrack.objects.filter(point_count__gt=0).iterator(chunk_size=50):
+        coords = np.frombuffer(packed.coordinates, dtype='<f8').reshape(-1, 2)
+        distances = cumulative_distances(coords[:, 0], coords[:, 1])
+        StageTrack.objects.filter(pk=packed.pk).update(distances=distances.astype('<f8').tobytes())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_stagetrack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagetrack',
+            name='distances',
+            field=models.BinaryField(default=b'', help_text='Cumulative distance in meters per point (float64), precomputed at ingest'),
+        ),
+        migrations.RunPython(populate_distances, migrations.RunPython.noop),
+    ]
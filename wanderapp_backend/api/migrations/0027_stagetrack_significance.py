@@ -0,0 +1,69 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import numpy as np
+
+# Frozen copy of api.track_simplification.douglas_peucker_significance at the time of this migration;
+# the backfill must not change when the application code does.
+EARTH_RADIUS_M = 6371000
+
+
+def _segment_distances(x, y, start, end):
+    px, py = x[start + 1:end], y[start + 1:end]
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return np.hypot(px - x[start], py - y[start])
+    t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length_sq, 0.0, 1.0)
+    return np.hypot(px - (x[start] + t * dx), py - (y[start] + t * dy))
+
+
+def douglas_peucker_significance(lon, lat):
+    n = len(lon)
+    significance = np.full(n, np.inf, dtype=np.float64)
+    if n < 3:
+        return significance
+    coef = np.cos(np.radians(np.mean(lat)))
+    x, y = np.radians(lon) * coef * EARTH_RADIUS_M, np.radians(lat) * EARTH_RADIUS_M
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, parent = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(x, y, start, end)
+        split = int(np.argmax(distances))
+        value = min(float(distances[split]), parent)
+        split += start + 1
+        significance[split] = value
+        stack.append((start, split, value))
+        stack.append((split, end, value))
+    return significance
+
+
+def populate_significance(apps, schema_editor):
+    """
+    Precompute the Douglas-Peucker pyramid for tracks packed before the significance column existed.
+    """
+    StageTrack = apps.get_model('api', 'StageTrack')
+
+    for packed in StageTrack.objects.filter(point_count__gt=0).iterator(chunk_size=50):
+        coords = np.frombuffer(packed.coordinates, dtype='<f8').reshape(-1, 2)
+        significance = douglas_peucker_significance(coords[:, 0], coords[:, 1])
+        StageTrack.objects.filter(pk=packed.pk).update(significance=significance.astype('<f8').tobytes())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_stagetrack_distances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagetrack',
+            name='significance',
+            field=models.BinaryField(default=b'', help_text='Douglas-Peucker tolerance in meters up to which each point is kept (float64)'),
+        ),
+        migrations.RunPython(populate_significance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:05
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_stagetrack_significance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stage',
+            name='track_end',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, help_text='Last point of the track', null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='track_envelope',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, help_text='Bounding box of the track', null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='track_start',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, help_text='First point of the track', null=True, srid=4326),
+        ),
+    ]
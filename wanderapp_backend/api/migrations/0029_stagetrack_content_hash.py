@@ -0,0 +1,41 @@
+# Generated by Django 4.2.23 on 2026-10-18 15:10
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def track_content_hash(coordinates, elevations, timestamps):
+    """Frozen copy of api.track_storage.track_content_hash at the time of this migration."""
+    digest = hashlib.sha256()
+    for blob in (coordinates, elevations, timestamps):
+        digest.update(bytes(blob))
+    return digest.hexdigest()
+
+
+def populate_content_hash(apps, schema_editor):
+    """
+    Hash the tracks packed before the content_hash column existed, so the first re-upload
+    of an unchanged track is already skipped.
+    """
+    StageTrack = apps.get_model('api', 'StageTrack')
+
+    for packed in StageTrack.objects.filter(point_count__gt=0).iterator(chunk_size=50):
+        content_hash = track_content_hash(packed.coordinates, packed.elevations, packed.timestamps)
+        StageTrack.objects.filter(pk=packed.pk).update(content_hash=content_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_stage_track_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagetrack',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of coordinates, elevations and timestamps; unchanged uploads are skipped', max_length=64),
+        ),
+        migrations.RunPython(populate_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0029_stagetrack_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagetrack',
+            name='metrics_state',
+            field=models.JSONField(blank=True, help_text='Running totals for live-tracking appends (api.track_metrics.update_running_metrics)', null=True),
+        ),
+    ]
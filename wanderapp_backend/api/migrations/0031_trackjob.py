@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_stagetrack_metrics_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('POINTS', 'Track points'), ('GPX', 'GPX file')], max_length=10)),
+                ('points', models.BinaryField(default=b'', help_text='lon, lat, ele, time columns (float64, little-endian) for POINTS jobs')),
+                ('gpx_file', models.FileField(blank=True, help_text='Uploaded file for GPX jobs', upload_to='track_jobs/')),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')], db_index=True, default='QUEUED', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Not picked up before this time (retry backoff)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_jobs', to='api.stage')),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
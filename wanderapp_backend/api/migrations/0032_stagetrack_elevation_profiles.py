@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_trackjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagetrack',
+            name='elevation_profiles',
+            field=models.JSONField(blank=True, help_text='LTTB-downsampled elevation profiles per resolution (api.track_profile), precomputed at ingest', null=True),
+        ),
+    ]
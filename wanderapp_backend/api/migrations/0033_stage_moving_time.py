@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_stagetrack_elevation_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stage',
+            name='calculated_moving_time',
+            field=models.DurationField(blank=True, help_text='Time in motion (> 1 km/h), pauses excluded', null=True),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='calculated_stopped_time',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='calculated_avg_speed_kmh',
+            field=models.FloatField(blank=True, help_text='Moving distance / moving time', null=True),
+        ),
+        migrations.AddField(
+            model_name='stage',
+            name='calculated_max_speed_kmh',
+            field=models.FloatField(blank=True, help_text='Highest speed averaged over 30 seconds', null=True),
+        ),
+    ]
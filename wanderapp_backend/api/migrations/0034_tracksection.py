@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_stage_moving_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('SPLIT', 'Kilometer split'), ('CLIMB', 'Climb'), ('DESCENT', 'Descent')], max_length=10)),
+                ('position', models.PositiveIntegerField(help_text='Order within the sections of the same kind')),
+                ('start_distance', models.FloatField(help_text='Meters from the track start')),
+                ('end_distance', models.FloatField(help_text='Meters from the track start')),
+                ('elevation_gain', models.FloatField(default=0)),
+                ('elevation_loss', models.FloatField(default=0)),
+                ('average_grade', models.FloatField(default=0, help_text='Net elevation change / distance in percent')),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='track_sections', to='api.stage')),
+            ],
+            options={
+                'ordering': ['stage', 'kind', 'position'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0034_tracksection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagetrack',
+            name='segment_starts',
+            field=models.BinaryField(default=b'', help_text='Start index of each GPX segment after the first (uint32, little-endian); empty = one segment'),
+        ),
+        migrations.AddField(
+            model_name='stagetrack',
+            name='segment_metrics',
+            field=models.JSONField(blank=True, help_text='Metrics per GPX segment for multi-segment tracks, precomputed at ingest', null=True),
+        ),
+        migrations.AddField(
+            model_name='trackjob',
+            name='segment_starts',
+            field=models.BinaryField(default=b'', help_text='Segment starts of the points (uint32, little-endian) for POINTS jobs'),
+        ),
+    ]
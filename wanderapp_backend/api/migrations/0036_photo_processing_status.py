@@ -0,0 +1,39 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_track_segments'),
+    ]
+
+    operations = [
+        # Existing photos already have their derivatives
+        migrations.AddField(
+            model_name='photo',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('DONE', 'Done'), ('FAILED', 'Failed')], db_index=True, default='DONE', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('DONE', 'Done'), ('FAILED', 'Failed')], db_index=True, default='PENDING', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='processing_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='processing_error',
+            field=models.TextField(blank=True),
+        ),
+    ]
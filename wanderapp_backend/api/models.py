@@ -1,6 +1,7 @@
 from django.contrib.gis.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django_countries.fields import CountryField
 
 class User(AbstractUser):
@@ -160,6 +161,10 @@ class Stage(models.Model):
     calculated_elevation_gain = models.IntegerField(null=True, blank=True)
     calculated_elevation_loss = models.IntegerField(null=True, blank=True)
     calculated_duration = models.DurationField(null=True, blank=True)
+    calculated_moving_time = models.DurationField(null=True, blank=True, help_text="Time in motion (> 1 km/h), pauses excluded")
+    calculated_stopped_time = models.DurationField(null=True, blank=True)
+    calculated_avg_speed_kmh = models.FloatField(null=True, blank=True, help_text="Moving distance / moving time")
+    calculated_max_speed_kmh = models.FloatField(null=True, blank=True, help_text="Highest speed averaged over 30 seconds")
     external_link = models.URLField(max_length=500, blank=True)
     
     # Surf-specific fields (all optional for backwards compatibility)
@@ -224,6 +229,12 @@ class Stage(models.Model):
         help_text="Water quality classification for riverwaves"
     )
 
+    # Materialized track geometry (maintained by api.track_storage, GiST-indexed).
+    # The full LineString lives on StageTrack.geometry.
+    track_envelope = models.PolygonField(srid=4326, null=True, blank=True, help_text="Bounding box of the track")
+    track_start = models.PointField(srid=4326, null=True, blank=True, help_text="First point of the track")
+    track_end = models.PointField(srid=4326, null=True, blank=True, help_text="Last point of the track")
+
     def __str__(self): return f"{self.trip.name} - {self.name}"
 
 class TrackPoint(models.Model):
@@ -233,7 +244,102 @@ class TrackPoint(models.Model):
     timestamp = models.DateTimeField(null=True, blank=True)
     class Meta: ordering = ['timestamp']
 
+class StageTrack(models.Model):
+    """
+    Packed track of a stage: all GPS fixes stored as little-endian float64 arrays in a single row.
+    Replaces one TrackPoint row per fix; TrackPoint is only kept as optional legacy/detail source.
+    """
+    stage = models.OneToOneField(Stage, on_delete=models.CASCADE, related_name='packed_track')
+    point_count = models.PositiveIntegerField(default=0)
+    coordinates = models.BinaryField(help_text="Interleaved lon/lat pairs (float64, little-endian)")
+    elevations = models.BinaryField(help_text="Elevation in meters per point (float64, NaN = unknown)")
+    timestamps = models.BinaryField(help_text="Unix timestamp in seconds per point (float64, NaN = unknown)")
+    distances = models.BinaryField(default=b'', help_text="Cumulative distance in meters per point (float64), precomputed at ingest")
+    significance = models.BinaryField(default=b'', help_text="Douglas-Peucker tolerance in meters up to which each point is kept (float64)")
+    segment_starts = models.BinaryField(default=b'', help_text="Start index of each GPX segment after the first (uint32, little-endian); empty = one segment")
+    segment_metrics = models.JSONField(null=True, blank=True, help_text="Metrics per GPX segment for multi-segment tracks, precomputed at ingest")
+    geometry = models.LineStringField(srid=4326, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 of coordinates, elevations and timestamps; unchanged uploads are skipped")
+    metrics_state = models.JSONField(null=True, blank=True, help_text="Running totals for live-tracking appends (api.track_metrics.update_running_metrics)")
+    elevation_profiles = models.JSONField(null=True, blank=True, help_text="LTTB-downsampled elevation profiles per resolution (api.track_profile), precomputed at ingest")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self): return f"Track {self.stage_id} ({self.point_count} points)"
+
+class TrackSection(models.Model):
+    """
+    Derived section of a stage track (api.track_sections): a kilometer split or a significant
+    climb/descent. Rebuilt whenever the track is written, so stage pages and dashboard records
+    never have to read track points.
+    """
+    SPLIT = 'SPLIT'
+    CLIMB = 'CLIMB'
+    DESCENT = 'DESCENT'
+    KIND_CHOICES = [
+        (SPLIT, 'Kilometer split'),
+        (CLIMB, 'Climb'),
+        (DESCENT, 'Descent'),
+    ]
+
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='track_sections')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    position = models.PositiveIntegerField(help_text="Order within the sections of the same kind")
+    start_distance = models.FloatField(help_text="Meters from the track start")
+    end_distance = models.FloatField(help_text="Meters from the track start")
+    elevation_gain = models.FloatField(default=0)
+    elevation_loss = models.FloatField(default=0)
+    average_grade = models.FloatField(default=0, help_text="Net elevation change / distance in percent")
+    duration = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['stage', 'kind', 'position']
+
+    def __str__(self): return f"{self.get_kind_display()} {self.position} of stage {self.stage_id}"
+
+class TrackJob(models.Model):
+    """
+    Queued track ingestion (packing, simplification pyramid, metrics) of a stage, processed
+    outside the request by api.track_jobs. Retries are safe: storing the same track twice is a no-op.
+    """
+    SOURCE_CHOICES = [
+        ('POINTS', 'Track points'),
+        ('GPX', 'GPX file'),
+    ]
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+        ('CANCELLED', 'Cancelled'),
+    ]
+
+    stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='track_jobs')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    points = models.BinaryField(default=b'', help_text="lon, lat, ele, time columns (float64, little-endian) for POINTS jobs")
+    segment_starts = models.BinaryField(default=b'', help_text="Segment starts of the points (uint32, little-endian) for POINTS jobs")
+    gpx_file = models.FileField(upload_to='track_jobs/', blank=True, help_text="Uploaded file for GPX jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='QUEUED', db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not picked up before this time (retry backoff)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self): return f"TrackJob {self.pk} for stage {self.stage_id} ({self.status})"
+
 class Photo(models.Model):
+    PROCESSING_STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('PROCESSING', 'Processing'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE, related_name='photos')
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='photos')
     caption = models.CharField(max_length=255, blank=True, help_text="Optionale Bildbeschreibung")
@@ -249,6 +355,12 @@ class Photo(models.Model):
     thumbnail_webp = models.ImageField(upload_to='photos/thumbnails_webp/')
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    # Derivate entstehen im Hintergrund (api.photo_jobs); bis DONE gibt es nur das hochgeladene Original
+    processing_status = models.CharField(max_length=10, choices=PROCESSING_STATUS_CHOICES, default='PENDING', db_index=True)
+    processing_attempts = models.PositiveIntegerField(default=0)
+    processing_started_at = models.DateTimeField(null=True, blank=True)
+    processing_error = models.TextField(blank=True)
+
     class Meta:
         ordering = ['uploaded_at']
 
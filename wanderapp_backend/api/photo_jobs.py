@@ -0,0 +1,184 @@
+# api/photo_jobs.py
+"""
+Hintergrund-Verarbeitung hochgeladener Fotos.
+
+Der Upload speichert nur das von Metadaten (EXIF/GPS) bereinigte Original und legt die Photo-Zeile
+an (``processing_status`` PENDING); die Derivate (api.image_processing.generate_derivatives) entstehen
+danach im Worker. Wie bei den Track-Jobs ist die Datenbank die Queue (``SELECT ... FOR UPDATE SKIP LOCKED``
+auf den Photo-Zeilen selbst).
+
+Worker:
+* im Webprozess: ein kleiner Thread-Pool (``PHOTO_WORKERS``, 0 = aus) startet die Verarbeitung nach dem Commit.
+  Ab dem ersten Foto fragt ein Poller-Thread alle ``PHOTO_POLL_INTERVAL`` Sekunden nach, damit Wiederholungen
+  und liegengebliebene PROCESSING-Fotos auch ohne run_photo_jobs verarbeitet werden
+* separat: ``python manage.py run_photo_jobs`` (mehrere Instanzen können parallel laufen); verarbeitet
+  Stapel von ``PHOTO_BATCH_SIZE`` Fotos parallel im Prozess-Pool von api.image_processing
+* synchron im Upload-Request, wenn ``PHOTO_UPLOAD_SYNC`` gesetzt ist
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import UnidentifiedImageError
+
+from .image_processing import process_photos
+from .photo_variants import delete_variants
+from .models import Photo
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+FILE_FIELDS = ('original', 'display', 'thumbnail', 'display_webp', 'thumbnail_webp')
+STALE_PROCESSING_AFTER = timedelta(minutes=15)  # PROCESSING photos of crashed workers are picked up again
+
+_executor = None
+_executor_lock = threading.Lock()
+_poll_pending = threading.Event()  # A poll is queued or running in the executor
+
+
+def process_uploaded_photos(photos):
+    """
+    Hands freshly stored photos to the workers once the transaction commits. With PHOTO_UPLOAD_SYNC
+    they are processed right here instead (in parallel, see run_photos()). Returns the photos.
+    """
+    if getattr(settings, 'PHOTO_UPLOAD_SYNC', False):
+        claimed = {photo.pk: photo for photo in claim_photos([photo.pk for photo in photos], limit=len(photos))}
+        run_photos(list(claimed.values()))
+        return [claimed.get(photo.pk, photo) for photo in photos]
+    ids = [photo.pk for photo in photos]
+    transaction.on_commit(lambda: [_kick_worker(photo_id) for photo_id in ids])
+    return photos
+
+
+def fail_exhausted_photos(now=None):
+    """
+    Marks stale PROCESSING photos without attempts left as FAILED: their worker died during the
+    last attempt, and claim_photos() never picks them up again. Returns the count.
+    """
+    now = now or timezone.now()
+    return Photo.objects.filter(
+        processing_status='PROCESSING', processing_attempts__gte=MAX_ATTEMPTS,
+        processing_started_at__lte=now - STALE_PROCESSING_AFTER,
+    ).update(processing_status='FAILED', processing_error='Worker stopped during the last attempt')
+
+
+def claim_photos(photo_ids=None, limit=1):
+    """Marks up to ``limit`` pending photos (of ``photo_ids``) as PROCESSING and returns them."""
+    now = timezone.now()
+    fail_exhausted_photos(now)
+    with transaction.atomic():
+        photos = Photo.objects.select_for_update(skip_locked=True).filter(
+            processing_status__in=('PENDING', 'PROCESSING'), processing_attempts__lt=MAX_ATTEMPTS,
+        ).exclude(processing_status='PROCESSING', processing_started_at__gt=now - STALE_PROCESSING_AFTER)
+        if photo_ids is not None:
+            photos = photos.filter(pk__in=photo_ids)
+        photos = list(photos.order_by('uploaded_at', 'pk')[:limit])
+        for photo in photos:
+            photo.processing_status = 'PROCESSING'
+            photo.processing_attempts += 1
+            photo.processing_started_at = now
+            photo.save(update_fields=['processing_status', 'processing_attempts', 'processing_started_at'])
+    return photos
+
+
+def run_photos(photos):
+    """
+    Generates the derivatives of claimed photos (in parallel for several, see process_photos()).
+    Failures go back to PENDING until MAX_ATTEMPTS is reached. Returns the number of finished photos.
+    """
+    finished = 0
+    for photo, error in process_photos(photos):
+        if error is not None:
+            logger.error("Photo %s processing failed (attempt %s): %s", photo.pk, photo.processing_attempts, error)
+            photo.processing_error = str(error)
+            # A file Pillow cannot read stays unreadable; only unexpected errors (storage, memory) are retried
+            if isinstance(error, UnidentifiedImageError) or photo.processing_attempts >= MAX_ATTEMPTS:
+                photo.processing_status = 'FAILED'
+            else:
+                photo.processing_status = 'PENDING'
+            Photo.objects.filter(pk=photo.pk).update(
+                processing_status=photo.processing_status, processing_error=photo.processing_error,
+            )
+            continue
+
+        # Only the processing fields are written: caption edits made in the meantime are kept
+        photo.processing_status, photo.processing_error = 'DONE', ''
+        updated = Photo.objects.filter(pk=photo.pk).update(
+            processing_status='DONE', processing_error='',
+            original_width=photo.original_width, original_height=photo.original_height,
+            **{field: getattr(photo, field).name for field in FILE_FIELDS},
+        )
+        if not updated:
+            # Deleted while processing: drop the files written in the meantime
+            for field in FILE_FIELDS:
+                getattr(photo, field).delete(save=False)
+            delete_variants(photo.pk)
+            continue
+        finished += 1
+    return finished
+
+
+def run_pending_photos(limit=None):
+    """Processes pending photos in batches until none is left (or ``limit`` were processed). Returns the count."""
+    batch_size = getattr(settings, 'PHOTO_BATCH_SIZE', 8)
+    count = 0
+    while limit is None or count < limit:
+        photos = claim_photos(limit=batch_size if limit is None else min(batch_size, limit - count))
+        if not photos:
+            break
+        run_photos(photos)
+        count += len(photos)
+    return count
+
+
+def _run_in_thread(photo_id):
+    close_old_connections()
+    try:
+        photos = claim_photos([photo_id])
+        if photos:
+            run_photos(photos)
+    finally:
+        close_old_connections()
+
+
+def _poll_once():
+    close_old_connections()
+    try:
+        run_pending_photos()
+    except Exception:
+        logger.exception("Polling photo jobs failed")
+    finally:
+        _poll_pending.clear()
+        close_old_connections()
+
+
+def _poll_loop(interval):
+    while True:
+        time.sleep(interval)
+        # Retries and stale PROCESSING photos; skipped while the previous poll is still busy
+        if not _poll_pending.is_set():
+            _poll_pending.set()
+            _executor.submit(_poll_once)
+
+
+def _kick_worker(photo_id):
+    """
+    Starts the processing in the in-process pool (if enabled); otherwise run_photo_jobs picks it up.
+    The first call also starts the poller that picks up retries and stale photos later on.
+    """
+    global _executor
+    workers = getattr(settings, 'PHOTO_WORKERS', 2)
+    if not workers:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo-jobs')
+            interval = getattr(settings, 'PHOTO_POLL_INTERVAL', 30)
+            if interval:
+                threading.Thread(target=_poll_loop, args=(interval,), name='photo-jobs-poller', daemon=True).start()
+    _executor.submit(_run_in_thread, photo_id)
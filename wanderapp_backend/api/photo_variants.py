@@ -0,0 +1,258 @@
+# api/photo_variants.py
+"""
+Foto-Varianten auf Abruf unter ``/media/photos/{id}/{variant}.{fmt}``.
+
+Eine Variante wird beim ersten Abruf aus dem Original gerendert (api.image_processing.render_variant)
+und als Datei im Cache-Verzeichnis abgelegt; spätere Abrufe liefern die Datei direkt aus. Der Pfad im
+Cache entspricht der URL unter MEDIA_ROOT, ein vorgeschalteter Webserver kann Treffer also selbst
+ausliefern und nur Fehlschläge an Django weiterreichen.
+
+Der Cache ist auf ``PHOTO_VARIANT_CACHE_MB`` begrenzt. Die mtime einer Datei dient als Zeitpunkt des
+letzten Zugriffs; beim Überschreiten werden die am längsten nicht genutzten Varianten gelöscht (LRU).
+Neue Varianten brauchen nur einen Eintrag in VARIANTS, die Fotobibliothek muss nicht neu verarbeitet werden.
+
+Für ``srcset`` gibt es zusätzlich die Breitenstufen ``w{breite}`` (``PHOTO_VARIANT_WIDTHS``). Ohne Endung
+(``/media/photos/{id}/{variant}``) wählt der Server das Format anhand des ``Accept``-Headers: AVIF (falls
+Pillow es kann und ``PHOTO_AVIF`` gesetzt ist), sonst WebP, sonst JPEG.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+
+from .image_processing import DERIVATIVES, FORMATS, render_variant
+
+logger = logging.getLogger(__name__)
+
+# Name -> Box, in die die Variante eingepasst wird (nie vergrössert); dieselben Namen wie die eager Derivate
+VARIANTS = dict(DERIVATIVES)
+
+# Keys of image_processing.FORMATS
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+# Formats tried for negotiated URLs, best first; JPEG is the fallback every browser accepts
+NEGOTIATED_FORMATS = ("avif", "webp")
+
+# Width variants are only limited in width (65535 = JPEG maximum)
+MAX_HEIGHT = 65535
+
+# srcset entry used as plain ``src``
+FALLBACK_WIDTH = 640
+
+# Eviction stops once the cache is below this share of PHOTO_VARIANT_CACHE_MB
+EVICT_TO = 0.9
+
+# Hits refresh the mtime at most this often, to avoid a metadata write per request
+TOUCH_INTERVAL = 60
+
+_cache_bytes = None  # Estimated cache size of this process; recounted on every eviction
+_cache_lock = threading.Lock()
+# Renders of the same variant in this process wait for each other instead of decoding twice
+_render_locks = [threading.Lock() for _ in range(64)]
+
+
+def cache_root():
+    return Path(getattr(settings, 'PHOTO_VARIANT_CACHE_DIR', None) or Path(settings.MEDIA_ROOT) / 'photos')
+
+
+def variant_path(photo_id, variant, fmt):
+    return cache_root() / str(photo_id) / f"{variant}.{fmt}"
+
+
+def variant_url(photo_id, variant, fmt):
+    return f"{settings.MEDIA_URL}photos/{photo_id}/{variant}.{fmt}"
+
+
+def variant_widths():
+    return tuple(getattr(settings, 'PHOTO_VARIANT_WIDTHS', (160, 320, 640, 1280, 2048)))
+
+
+def variant_box(variant):
+    """Box of a variant name (a VARIANTS key or ``w{width}`` of the width ladder); None if unknown."""
+    if variant in VARIANTS:
+        return VARIANTS[variant]
+    if variant.startswith("w") and variant[1:].isdigit() and int(variant[1:]) in variant_widths():
+        return int(variant[1:]), MAX_HEIGHT
+    return None
+
+
+def formats():
+    """File extensions variants are served in: jpg and webp, plus avif if Pillow supports it and it is enabled."""
+    return [fmt for fmt in CONTENT_TYPES if fmt in FORMATS and (fmt != "avif" or getattr(settings, 'PHOTO_AVIF', True))]
+
+
+def negotiate_format(accept):
+    """
+    Best available format for an ``Accept`` header. AVIF and WebP count only when listed explicitly
+    (``image/*`` and ``*/*`` are sent by browsers that cannot decode them too).
+    """
+    accepted = {}
+    for media_range in (accept or "").split(","):
+        media_type, *params = media_range.strip().split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_type.strip().lower()] = quality
+    available = formats()
+    for fmt in NEGOTIATED_FORMATS:
+        if fmt in available and accepted.get(CONTENT_TYPES[fmt], 0) > 0:
+            return fmt
+    return "jpg"
+
+
+def variant_urls(photo_id):
+    """``{variant: {fmt: url}}`` for the named variants (VARIANTS) of a photo."""
+    return {variant: {fmt: variant_url(photo_id, variant, fmt) for fmt in formats()} for variant in VARIANTS}
+
+
+def negotiated_url(photo_id, variant):
+    """URL without extension: the format is picked from the request's Accept header."""
+    return f"{settings.MEDIA_URL}photos/{photo_id}/{variant}"
+
+
+def photo_srcset(photo_id, original_width=None, absolute=str):
+    """
+    ``{'src': url, 'srcset': 'url 160w, ...'}`` over the width ladder, with negotiated URLs;
+    ``absolute`` maps them to absolute URLs (request.build_absolute_uri). Images are never enlarged:
+    the widths at or above the original's collapse into one entry with the original width.
+    """
+    entries = []
+    for width in variant_widths():
+        url = absolute(negotiated_url(photo_id, f"w{width}"))
+        if original_width and width >= original_width:
+            entries.append((url, original_width))
+            break
+        entries.append((url, width))
+    if not entries:
+        return None
+    src = next((url for url, width in entries if width >= FALLBACK_WIDTH), entries[-1][0])
+    return {'src': src, 'srcset': ", ".join(f"{url} {width}w" for url, width in entries)}
+
+
+def _touch(path):
+    """Marks a cache hit; returns False if the file is gone (evicted meanwhile)."""
+    try:
+        if time.time() - path.stat().st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _read_photo_original(photo):
+    try:
+        with photo.original.open('rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        # Die Verarbeitung hat das hochgeladene Original gerade durch das normalisierte ersetzt
+        photo.refresh_from_db(fields=['original'])
+        with photo.original.open('rb') as f:
+            return f.read()
+
+
+def get_variant(photo, variant, fmt):
+    """
+    Path of the cached variant file, rendered from the photo's original first if needed.
+    ``variant`` must be known to variant_box() and ``fmt`` one of formats().
+    """
+    path = variant_path(photo.pk, variant, fmt)
+    if _touch(path):
+        return path
+    with _render_locks[zlib.crc32(str(path).encode()) % len(_render_locks)]:
+        if _touch(path):
+            return path
+        content = render_variant(_read_photo_original(photo), variant_box(variant), fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomar ersetzen: parallele Leser sehen nie eine halb geschriebene Datei
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{variant}.{fmt}.")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    _account(len(content), path)
+    return path
+
+
+def _scan():
+    """All cached variant files as ``[(mtime, size, path)]``."""
+    files = []
+    root = cache_root()
+    if not root.is_dir():
+        return files
+    for photo_dir in root.iterdir():
+        if not photo_dir.name.isdigit() or not photo_dir.is_dir():
+            continue
+        for path in photo_dir.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def _account(added, written):
+    global _cache_bytes
+    limit = getattr(settings, 'PHOTO_VARIANT_CACHE_MB', 1024) * 1024 * 1024
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _mtime, size, _path in _scan())
+        else:
+            _cache_bytes += added
+        if _cache_bytes > limit:
+            _cache_bytes = evict(limit, keep=written)
+
+
+def evict(limit, keep=None):
+    """
+    Deletes the least recently used variants until the cache is below EVICT_TO * ``limit`` bytes,
+    never the file ``keep`` (the one about to be served). Counts the files on disk (other processes
+    write to the same cache) and returns the new size.
+    """
+    files = sorted(_scan(), key=lambda entry: entry[0])
+    total = sum(size for _mtime, size, _path in files)
+    target = limit * EVICT_TO
+    removed = 0
+    for _mtime, size, path in files:
+        if total <= target:
+            break
+        if path == keep:
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("Evicted %s photo variants, cache now %.1f MB", removed, total / 1024 / 1024)
+    return total
+
+
+def delete_variants(photo_id):
+    """Removes all cached variants of a photo (when the photo is deleted)."""
+    photo_dir = cache_root() / str(photo_id)
+    if not photo_dir.is_dir():
+        return
+    for path in photo_dir.iterdir():
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    try:
+        photo_dir.rmdir()
+    except OSError:
+        pass  # A variant was rendered again meanwhile
@@ -0,0 +1,22 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+from .track_binary import MEDIA_TYPE
+
+
+class TrackBinaryRenderer(BaseRenderer):
+    """
+    Renders a stage track in the binary layout of api.track_binary.
+    Selected via 'Accept: application/vnd.wanderapp.track', ?format=bin or the .bin suffix.
+    """
+    media_type = MEDIA_TYPE
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        # Error responses (404, 400, ...) still come back as JSON bodies
+        return json.dumps(data).encode('utf-8')
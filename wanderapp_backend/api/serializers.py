@@ -1,7 +1,10 @@
 from rest_framework import serializers
-from django.contrib.gis.geos import LineString, Point
-from .models import Trip, Stage, User, TrackPoint, Comment, Hut, Photo, Surfboard, SurfSpot
-from datetime import timedelta
+from .models import Trip, Stage, StageTrack, User, TrackSection, Comment, Hut, Photo, Surfboard, SurfSpot
+from .track_storage import PackedTrack, load_track
+from .track_jobs import enqueue_track, latest_job_status
+from .track_preview import load_preview_track
+from .photo_variants import photo_srcset, variant_urls
+from .track_simplification import resolve_tolerance
 
 # ===================================================================
 # HELPER SERIALIZERS (Your existing code, unchanged)
@@ -17,6 +20,7 @@ class TrackPointCreateSerializer(serializers.Serializer):
     lon = serializers.FloatField()
     ele = serializers.FloatField(required=False, allow_null=True)
     time = serializers.DateTimeField(required=False, allow_null=True)
+    segment = serializers.IntegerField(required=False, min_value=0, help_text="GPX segment index; a new segment starts where it changes")
 
 class CommentSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
@@ -32,15 +36,32 @@ class HutSerializer(serializers.ModelSerializer):
 
 class PhotoSerializer(serializers.ModelSerializer):
     creator = UserSerializer(read_only=True)
+    # On-demand derivatives: {variant: {fmt: url}}, see api.photo_variants
+    variants = serializers.SerializerMethodField()
+    # {'src', 'srcset'} over the width ladder; the media view picks AVIF/WebP/JPEG from the Accept header
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = Photo
         fields = [
             'id', 'caption', 'creator', 'uploaded_at',
             'original', 'original_width', 'original_height',
             'display', 'thumbnail',
-            'display_webp', 'thumbnail_webp'
+            'display_webp', 'thumbnail_webp', 'variants', 'srcset',
+            'processing_status', 'processing_error'
         ]
-        read_only_fields = ['creator']
+        read_only_fields = ['creator', 'processing_status', 'processing_error']
+
+    def get_variants(self, obj):
+        request = self.context.get('request')
+        urls = variant_urls(obj.pk)
+        if request is None:
+            return urls
+        return {variant: {fmt: request.build_absolute_uri(url) for fmt, url in formats.items()} for variant, formats in urls.items()}
+
+    def get_srcset(self, obj):
+        request = self.context.get('request')
+        return photo_srcset(obj.pk, obj.original_width, request.build_absolute_uri if request else str)
 
 class SurfboardSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
@@ -89,6 +110,11 @@ class PartnerStatSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'hike_count']
 
+class TrackSectionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TrackSection
+        fields = ['kind', 'position', 'start_distance', 'end_distance', 'elevation_gain', 'elevation_loss', 'average_grade', 'duration']
+
 
 # ===================================================================
 # COMPLEX SERIALIZERS (Your existing StageSerializer is preserved)
@@ -96,7 +122,11 @@ class PartnerStatSerializer(serializers.ModelSerializer):
 
 class StageSerializer(serializers.ModelSerializer):
     track = serializers.SerializerMethodField()
+    track_bounds = serializers.SerializerMethodField()
+    track_job = serializers.SerializerMethodField()
+    track_segments = serializers.SerializerMethodField()
     track_points = TrackPointCreateSerializer(many=True, write_only=True, required=False)
+    track_token = serializers.CharField(write_only=True, required=False, help_text="Token from calculate-gpx instead of track_points")
     comments = CommentSerializer(many=True, read_only=True)
     creator = UserSerializer(read_only=True)
     participants = UserSerializer(many=True, read_only=True)
@@ -104,6 +134,7 @@ class StageSerializer(serializers.ModelSerializer):
         many=True, write_only=True, queryset=User.objects.all(), source='participants', required=False
     )
     photos = PhotoSerializer(many=True, read_only=True)
+    track_sections = TrackSectionSerializer(many=True, read_only=True)  # Kilometer splits and climbs/descents
     surfboard = SurfboardSerializer(read_only=True)
     surfboard_id = serializers.PrimaryKeyRelatedField(
         write_only=True, queryset=Surfboard.objects.all(), source='surfboard', required=False, allow_null=True
@@ -120,7 +151,8 @@ class StageSerializer(serializers.ModelSerializer):
             'activity_type',
             'manual_duration', 'manual_length_km', 'manual_elevation_gain', 'manual_elevation_loss',
             'calculated_length_km', 'calculated_elevation_gain', 'calculated_elevation_loss', 'calculated_duration',
-            'external_link', 'track', 'track_points', 'comments', 'photos',
+            'calculated_moving_time', 'calculated_stopped_time', 'calculated_avg_speed_kmh', 'calculated_max_speed_kmh',
+            'external_link', 'track', 'track_bounds', 'track_job', 'track_segments', 'track_points', 'track_token', 'track_sections', 'comments', 'photos',
             # Surf-specific fields
             'surf_spot', 'surf_spot_obj', 'surf_spot_id', 'time_in_water', 'surfboard_used', 'surfboard', 'surfboard_id', 'wave_height', 'wave_quality',
             'water_temperature', 'waves_caught', 'tide_stage', 'tide_movement',
@@ -131,101 +163,74 @@ class StageSerializer(serializers.ModelSerializer):
         extra_kwargs = { 'trip': {'required': False} }
 
     def get_track(self, obj):
-        track_points = obj.track_points.order_by('timestamp').values('location', 'elevation')
-        if not track_points: return None
-
-        # Extract coordinates and elevations
-        coordinates = []
-        elevations = []
-        distances = [0]  # Start at 0 meters
-
-        cumulative_distance = 0
-        prev_point = None
-
-        for tp in track_points:
-            point = tp['location']
-            coordinates.append([point.x, point.y])
-            elevations.append(tp['elevation'] if tp['elevation'] is not None else None)
-
-            # Calculate cumulative distance using gpxpy for accuracy
-            if prev_point:
-                from math import radians, cos, sin, asin, sqrt
-                # Haversine formula for distance between two lat/lon points
-                lon1, lat1 = radians(prev_point.x), radians(prev_point.y)
-                lon2, lat2 = radians(point.x), radians(point.y)
-                dlon = lon2 - lon1
-                dlat = lat2 - lat1
-                a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-                c = 2 * asin(sqrt(a))
-                distance_meters = 6371000 * c  # Earth radius in meters
-                cumulative_distance += distance_meters
-                distances.append(round(cumulative_distance, 2))
-
-            prev_point = point
-
-        return {
-            'type': 'LineString',
-            'coordinates': coordinates,
-            'elevations': elevations,
-            'distances': distances
-        }
-
-    def _handle_gpx_data(self, stage, track_points_data):
-        stage.track_points.all().delete()
-        points_to_create = []
-        if track_points_data:
-            for point_data in track_points_data:
-                points_to_create.append(
-                    TrackPoint(
-                        stage=stage,
-                        location=Point(point_data['lon'], point_data['lat'], srid=4326),
-                        elevation=point_data.get('ele'),
-                        timestamp=point_data.get('time')
-                    )
-                )
-            if points_to_create:
-                TrackPoint.objects.bulk_create(points_to_create)
-            try:
-                import gpxpy
-                gpx = gpxpy.gpx.GPX()
-                gpx_track = gpxpy.gpx.GPXTrack()
-                gpx.tracks.append(gpx_track)
-                gpx_segment = gpxpy.gpx.GPXTrackSegment()
-                gpx_track.segments.append(gpx_segment)
-                for point_data in track_points_data:
-                    gpx_segment.points.append(gpxpy.gpx.GPXTrackPoint(
-                        latitude=point_data['lat'], longitude=point_data['lon'], elevation=point_data.get('ele')
-                    ))
-                stage.calculated_length_km = round(gpx.length_3d() / 1000, 2)
-                uphill, downhill = gpx.get_uphill_downhill()
-                stage.calculated_elevation_gain = round(uphill)
-                stage.calculated_elevation_loss = round(downhill)
-                duration_in_seconds = gpx.get_duration()
-                if duration_in_seconds:
-                    stage.calculated_duration = timedelta(seconds=duration_in_seconds)
-            except Exception:
-                stage.calculated_length_km, stage.calculated_elevation_gain, stage.calculated_elevation_loss, stage.calculated_duration = None, None, None, None
-        else:
-            stage.calculated_length_km, stage.calculated_elevation_gain, stage.calculated_elevation_loss, stage.calculated_duration = None, None, None, None
-        stage.save()
+        # Coordinates, elevations and cumulative distances are precomputed at ingest (StageTrack)
+        track = load_track(obj)
+        if track is None: return None
+        return track.to_payload(self.get_track_tolerance())
+
+    def get_track_bounds(self, obj):
+        # [minLon, minLat, maxLon, maxLat] from the materialized envelope, for map fit-bounds
+        return list(obj.track_envelope.extent) if obj.track_envelope else None
+
+    def get_track_segments(self, obj):
+        # Per-segment metrics of multi-segment GPX tracks (None for single-segment tracks)
+        try:
+            return obj.packed_track.segment_metrics
+        except StageTrack.DoesNotExist:
+            return None
+
+    def get_track_job(self, obj):
+        # Track ingestion runs in the background (api.track_jobs); QUEUED/RUNNING means 'track' is not updated yet
+        return latest_job_status(obj)
+
+    def get_track_tolerance(self):
+        """Simplification tolerance from ?lod=full|high|medium|low or ?tolerance=<meters>."""
+        request = self.context.get('request')
+        if request is None:
+            return None
+        try:
+            return resolve_tolerance(request.query_params.get('lod'), request.query_params.get('tolerance'))
+        except ValueError as e:
+            raise serializers.ValidationError({'lod': str(e)})
+
+    def validate_track_token(self, value):
+        # Resolved to the cached PackedTrack of the preview; expired tokens make the client resend the points
+        track = load_preview_track(self.context['request'].user, value)
+        if track is None:
+            raise serializers.ValidationError("Preview expired, please send track_points.")
+        return track
+
+    def _pop_track(self, validated_data):
+        """``(given, track)`` from track_token or track_points; an empty track_points list clears the track."""
+        track_points_data = validated_data.pop('track_points', None)
+        track = validated_data.pop('track_token', None)
+        if track is not None:
+            return True, track
+        if track_points_data is None:
+            return False, None
+        return True, PackedTrack.from_points(track_points_data) if track_points_data else None
+
+    def _handle_gpx_data(self, stage, track):
+        # Packing and metrics run as a background job; the request only stores the raw columns
+        enqueue_track(stage, track)
 
     def create(self, validated_data):
-        track_points_data = validated_data.pop('track_points', [])
+        _, track = self._pop_track(validated_data)
         participants_data = validated_data.pop('participants', [])
         stage = Stage.objects.create(**validated_data)
         if participants_data:
             stage.participants.set(participants_data)
-        self._handle_gpx_data(stage, track_points_data)
+        self._handle_gpx_data(stage, track)
         return stage
 
     def update(self, instance, validated_data):
-        track_points_data = validated_data.pop('track_points', None)
+        track_given, track = self._pop_track(validated_data)
         participants_data = validated_data.pop('participants', None)
         instance = super().update(instance, validated_data)
         if participants_data is not None:
             instance.participants.set(participants_data)
-        if track_points_data is not None:
-            self._handle_gpx_data(instance, track_points_data)
+        if track_given:
+            self._handle_gpx_data(instance, track)
         return instance
 
 class TripListSerializer(serializers.ModelSerializer):
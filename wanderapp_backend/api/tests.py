@@ -1,3 +1,784 @@
-from django.test import TestCase
+from datetime import datetime, timezone
+from pathlib import Path
 
-# Create your tests here.
+import gpxpy
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from .track_metrics import compute_track_metrics, cumulative_distances, running_metrics, update_running_metrics
+
+SAMPLE_GPX = Path(__file__).resolve().parent.parent / 'track.gpx'
+
+
+def _gpxpy_segment(lon, lat, ele, time):
+    """Builds the gpxpy object graph the serializer used before the vectorized engine."""
+    gpx = gpxpy.gpx.GPX()
+    gpx_track = gpxpy.gpx.GPXTrack()
+    gpx.tracks.append(gpx_track)
+    segment = gpxpy.gpx.GPXTrackSegment()
+    gpx_track.segments.append(segment)
+    for x, y, e, t in zip(lon, lat, ele, time):
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(
+            latitude=y, longitude=x,
+            elevation=None if np.isnan(e) else e,
+            time=None if np.isnan(t) else datetime.fromtimestamp(t, tz=timezone.utc),
+        ))
+    return gpx
+
+
+class TrackMetricsParityTests(SimpleTestCase):
+    """The NumPy metrics engine must reproduce the gpxpy numbers stages were calculated with."""
+
+    def assertMatchesGpxpy(self, lon, lat, ele, time):
+        metrics = compute_track_metrics(lon, lat, ele, time)
+        gpx = _gpxpy_segment(lon, lat, ele, time)
+        uphill, downhill = gpx.get_uphill_downhill()
+        moving = gpx.get_moving_data(raw=True)
+
+        self.assertAlmostEqual(metrics['length_2d'], gpx.length_2d(), places=3)
+        self.assertAlmostEqual(metrics['length_3d'], gpx.length_3d(), places=3)
+        self.assertAlmostEqual(metrics['uphill'], uphill, places=3)
+        self.assertAlmostEqual(metrics['downhill'], downhill, places=3)
+        self.assertEqual(metrics['duration'], gpx.get_duration())
+        self.assertAlmostEqual(metrics['moving_time'], moving.moving_time, places=3)
+        self.assertAlmostEqual(metrics['stopped_time'], moving.stopped_time, places=3)
+        self.assertAlmostEqual(metrics['moving_distance'], moving.moving_distance, places=3)
+        return metrics
+
+    def test_sample_gpx_file(self):
+        with open(SAMPLE_GPX) as f:
+            points = [p for track in gpxpy.parse(f).tracks for seg in track.segments for p in seg.points]
+        lon = np.array([p.longitude for p in points])
+        lat = np.array([p.latitude for p in points])
+        ele = np.array([np.nan if p.elevation is None else p.elevation for p in points])
+        time = np.array([np.nan if p.time is None else p.time.timestamp() for p in points])
+        metrics = self.assertMatchesGpxpy(lon, lat, ele, time)
+        self.assertGreater(metrics['length_3d'], 0)
+
+    def test_synthetic_track_with_pause_gaps_and_jump(self):
+        rng = np.random.default_rng(42)
+        n = 2000
+        lon = 8.0 + np.cumsum(rng.normal(0, 1e-4, n))
+        lat = 46.5 + np.cumsum(rng.normal(0, 1e-4, n))
+        lon[1500:] += 0.3  # Jump > 0.2° switches gpxpy to haversine
+        ele = 1500 + np.cumsum(rng.normal(0, 2, n))
+        ele[rng.choice(n, 100, replace=False)] = np.nan
+        time = 1.7e9 + np.arange(n) * 5.0
+        time[800:900] = time[800]  # Pause without time progress
+        time[1000:] += 3600
+        time[rng.choice(n, 50, replace=False)] = np.nan
+        time[0] = 1.7e9
+        time[-1] = 1.7e9 + n * 5 + 3600
+        self.assertMatchesGpxpy(lon, lat, ele, time)
+
+    def test_multi_segment_track_matches_gpxpy(self):
+        rng = np.random.default_rng(3)
+        n = 900
+        lon = 8.0 + np.cumsum(rng.normal(0, 1e-4, n))
+        lat = 46.5 + np.cumsum(rng.normal(0, 1e-4, n))
+        ele = 1500 + np.cumsum(rng.normal(0, 2, n))
+        time = 1.7e9 + np.arange(n) * 5.0
+        starts = [300, 650]
+        lon[300:] += 0.05  # Next day starts somewhere else
+        time[300:] += 86400
+        time[650:] += 86400
+
+        gpx = gpxpy.gpx.GPX()
+        gpx.tracks.append(gpxpy.gpx.GPXTrack())
+        for a, b in zip([0, *starts], [*starts, n]):
+            gpx.tracks[0].segments.append(_gpxpy_segment(lon[a:b], lat[a:b], ele[a:b], time[a:b]).tracks[0].segments[0])
+        metrics = compute_track_metrics(lon, lat, ele, time, starts)
+        uphill, downhill = gpx.get_uphill_downhill()
+        moving = gpx.get_moving_data(raw=True)
+
+        self.assertAlmostEqual(metrics['length_3d'], gpx.length_3d(), places=3)
+        self.assertAlmostEqual(metrics['uphill'], uphill, places=3)
+        self.assertAlmostEqual(metrics['downhill'], downhill, places=3)
+        self.assertEqual(metrics['duration'], gpx.get_duration())  # Nights between the days don't count
+        self.assertAlmostEqual(metrics['moving_time'], moving.moving_time, places=3)
+        self.assertAlmostEqual(metrics['moving_distance'], moving.moving_distance, places=3)
+
+        distances = cumulative_distances(lon, lat, starts)
+        self.assertEqual(distances[300], distances[299])
+        self.assertLess(distances[-1], cumulative_distances(lon, lat)[-1] - 3000)
+
+    def test_max_speed_ignores_single_gps_jump(self):
+        n = 600
+        lat = 46.5 + np.arange(n) * 1e-5  # ~1.1 m/s
+        lat[300] += 1e-3  # One fix 110 m off
+        lon = np.full(n, 8.0)
+        metrics = compute_track_metrics(lon, lat, None, 1.7e9 + np.arange(n, dtype=float))
+        self.assertLess(metrics['max_speed'], 10)
+        self.assertIsNone(compute_track_metrics(lon[:20], lat[:20], None, 1.7e9 + np.arange(20.0))['max_speed'])
+
+    def test_track_without_elevation_and_time(self):
+        lon = np.linspace(7.0, 7.1, 50)
+        lat = np.linspace(46.0, 46.05, 50)
+        metrics = compute_track_metrics(lon, lat)
+        gpx = _gpxpy_segment(lon, lat, np.full(50, np.nan), np.full(50, np.nan))
+        self.assertAlmostEqual(metrics['length_3d'], gpx.length_3d(), places=3)
+        self.assertEqual((metrics['uphill'], metrics['downhill']), (0.0, 0.0))
+        self.assertIsNone(metrics['duration'])
+
+
+class RunningMetricsTests(SimpleTestCase):
+    """Live-tracking appends must end up with the same totals as a full recomputation."""
+
+    def test_batched_appends_match_full_track(self):
+        rng = np.random.default_rng(7)
+        n = 497
+        lon = 8.0 + np.cumsum(rng.normal(0, 1e-4, n))
+        lat = 46.5 + np.cumsum(rng.normal(0, 1e-4, n))
+        ele = 1500 + np.cumsum(rng.normal(0, 2, n))
+        ele[rng.choice(n, 40, replace=False)] = np.nan
+        time = 1.7e9 + np.cumsum(rng.integers(0, 10, n)).astype(float)
+        time[rng.choice(n, 20, replace=False)] = np.nan
+
+        state, start = None, 0
+        for size in [1, 1, 2, 3] + [7] * 70:
+            state = update_running_metrics(state, lon[start:start + size], lat[start:start + size],
+                                           ele[start:start + size], time[start:start + size])
+            start += size
+        self.assertEqual(start, n)
+
+        expected = compute_track_metrics(lon, lat, ele, time)
+        for key, value in running_metrics(state).items():
+            self.assertAlmostEqual(value, expected[key], places=6, msg=key)
+
+    def test_empty_state(self):
+        self.assertIsNone(running_metrics(None))
+        self.assertIsNone(running_metrics(update_running_metrics(None, [], [])))
+
+
+class GPXImportTests(SimpleTestCase):
+
+    def test_streaming_parser_matches_gpxpy(self):
+        from .gpx_import import parse_gpx
+        with open(SAMPLE_GPX) as f:
+            points = [p for track in gpxpy.parse(f).tracks for seg in track.segments for p in seg.points]
+        track = parse_gpx(str(SAMPLE_GPX))
+
+        self.assertEqual(len(track), len(points))
+        np.testing.assert_array_equal(track.lon, [p.longitude for p in points])
+        np.testing.assert_array_equal(track.lat, [p.latitude for p in points])
+        np.testing.assert_array_equal(track.ele, [np.nan if p.elevation is None else p.elevation for p in points])
+        np.testing.assert_array_equal(track.time, [np.nan if p.time is None else p.time.timestamp() for p in points])
+
+    def test_invalid_gpx_is_rejected(self):
+        from io import BytesIO
+        from .gpx_import import GPXImportError, parse_gpx
+        with self.assertRaises(GPXImportError):
+            parse_gpx(BytesIO(b'<gpx><trk><trkseg><trkpt lat="46.0"></trkpt></trkseg></trk></gpx>'))
+        with self.assertRaises(GPXImportError):
+            parse_gpx(BytesIO(b'<gpx><trk>'))
+
+
+class TrackBinaryFormatTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        from .track_binary import HEADER, decode_track, encode_track
+        rng = np.random.default_rng(7)
+        n = 497
+        lon = 8.0 + np.cumsum(rng.normal(0, 1e-4, n))
+        lat = 46.5 + np.cumsum(rng.normal(0, 1e-4, n))
+        ele = 1500 + np.cumsum(rng.normal(0, 2, n))
+        ele[[3, 42]] = np.nan
+        distances = np.cumsum(rng.uniform(0, 10, n))
+
+        data = encode_track(lon, lat, ele, distances)
+        self.assertEqual(len(data), HEADER.size + 16 * n)
+        lon2, lat2, ele2, distances2, segment_starts = decode_track(data)
+        np.testing.assert_allclose(lon2, lon, rtol=1e-7)
+        np.testing.assert_allclose(lat2, lat, rtol=1e-7)
+        np.testing.assert_allclose(ele2, ele, rtol=1e-7)  # NaN positions must match as well
+        np.testing.assert_allclose(distances2, distances, rtol=1e-7)
+        self.assertEqual(len(segment_starts), 0)
+
+        data = encode_track(lon, lat, ele, distances, [100, 250])
+        self.assertEqual(len(data), HEADER.size + 16 * n + 8)
+        self.assertEqual(decode_track(data)[4].tolist(), [100, 250])
+
+    def test_rejects_foreign_data(self):
+        from .track_binary import decode_track, encode_track
+        with self.assertRaises(ValueError):
+            decode_track(b'XXXX' + encode_track([8.0], [46.0], [1.0], [0.0])[4:])
+        with self.assertRaises(ValueError):
+            decode_track(encode_track([8.0, 8.1], [46.0, 46.1], [1.0, 2.0], [0.0, 5.0])[:-4])
+
+
+class LttbTests(SimpleTestCase):
+    """Downsampled elevation profiles must keep the shape (endpoints, peaks) of the full profile."""
+
+    def test_keeps_endpoints_and_peak(self):
+        from .track_profile import lttb_indices
+        rng = np.random.default_rng(3)
+        n = 20000
+        x = np.cumsum(rng.uniform(0, 5, n))
+        y = 1000 + np.cumsum(rng.normal(0, 0.5, n))
+        y[12345] += 300  # Single-sample spike
+
+        indices = lttb_indices(x, y, 400)
+        self.assertEqual(len(indices), 400)
+        self.assertEqual((indices[0], indices[-1]), (0, n - 1))
+        self.assertTrue(np.all(np.diff(indices) > 0))
+        self.assertIn(12345, indices)
+
+    def test_short_series_is_unchanged(self):
+        from .track_profile import lttb_indices
+        np.testing.assert_array_equal(lttb_indices([0, 1, 2], [5, 6, 7], 500), [0, 1, 2])
+
+    def test_two_points_are_the_endpoints(self):
+        from .track_profile import lttb_indices
+        x = np.arange(1000.0)
+        np.testing.assert_array_equal(lttb_indices(x, np.sin(x), 2), [0, 999])
+
+    def test_precomputed_levels(self):
+        from .track_profile import profile_from_precomputed
+        profiles = {'250': {'distances': [0.0, 1.0, 2.0], 'elevations': [5.0, 9.0, 7.0], 'coordinates': [[8, 46]] * 3}}
+        self.assertEqual(profile_from_precomputed(profiles, 1000)['elevations'], [5.0, 9.0, 7.0])
+        profiles = {'250': {'distances': list(range(250)), 'elevations': [0.0] * 250, 'coordinates': [[8, 46]] * 250}}
+        self.assertEqual(len(profile_from_precomputed(profiles, 100)['distances']), 100)
+        self.assertIsNone(profile_from_precomputed(profiles, 1000))
+
+
+class TrackSectionTests(SimpleTestCase):
+    """Splits and climbs derived at ingest must agree with the stage metrics."""
+
+    def test_splits_and_climbs(self):
+        from .models import TrackSection
+        from .track_metrics import uphill_downhill
+        from .track_sections import compute_track_sections
+        from .track_storage import PackedTrack
+        n = 3000
+        lat = 46.0 + np.arange(n) * 1e-5  # ~1.1 m per point
+        ele = np.concatenate([
+            np.linspace(500, 650, 800), np.linspace(650, 640, 100),  # 10 m dip inside the climb
+            np.linspace(640, 800, 800), np.linspace(800, 600, 1000), np.linspace(600, 605, 300),
+        ])
+        sections = compute_track_sections(PackedTrack(np.full(n, 8.0), lat, ele))
+
+        splits = [s for s in sections if s.kind == TrackSection.SPLIT]
+        self.assertEqual(len(splits), 4)
+        uphill, downhill = uphill_downhill(ele)
+        self.assertAlmostEqual(sum(s.elevation_gain for s in splits), uphill, delta=0.5)
+        self.assertAlmostEqual(sum(s.elevation_loss for s in splits), downhill, delta=0.5)
+
+        climbs = [s for s in sections if s.kind == TrackSection.CLIMB]
+        descents = [s for s in sections if s.kind == TrackSection.DESCENT]
+        self.assertEqual((len(climbs), len(descents)), (1, 1))
+        self.assertAlmostEqual(climbs[0].elevation_gain, 310, delta=1)
+        self.assertGreater(climbs[0].average_grade, 10)
+
+    def test_split_durations_skip_segment_gaps(self):
+        from .models import TrackSection
+        from .track_sections import compute_track_sections
+        from .track_storage import PackedTrack
+        n = 2000
+        lat = 46.0 + np.arange(n) * 1e-5
+        time = 1.7e9 + np.arange(n) * 2.0
+        time[1000:] += 12 * 3600  # Second segment starts the next morning, in the middle of split 1
+        track = PackedTrack(np.full(n, 8.0), lat, time=time, segment_starts=[1000])
+        splits = [s for s in compute_track_sections(track) if s.kind == TrackSection.SPLIT]
+
+        self.assertEqual(len(splits), 3)
+        total = sum(s.duration.total_seconds() for s in splits)
+        self.assertAlmostEqual(total, track.metrics()['duration'], delta=0.01)
+        self.assertLess(splits[1].duration.total_seconds(), 3600)
+
+
+class PhotoVariantTests(SimpleTestCase):
+    """On-demand photo variants: LRU eviction of the disk cache, format negotiation and srcset."""
+
+    def test_evicts_least_recently_used(self):
+        import os
+        import tempfile
+        from django.test import override_settings
+        from .photo_variants import evict, variant_path
+        with tempfile.TemporaryDirectory() as root, override_settings(PHOTO_VARIANT_CACHE_DIR=root):
+            paths = [variant_path(photo_id, 'thumbnail', 'jpg') for photo_id in (1, 2, 3)]
+            for age, path in zip((300, 100, 200), paths):
+                path.parent.mkdir()
+                path.write_bytes(b'x' * 1000)
+                os.utime(path, (0, 1e9 - age))
+            # Photo 1 is the oldest, but the file about to be served is never evicted
+            self.assertEqual(evict(2500, keep=paths[0]), 2000)
+            self.assertEqual([path.exists() for path in paths], [True, True, False])
+            self.assertEqual(evict(1500), 1000)
+            self.assertEqual([path.exists() for path in paths], [False, True, False])
+
+    def test_negotiated_format_and_srcset(self):
+        from django.test import override_settings
+        from .photo_variants import negotiate_format, photo_srcset
+        chrome = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+        with override_settings(PHOTO_AVIF=False):
+            self.assertEqual(negotiate_format(chrome), 'webp')
+        self.assertEqual(negotiate_format('image/*,*/*;q=0.8'), 'jpg')
+        self.assertEqual(negotiate_format('image/webp;q=0'), 'jpg')
+
+        with override_settings(PHOTO_VARIANT_WIDTHS=(160, 320, 640, 1280), MEDIA_URL='/media/'):
+            self.assertEqual(photo_srcset(7, 1000), {
+                'src': '/media/photos/7/w640',
+                'srcset': '/media/photos/7/w160 160w, /media/photos/7/w320 320w, '
+                          '/media/photos/7/w640 640w, /media/photos/7/w1280 1000w',
+            })
+
+
+class PhotoMetadataTests(SimpleTestCase):
+    """Originals are served publicly: only the orientation and the ICC profile may survive the upload."""
+
+    def _photo(self, format):
+        from io import BytesIO
+        from PIL import Image, ImageCms
+        icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90° clockwise
+        exif[0x010F] = 'Camera maker'
+        exif[0x8825] = {1: 'N', 2: (46.0, 30.0, 15.0), 3: 'E', 4: (8.0, 12.0, 30.0)}  # GPS IFD
+        buf = BytesIO()
+        Image.new('RGB', (64, 48), (200, 120, 40)).save(buf, format=format, exif=exif, icc_profile=icc)
+        return buf.getvalue(), icc
+
+    def test_jpeg_keeps_only_orientation_and_icc_profile(self):
+        from io import BytesIO
+        from PIL import Image
+        from .image_processing import render_photo
+
+        data, icc = self._photo('JPEG')
+        xmp = b'http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta>secret place</x:xmpmeta>'
+        comment = b'shot at secret place'
+        # XMP (APP1) and COM segments right after SOI
+        data = (data[:2] + b'\xff\xe1' + (len(xmp) + 2).to_bytes(2, 'big') + xmp
+                + b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment + data[2:])
+        self.assertEqual(Image.open(BytesIO(data)).getexif().get_ifd(0x8825)[1], 'N')
+
+        width, height, files = render_photo(data, 'photo', derivatives=False)
+        self.assertEqual(list(files), ['original'])
+        self.assertEqual((width, height), (48, 64))
+        original = files['original'][1]
+        self.assertNotIn(b'secret place', original)
+        self.assertNotIn(b'Camera maker', original)
+        img = Image.open(BytesIO(original))
+        self.assertEqual(dict(img.getexif()), {0x0112: 6})
+        self.assertEqual(img.getexif().get_ifd(0x8825), {})
+        self.assertEqual(img.info.get('icc_profile'), icc)
+        self.assertNotIn('comment', img.info)
+
+    def test_png_is_reencoded_without_metadata(self):
+        from io import BytesIO
+        from PIL import Image
+        from .image_processing import render_photo
+
+        data, _icc = self._photo('PNG')
+        width, height, files = render_photo(data, 'photo', derivatives=False)
+        self.assertEqual((width, height), (48, 64))
+        filename, original = files['original']
+        self.assertEqual(filename, 'photo.jpg')
+        img = Image.open(BytesIO(original))
+        self.assertEqual((img.format, img.size), ('JPEG', (48, 64)))  # Rotation applied to the pixels
+        self.assertEqual(dict(img.getexif()), {})
+
+
+class SaveTrackTests(TestCase):
+    """Re-sent tracks are skipped by content hash, extended tracks only write the new points."""
+
+    def setUp(self):
+        from datetime import date
+        from .models import Stage, Trip, User
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        self.stage = Stage.objects.create(trip=trip, creator=user, name='Stage', date=date(2024, 7, 1))
+        rng = np.random.default_rng(5)
+        n = 600
+        self.columns = (
+            8.0 + np.cumsum(rng.normal(0, 1e-4, n)), 46.5 + np.cumsum(rng.normal(0, 1e-4, n)),
+            1500 + np.cumsum(rng.normal(0, 2, n)), 1.7e9 + np.arange(n) * 5.0,
+        )
+
+    def _track(self, n):
+        from .track_storage import PackedTrack
+        return PackedTrack(*(column[:n] for column in self.columns))
+
+    def test_identical_resubmit_writes_nothing(self):
+        from unittest import mock
+        from .models import StageTrack
+        from . import track_storage
+
+        self.assertEqual(track_storage.ingest_track(self.stage, self._track(400)), track_storage.TRACK_REPLACED)
+        updated_at = StageTrack.objects.get(stage=self.stage).updated_at
+
+        with mock.patch.object(track_storage, 'write_packed_track') as write, \
+                mock.patch.object(track_storage, 'replace_track_sections') as sections:
+            result = track_storage.ingest_track(self.stage, self._track(400))
+        self.assertEqual(result, track_storage.TRACK_UNCHANGED)
+        write.assert_not_called()
+        sections.assert_not_called()
+        self.assertEqual(StageTrack.objects.get(stage=self.stage).updated_at, updated_at)
+
+    def test_extended_track_is_appended(self):
+        from django.test import override_settings
+        from .models import StageTrack, TrackPoint
+        from .track_metrics import stage_metric_fields
+        from . import track_storage
+
+        with override_settings(TRACKPOINT_LEGACY_ROWS=True):
+            track_storage.ingest_track(self.stage, self._track(400))
+            first_rows = set(TrackPoint.objects.filter(stage=self.stage).values_list('pk', flat=True))
+            result = track_storage.ingest_track(self.stage, self._track(600))
+
+        self.assertEqual(result, track_storage.TRACK_APPENDED)
+        # The stored points were kept, only the 200 new ones were written
+        rows = set(TrackPoint.objects.filter(stage=self.stage).values_list('pk', flat=True))
+        self.assertEqual((len(rows), len(first_rows - rows)), (600, 0))
+
+        full = self._track(600)
+        stored = track_storage.PackedTrack.from_model(StageTrack.objects.get(stage=self.stage))
+        self.assertEqual(len(stored), 600)
+        self.assertTrue(np.allclose(stored.distances, full.distances))
+        self.stage.refresh_from_db()
+        for field, value in stage_metric_fields(full.metrics()).items():
+            self.assertEqual(getattr(self.stage, field), value, msg=field)
+
+
+class SpatialFilterTests(TestCase):
+    """?bbox= and ?near=&radius_m= on the stage tracks, for stages and trips."""
+
+    def setUp(self):
+        from datetime import date
+        from .models import Stage, Trip, User
+        from .track_storage import PackedTrack, ingest_track
+
+        self.user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        self.trip = Trip.objects.create(name='Alps', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=self.user)
+        self.zermatt = Stage.objects.create(trip=self.trip, creator=self.user, name='Zermatt', date=date(2024, 7, 1))
+        self.chamonix = Stage.objects.create(trip=self.trip, creator=self.user, name='Chamonix', date=date(2024, 7, 2))
+        # East-west lines of about 1.5 km
+        ingest_track(self.zermatt, PackedTrack(np.linspace(7.74, 7.76, 20), np.full(20, 46.02)))
+        ingest_track(self.chamonix, PackedTrack(np.linspace(6.86, 6.88, 20), np.full(20, 45.92)))
+
+    def _stages(self, **params):
+        from .filters import StageFilter
+        from .models import Stage
+        filterset = StageFilter(data=params, queryset=Stage.objects.all())
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        return set(filterset.qs.values_list('name', flat=True))
+
+    def test_bbox(self):
+        from .filters import TripFilter
+        from .models import Trip
+        self.assertEqual(self._stages(bbox='7.7,46.0,7.8,46.1'), {'Zermatt'})
+        self.assertEqual(self._stages(bbox='6.0,45.0,8.0,47.0'), {'Zermatt', 'Chamonix'})
+        self.assertEqual(self._stages(bbox='9.0,47.0,9.1,47.1'), set())
+        trips = TripFilter(data={'bbox': '7.7,46.0,7.8,46.1'}, queryset=Trip.objects.all()).qs
+        self.assertEqual(list(trips), [self.trip])  # One row although the join could repeat it
+
+    def test_near_with_radius(self):
+        # 500 m north of the Zermatt line
+        self.assertEqual(self._stages(near='46.0245,7.75', radius_m=1000), {'Zermatt'})
+        self.assertEqual(self._stages(near='46.0245,7.75', radius_m=300), set())
+        self.assertEqual(self._stages(near='46.0245,7.75'), {'Zermatt'})  # Default radius 1 km
+        self.assertEqual(self._stages(near='46.0,7.3', radius_m=60000), {'Zermatt', 'Chamonix'})
+
+    def test_invalid_parameters(self):
+        from .filters import StageFilter
+        from .models import Stage
+        for params, field in (
+            ({'bbox': '7.7,46.0,7.8'}, 'bbox'),
+            ({'bbox': '7.8,46.0,7.7,46.1'}, 'bbox'),  # min > max
+            ({'bbox': 'a,b,c,d'}, 'bbox'),
+            ({'bbox': 'nan,46.0,7.8,46.1'}, 'bbox'),
+            ({'near': '46.0'}, 'near'),
+            ({'near': '95,7.75'}, 'near'),
+            ({'near': '46.0,7.75', 'radius_m': '-1'}, 'radius_m'),
+            ({'near': '46.0,7.75', 'radius_m': '600000'}, 'radius_m'),
+        ):
+            filterset = StageFilter(data=params, queryset=Stage.objects.all())
+            self.assertFalse(filterset.is_valid(), params)
+            self.assertIn(field, filterset.errors)
+
+        from rest_framework.test import APIClient
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/stages/', {'bbox': 'nope'}).status_code, 400)
+
+
+class TrackExportTests(TestCase):
+    """Streamed GPX/GeoJSON exports must be complete documents with one segment per GPX segment."""
+
+    def setUp(self):
+        from datetime import date, timedelta
+        from django.contrib.gis.geos import Point
+        from django.utils import timezone as dj_timezone
+        from .models import Stage, TrackPoint, Trip, User
+        from .track_storage import PackedTrack, write_packed_track
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Alps & more', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        self.packed = Stage.objects.create(trip=trip, creator=user, name='Two days', date=date(2024, 7, 1))
+        self.legacy = Stage.objects.create(trip=trip, creator=user, name='Legacy <old>', date=date(2024, 7, 2))
+        # More points than export.CHUNK_SIZE per segment, so segments are streamed in several chunks
+        n = 4500
+        self.track = PackedTrack(
+            np.linspace(7.0, 7.5, n), np.linspace(46.0, 46.2, n), np.linspace(500, 900, n).round(1),
+            1.7e9 + np.arange(n) * 10.0, segment_starts=[2500],
+        )
+        write_packed_track(self.packed, self.track)
+        start = dj_timezone.now().replace(microsecond=0)
+        TrackPoint.objects.bulk_create(
+            TrackPoint(stage=self.legacy, location=Point(8.0 + i * 1e-3, 46.5, srid=4326), elevation=1000 + i,
+                       timestamp=start + timedelta(minutes=i))
+            for i in range(30)
+        )
+
+    def _content(self, fmt):
+        from .models import Stage
+        from .track_export import export_response
+        response = export_response(Stage.objects.order_by('date', 'id').iterator(chunk_size=50), 'Alps & more', fmt)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="alps-more.' + fmt + '"')
+        return b''.join(response.streaming_content)
+
+    def test_gpx(self):
+        gpx = gpxpy.parse(self._content('gpx').decode())
+        self.assertEqual(gpx.name, 'Alps & more')
+        self.assertEqual([track.name for track in gpx.tracks], ['Two days', 'Legacy <old>'])
+
+        packed, legacy = gpx.tracks
+        self.assertEqual([len(segment.points) for segment in packed.segments], [2500, 2000])
+        points = [point for segment in packed.segments for point in segment.points]
+        np.testing.assert_allclose([p.longitude for p in points], self.track.lon)
+        np.testing.assert_allclose([p.latitude for p in points], self.track.lat)
+        np.testing.assert_allclose([p.elevation for p in points], self.track.ele)
+        np.testing.assert_allclose([p.time.timestamp() for p in points], self.track.time)
+
+        self.assertEqual([len(segment.points) for segment in legacy.segments], [30])
+        self.assertEqual([p.elevation for p in legacy.segments[0].points], [1000 + i for i in range(30)])
+
+    def test_geojson(self):
+        import json
+        features = json.loads(self._content('geojson'))['features']
+        self.assertEqual([f['properties']['name'] for f in features], ['Two days', 'Legacy <old>'])
+        packed, legacy = (f['geometry'] for f in features)
+        self.assertEqual(packed['type'], 'MultiLineString')
+        self.assertEqual([len(line) for line in packed['coordinates']], [2500, 2000])
+        self.assertEqual(packed['coordinates'][1][0], [self.track.lon[2500], self.track.lat[2500], self.track.ele[2500]])
+        self.assertEqual((legacy['type'], len(legacy['coordinates'])), ('LineString', 30))
+
+
+class TrackPreviewTests(TestCase):
+    """calculate-gpx tokens resolve to the cached track, for the user who created them only."""
+
+    def test_token_round_trip(self):
+        from .models import User
+        from .track_preview import load_preview_track, store_preview_track
+        from .track_storage import PackedTrack
+
+        owner = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        other = User.objects.create_user(username='other', email='other@example.com', password='x')
+        n = 50
+        track = PackedTrack(np.linspace(8.0, 8.01, n), np.linspace(46.0, 46.01, n), np.full(n, np.nan),
+                            1.7e9 + np.arange(n), segment_starts=[20])
+
+        token = store_preview_track(owner, track)
+        loaded = load_preview_track(owner, token)
+        self.assertEqual(loaded.content_hash(), track.content_hash())
+        self.assertEqual(loaded.segment_starts.tolist(), [20])
+        self.assertIsNone(load_preview_track(other, token))
+        self.assertIsNone(load_preview_track(owner, 'unknown'))
+
+
+class TrackJobRetryTests(TestCase):
+    """Failed track jobs go back to the queue and are run again once their backoff has passed."""
+
+    def test_failed_job_is_picked_up_again(self):
+        from datetime import date, timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from .models import Stage, TrackJob, Trip, User
+        from .track_jobs import _claim, run_job, run_pending_jobs
+        from .track_storage import PackedTrack
+        from . import track_jobs
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        stage = Stage.objects.create(trip=trip, creator=user, name='Stage', date=date(2024, 7, 1))
+        track = PackedTrack(np.linspace(8.0, 8.01, 50), np.linspace(46.0, 46.01, 50))
+        job = TrackJob.objects.create(stage=stage, source='POINTS', points=track_jobs._pack_points(track))
+
+        with mock.patch.object(track_jobs, 'ingest_track', side_effect=RuntimeError("database gone")):
+            self.assertFalse(run_job(_claim(job.pk)))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('QUEUED', 1))
+        self.assertIsNone(_claim())  # Still in backoff
+
+        TrackJob.objects.filter(pk=job.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(run_pending_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('DONE', 2))
+        stage.refresh_from_db()
+        self.assertIsNotNone(stage.calculated_length_km)
+
+    def test_job_of_dead_worker_fails_after_last_attempt(self):
+        from datetime import date, timedelta
+        from django.utils import timezone
+        from .models import Stage, TrackJob, Trip, User
+        from .track_jobs import has_pending_job, run_pending_jobs
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        stage = Stage.objects.create(trip=trip, creator=user, name='Stage', date=date(2024, 7, 1))
+        # Worker died 16 minutes ago during the last attempt
+        job = TrackJob.objects.create(stage=stage, source='POINTS', status='RUNNING', attempts=3, max_attempts=3,
+                                      started_at=timezone.now() - timedelta(minutes=16))
+
+        self.assertEqual(run_pending_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertIsNotNone(job.finished_at)
+        self.assertTrue(job.error)
+        self.assertFalse(has_pending_job(stage))
+
+
+class PhotoJobTests(TestCase):
+    """Photos of crashed workers must not stay PROCESSING forever."""
+
+    def test_photo_of_dead_worker_fails_after_last_attempt(self):
+        from datetime import date, timedelta
+        from django.utils import timezone
+        from .models import Photo, Stage, Trip, User
+        from .photo_jobs import MAX_ATTEMPTS, run_pending_photos
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        stage = Stage.objects.create(trip=trip, creator=user, name='Stage', date=date(2024, 7, 1))
+        photo = Photo.objects.create(
+            stage=stage, creator=user, original='photos/originals/lost.jpg', original_width=1, original_height=1,
+            processing_status='PROCESSING', processing_attempts=MAX_ATTEMPTS,
+            processing_started_at=timezone.now() - timedelta(minutes=16),
+        )
+
+        self.assertEqual(run_pending_photos(), 0)
+        photo.refresh_from_db()
+        self.assertEqual(photo.processing_status, 'FAILED')
+        self.assertTrue(photo.processing_error)
+
+
+class TrackJobStatusTests(TestCase):
+    """Stage lists read the track_job status of all stages in one query."""
+
+    def test_latest_job_status_is_prefetched(self):
+        from datetime import date
+        from .models import Stage, TrackJob, Trip, User
+        from .track_jobs import latest_job_prefetch, latest_job_status
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        for name in ('A', 'B', 'C'):
+            stage = Stage.objects.create(trip=trip, creator=user, name=name, date=date(2024, 7, 1))
+            if name != 'C':
+                TrackJob.objects.create(stage=stage, source='POINTS', status='DONE')
+                TrackJob.objects.create(stage=stage, source='POINTS', status='QUEUED')
+
+        with self.assertNumQueries(2):
+            stages = list(Stage.objects.order_by('name').prefetch_related(latest_job_prefetch()))
+            statuses = [latest_job_status(stage) for stage in stages]
+        self.assertEqual([s and s['status'] for s in statuses], ['QUEUED', 'QUEUED', None])
+        self.assertEqual(statuses[0], latest_job_status(Stage.objects.get(name='A')))
+
+
+class MovingStatsTests(TestCase):
+    """Dashboard speeds are moving distance over moving time, like the per-stage average."""
+
+    def test_average_speed_uses_moving_distance(self):
+        from datetime import date, timedelta
+        from .models import Stage, Trip, User
+        from .views import _moving_aggregates, _moving_stats
+
+        user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=user)
+        # 12 km track, 10 km of it covered in 2 h of moving time (the rest while dawdling)
+        Stage.objects.create(trip=trip, creator=user, name='Timed', date=date(2024, 7, 1), calculated_length_km=12,
+                             calculated_moving_time=timedelta(hours=2), calculated_avg_speed_kmh=5)
+        Stage.objects.create(trip=trip, creator=user, name='Untimed', date=date(2024, 7, 2), calculated_length_km=8)
+
+        stats = _moving_stats(Stage.objects.aggregate(**_moving_aggregates()))
+        self.assertEqual(stats['avg_moving_speed_kmh'], 5.0)
+        self.assertEqual(stats['total_moving_time'], 7200)
+
+
+class LiveAppendTests(TestCase):
+    """Live-tracking appends keep segment starts and never race a queued track upload."""
+
+    def setUp(self):
+        from datetime import date
+        from rest_framework.test import APIClient
+        from .models import Stage, Trip, User
+
+        self.user = User.objects.create_user(username='hiker', email='hiker@example.com', password='x')
+        trip = Trip.objects.create(name='Trip', start_date=date(2024, 7, 1), end_date=date(2024, 7, 2), creator=self.user)
+        self.stage = Stage.objects.create(trip=trip, creator=self.user, name='Stage', date=date(2024, 7, 1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/stages/{self.stage.pk}/track/append/'
+
+    def test_segment_starts_survive_incremental_appends(self):
+        from .models import StageTrack
+        from .track_storage import PackedTrack, append_track, load_track
+
+        rng = np.random.default_rng(3)
+        n = 300
+        lon = 8.0 + np.cumsum(rng.normal(0, 1e-4, n))
+        lat = 46.5 + np.cumsum(rng.normal(0, 1e-4, n))
+        ele = 1500 + np.cumsum(rng.normal(0, 2, n))
+        time = 1.7e9 + np.arange(n) * 5.0
+        segment = np.repeat([0, 1, 2], [150, 60, 90])  # Starts at a batch boundary and inside a batch
+
+        for start in range(0, n, 50):
+            end = start + 50
+            batch = PackedTrack(lon[start:end], lat[start:end], ele[start:end], time[start:end],
+                                segment_starts=np.flatnonzero(np.diff(segment[start:end])) + 1)
+            state = append_track(self.stage, batch, int(segment[start]), int(segment[end - 1]))
+
+        expected = PackedTrack(lon, lat, ele, time, segment_starts=[150, 210])
+        stored = load_track(self.stage)
+        self.assertEqual(stored.segment_starts.tolist(), [150, 210])
+        self.assertTrue(np.allclose(stored.distances, expected.distances))
+        self.assertEqual(state['track_point_count'], n)
+        for key, value in running_metrics(state).items():
+            self.assertAlmostEqual(value, expected.metrics()[key], places=6, msg=key)
+        self.assertEqual(StageTrack.objects.get(stage=self.stage).segment_metrics, expected.segment_summaries())
+
+    def test_rejects_bare_list(self):
+        response = self.client.post(self.url, [{'lat': 46.5, 'lon': 8.0}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_append_while_upload_is_queued(self):
+        from .models import TrackJob
+
+        TrackJob.objects.create(stage=self.stage, source='POINTS')
+        points = [{'lat': 46.5, 'lon': 8.0}, {'lat': 46.501, 'lon': 8.0}]
+        response = self.client.post(self.url, {'points': points}, format='json')
+        self.assertEqual(response.status_code, 409)
+        TrackJob.objects.update(status='DONE')
+        response = self.client.post(self.url, {'points': points}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class GPXBatchValidationTests(SimpleTestCase):
+    """Invalid tracks of a batch get their own error, the valid ones are still calculated."""
+
+    def test_bad_item_among_good_ones(self):
+        from .gpx_batch import batch_previews, json_items
+        points = [{'lat': 46.0 + i * 1e-4, 'lon': 8.0, 'ele': 500.0 + i} for i in range(50)]
+        items = json_items([
+            {'name': 'good', 'track_points': points},
+            {'name': 'bad', 'track_points': [{'lat': 'north', 'lon': 8.0}]},
+            'not a track',
+            {'name': 'also good', 'track_points': points[:20]},
+        ])
+        results = batch_previews(items)
+
+        self.assertEqual([r['name'] for r in results], ['good', 'bad', 'Track 3', 'also good'])
+        self.assertEqual((results[0]['pointCount'], results[3]['pointCount']), (50, 20))
+        self.assertIn('Point 1: lat', results[1]['error'])
+        self.assertIn('error', results[2])
+        self.assertNotIn('error', results[0])
@@ -0,0 +1,77 @@
+# api/tiles.py
+"""
+Mapbox Vector Tiles mit allen Etappen-Tracks, direkt in PostGIS gerendert (ST_AsMVT / ST_AsMVTGeom).
+
+Gerenderte Kacheln werden im Django-Cache abgelegt. Statt einzelne Kacheln gezielt zu löschen,
+enthält jeder Cache-Key eine Version, die aus der Datenbank abgeleitet wird (Anzahl der Tracks und
+letzte Änderung); jede Track-Änderung ergibt damit in allen Prozessen sofort neue Keys, auch wenn
+der Cache nur prozesslokal ist.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Max
+
+from .models import Stage, StageTrack, Trip
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+LAYER_NAME = 'tracks'
+WEB_MERCATOR_SIZE_M = 40075016.686  # Circumference of the Web Mercator world in meters
+
+
+def tile_cache_version():
+    """Changes whenever a track is written, appended to or deleted (StageTrack.updated_at is auto_now)."""
+    state = StageTrack.objects.aggregate(count=Count('pk'), updated=Max('updated_at'))
+    updated = state['updated'].timestamp() if state['updated'] else 0
+    return f"{state['count']}-{updated}"
+
+
+def render_tile(z, x, y, user_id=None, trip_id=None, activity_type=None):
+    """
+    Returns the MVT tile (bytes) with the track LineStrings in the given tile, optionally
+    restricted to the trips of a participant, a single trip and/or an activity type.
+    """
+    key = f"tiles:{tile_cache_version()}:{z}/{x}/{y}:{user_id}:{trip_id}:{activity_type}"
+    tile = cache.get(key)
+    if tile is not None:
+        return tile
+
+    filters = []
+    params = [z, x, y, WEB_MERCATOR_SIZE_M / (2 ** z) / TILE_EXTENT / 2, TILE_EXTENT, TILE_BUFFER]
+    if user_id is not None:
+        filters.append(f"AND s.trip_id IN (SELECT trip_id FROM {Trip.participants.through._meta.db_table} WHERE user_id = %s)")
+        params.append(user_id)
+    if trip_id is not None:
+        filters.append("AND s.trip_id = %s")
+        params.append(trip_id)
+    if activity_type:
+        filters.append("AND s.activity_type = %s")
+        params.append(activity_type)
+    params.extend([LAYER_NAME, TILE_EXTENT])
+
+    # The && on the 4326 geometry uses the GiST index of StageTrack.geometry;
+    # simplification to half a tile pixel keeps low zoom levels cheap.
+    sql = f"""
+        WITH bounds AS (SELECT ST_TileEnvelope(%s, %s, %s) AS geom),
+        mvtgeom AS (
+            SELECT ST_AsMVTGeom(
+                       ST_Simplify(ST_Transform(t.geometry, 3857), %s),
+                       bounds.geom, %s, %s, true
+                   ) AS geom,
+                   s.id AS stage_id, s.trip_id, s.activity_type
+            FROM {StageTrack._meta.db_table} t
+            JOIN {Stage._meta.db_table} s ON s.id = t.stage_id
+            CROSS JOIN bounds
+            WHERE t.geometry && ST_Transform(bounds.geom, 4326)
+            {' '.join(filters)}
+        )
+        SELECT ST_AsMVT(mvtgeom.*, %s, %s, 'geom') FROM mvtgeom WHERE geom IS NOT NULL
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    tile = bytes(row[0]) if row and row[0] is not None else b''
+
+    cache.set(key, tile, timeout=getattr(settings, 'TILE_CACHE_TIMEOUT', 3600))
+    return tile
@@ -0,0 +1,61 @@
+# api/track_binary.py
+"""
+Binäres Track-Format für Karte und Höhenprofil (Alternative zu den JSON-Listen von get_track).
+
+Layout (alle Werte little-endian):
+
+    Offset  Grösse  Inhalt
+    0       4       Magic ``b'WTRK'``
+    4       1       Version (uint8, aktuell 2)
+    5       3       reserviert (0)
+    8       4       Anzahl Punkte n (uint32)
+    12      4       Anzahl Segment-Starts s (uint32, 0 = ein Segment; in Version 1 reserviert)
+    16      8 * n   Koordinaten: float32 lon, float32 lat (interleaved)
+    16+8n   4 * n   Höhen in Metern (float32, NaN = unbekannt)
+    16+12n  4 * n   Kumulierte Distanz in Metern (float32)
+    16+16n  4 * s   Punkt-Index, an dem ein neues GPX-Segment beginnt (uint32)
+
+Der Header ist 16 Byte gross, damit alle Arrays 4-Byte-aligned sind und im Browser direkt als
+``Float32Array`` auf dem ``ArrayBuffer`` gelesen werden können (siehe ``src/utils/trackBinary.js``).
+"""
+import struct
+
+import numpy as np
+
+MEDIA_TYPE = 'application/vnd.wanderapp.track'
+MAGIC = b'WTRK'
+VERSION = 2
+HEADER = struct.Struct('<4sB3xII')
+FLOAT32 = np.dtype('<f4')
+UINT32 = np.dtype('<u4')
+
+
+def encode_track(lon, lat, ele, distances, segment_starts=()):
+    """Encodes the track arrays into the binary layout described above."""
+    n = len(lon)
+    coords = np.empty(2 * n, dtype=FLOAT32)
+    coords[0::2] = lon
+    coords[1::2] = lat
+    return b''.join((
+        HEADER.pack(MAGIC, VERSION, n, len(segment_starts)),
+        coords.tobytes(),
+        np.asarray(ele, dtype=FLOAT32).tobytes(),
+        np.asarray(distances, dtype=FLOAT32).tobytes(),
+        np.asarray(segment_starts, dtype=UINT32).tobytes(),
+    ))
+
+
+def decode_track(data):
+    """Decodes the binary layout into ``(lon, lat, ele, distances, segment_starts)`` arrays (version 1 or 2)."""
+    magic, version, n, s = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError("Unsupported binary track (magic/version mismatch)")
+    if version == 1:
+        s = 0
+    if len(data) != HEADER.size + 16 * n + 4 * s:
+        raise ValueError("Truncated binary track")
+    coords = np.frombuffer(data, dtype=FLOAT32, count=2 * n, offset=HEADER.size)
+    ele = np.frombuffer(data, dtype=FLOAT32, count=n, offset=HEADER.size + 8 * n)
+    distances = np.frombuffer(data, dtype=FLOAT32, count=n, offset=HEADER.size + 12 * n)
+    segment_starts = np.frombuffer(data, dtype=UINT32, count=s, offset=HEADER.size + 16 * n)
+    return coords[0::2], coords[1::2], ele, distances, segment_starts
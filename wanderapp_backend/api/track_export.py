@@ -0,0 +1,148 @@
+# api/track_export.py
+"""
+Streaming-Export von Etappen-Tracks als GPX oder GeoJSON.
+
+Die Generatoren laden immer nur den Track einer einzigen Etappe (bzw. bei Legacy-Etappen
+TrackPoint-Blöcke über einen serverseitigen Cursor) und geben das Dokument stückweise aus,
+sodass auch Trips mit vielen Etappen nie komplett im Speicher liegen.
+"""
+import json
+from datetime import datetime, timezone as dt_timezone
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
+
+from .models import StageTrack, TrackPoint
+from .track_storage import PackedTrack
+
+CHUNK_SIZE = 2000  # Points per yielded chunk / per server-side cursor fetch
+
+CONTENT_TYPES = {
+    'gpx': 'application/gpx+xml',
+    'geojson': 'application/geo+json',
+}
+
+
+def _iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def track_segments(stage):
+    """
+    The GPX segments of a stage as a list of lazy iterators. Each yields the points of its segment
+    as lists of ``(lon, lat, ele, unix_time)`` tuples, at most CHUNK_SIZE per list (unknown
+    elevation/time are None). Legacy stages always have a single segment.
+    """
+    packed = StageTrack.objects.filter(stage=stage).first()
+    if packed is None:
+        return [_iter_legacy_chunks(stage)]
+    track = PackedTrack.from_model(packed)
+    return [_iter_packed_chunks(track, start, end) for start, end in track.segments()]
+
+
+def _iter_packed_chunks(track, first, last):
+    for start in range(first, last, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, last)
+        ele = track.ele[start:end]
+        time = track.time[start:end]
+        yield list(zip(
+            track.lon[start:end].tolist(),
+            track.lat[start:end].tolist(),
+            np.where(np.isnan(ele), None, ele).tolist(),
+            np.where(np.isnan(time), None, time).tolist(),
+        ))
+
+
+def _iter_legacy_chunks(stage):
+    # Legacy stages: TrackPoint rows via server-side cursor
+    rows = (
+        TrackPoint.objects.filter(stage=stage).order_by('timestamp', 'id')
+        .values_list('location', 'elevation', 'timestamp')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    chunk = []
+    for location, elevation, timestamp in rows:
+        chunk.append((location.x, location.y, elevation, timestamp.timestamp() if timestamp else None))
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _gpx_point(lon, lat, ele, time):
+    children = ''
+    if ele is not None:
+        children += f'<ele>{ele}</ele>'
+    if time is not None:
+        children += f'<time>{_iso_time(time)}</time>'
+    return f'<trkpt lat="{lat}" lon="{lon}">{children}</trkpt>\n'
+
+
+def stream_gpx(stages, name):
+    """GPX 1.1 document with one <trk> per stage and one <trkseg> per track segment."""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<gpx version="1.1" creator="WanderApp" xmlns="http://www.topografix.com/GPX/1/1">\n'
+    yield f'<metadata><name>{escape(name)}</name></metadata>\n'
+    for stage in stages:
+        yield f'<trk><name>{escape(stage.name)}</name>\n'
+        for segment in track_segments(stage):
+            yield '<trkseg>\n'
+            for chunk in segment:
+                yield ''.join(_gpx_point(*point) for point in chunk)
+            yield '</trkseg>\n'
+        yield '</trk>\n'
+    yield '</gpx>\n'
+
+
+def stream_geojson(stages):
+    """
+    GeoJSON FeatureCollection with one feature per stage ([lon, lat, ele] positions): a LineString,
+    or a MultiLineString with one line per segment for multi-segment tracks.
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    first_feature = True
+    for stage in stages:
+        properties = {
+            'id': stage.id,
+            'name': stage.name,
+            'date': stage.date.isoformat() if stage.date else None,
+            'activity_type': stage.activity_type,
+            'calculated_length_km': stage.calculated_length_km,
+            'calculated_elevation_gain': stage.calculated_elevation_gain,
+            'calculated_elevation_loss': stage.calculated_elevation_loss,
+        }
+        yield ('' if first_feature else ',') + '\n{"type": "Feature", "properties": ' + json.dumps(properties)
+        segments = track_segments(stage)
+        multi = len(segments) > 1
+        yield ', "geometry": {"type": "%s", "coordinates": [' % ('MultiLineString' if multi else 'LineString')
+        for i, segment in enumerate(segments):
+            if multi:
+                yield (',' if i else '') + '['
+            first_point = True
+            for chunk in segment:
+                positions = ','.join(
+                    f'[{lon},{lat},{ele}]' if ele is not None else f'[{lon},{lat}]'
+                    for lon, lat, ele, _ in chunk
+                )
+                yield ('' if first_point else ',') + positions
+                first_point = False
+            if multi:
+                yield ']'
+        yield ']}}'
+        first_feature = False
+    yield '\n]}\n'
+
+
+def export_response(stages, name, fmt):
+    """StreamingHttpResponse with the tracks of ``stages`` as download in ``fmt`` ('gpx' or 'geojson')."""
+    if fmt == 'gpx':
+        content = stream_gpx(stages, name)
+    else:
+        content = stream_geojson(stages)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    filename = f"{slugify(name) or 'track'}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename={quoteattr(filename)}'
+    return response
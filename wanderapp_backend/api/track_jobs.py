@@ -0,0 +1,231 @@
+# api/track_jobs.py
+"""
+Hintergrund-Jobs für den Track-Import.
+
+Der Request legt nur eine TrackJob-Zeile an (Punkte gepackt bzw. die GPX-Datei) und kehrt sofort
+zurück; Packen, Douglas-Peucker-Pyramide, Metriken und Legacy-Zeilen laufen im Worker. Die Queue
+ist die Datenbank selbst (``SELECT ... FOR UPDATE SKIP LOCKED``), ein externer Broker ist nicht nötig.
+
+Worker:
+* im Webprozess: ein kleiner Thread-Pool (``TRACK_JOB_WORKERS``, 0 = aus) startet Jobs nach dem Commit.
+  Ab dem ersten Job fragt ein Poller-Thread die Queue alle ``TRACK_JOB_POLL_INTERVAL`` Sekunden ab, damit
+  Wiederholungen nach dem Backoff und liegengebliebene RUNNING-Jobs auch ohne run_track_jobs laufen
+* separat: ``python manage.py run_track_jobs`` (mehrere Instanzen können parallel laufen)
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery
+from django.utils import timezone
+
+from .gpx_import import GPXImportError, parse_gpx
+from .models import Stage, StageTrack, TrackJob
+from .track_storage import FLOAT_DTYPE, PackedTrack, ingest_track, unpack_segment_starts
+
+logger = logging.getLogger(__name__)
+
+RETRY_BACKOFF_SECONDS = 30  # Multiplied by the attempt number
+STALE_RUNNING_AFTER = timedelta(minutes=15)  # RUNNING jobs of crashed workers are picked up again
+JOB_STATUS_FIELDS = ('id', 'status', 'attempts', 'error', 'created_at', 'finished_at')
+
+_executor = None
+_executor_lock = threading.Lock()
+_poll_pending = threading.Event()  # A poll is queued or running in the executor
+
+
+def _pack_points(track):
+    return np.vstack((track.lon, track.lat, track.ele, track.time)).astype(FLOAT_DTYPE).tobytes()
+
+
+def _unpack_points(data, segment_starts=b''):
+    lon, lat, ele, time = np.frombuffer(data, dtype=FLOAT_DTYPE).reshape(4, -1)
+    return PackedTrack(lon, lat, ele, time, segment_starts=unpack_segment_starts(segment_starts))
+
+
+@transaction.atomic
+def enqueue_track(stage, track=None, gpx_file=None):
+    """
+    Queues the ingestion of ``track`` (PackedTrack) or of an uploaded ``gpx_file`` for a stage and
+    returns the TrackJob. Older queued jobs of the stage are cancelled, only the latest upload counts.
+    Clearing the track and re-sending the stored track are handled right away (returns None).
+    """
+    if gpx_file is None:
+        if track is None or not len(track):
+            TrackJob.objects.filter(stage=stage, status='QUEUED').update(status='CANCELLED', finished_at=timezone.now())
+            ingest_track(stage, None)
+            return None
+        if StageTrack.objects.filter(stage=stage, content_hash=track.content_hash()).exists():
+            return None
+
+    TrackJob.objects.filter(stage=stage, status='QUEUED').update(status='CANCELLED', finished_at=timezone.now())
+    if gpx_file is not None:
+        job = TrackJob(stage=stage, source='GPX')
+        job.gpx_file.save(gpx_file.name, gpx_file, save=False)
+        job.save()
+    else:
+        job = TrackJob.objects.create(
+            stage=stage, source='POINTS', points=_pack_points(track), segment_starts=track.segment_blob(),
+        )
+    transaction.on_commit(lambda: _kick_worker(job.pk))
+    return job
+
+
+def latest_job_status(stage):
+    """
+    Status summary of the latest track job of a stage (None if it never had one). Uses the
+    latest_job_prefetch() result if the stage was loaded with it, otherwise one query.
+    """
+    if hasattr(stage, 'latest_track_jobs'):
+        job = stage.latest_track_jobs[0] if stage.latest_track_jobs else None
+        return {field: getattr(job, field) for field in JOB_STATUS_FIELDS} if job else None
+    return TrackJob.objects.filter(stage=stage).order_by('-created_at').values(*JOB_STATUS_FIELDS).first()
+
+
+def latest_job_prefetch(lookup='track_jobs'):
+    """
+    Prefetch of only the latest track job per stage (``lookup`` leads to Stage.track_jobs), so
+    serializing a list of stages costs one query for their job status instead of one per stage.
+    """
+    latest = TrackJob.objects.filter(stage=OuterRef('stage')).order_by('-created_at').values('pk')[:1]
+    jobs = TrackJob.objects.filter(pk=Subquery(latest)).only('stage', *JOB_STATUS_FIELDS)
+    return Prefetch(lookup, queryset=jobs, to_attr='latest_track_jobs')
+
+
+def has_pending_job(stage):
+    """True while a track job of the stage is queued or running; it would overwrite live appends."""
+    return TrackJob.objects.filter(stage=stage, status__in=('QUEUED', 'RUNNING')).exists()
+
+
+def fail_exhausted_jobs(now=None):
+    """
+    Marks stale RUNNING jobs without attempts left as FAILED: their worker died during the last
+    attempt, and _claim() never picks them up again. Returns the count.
+    """
+    now = now or timezone.now()
+    return TrackJob.objects.filter(
+        status='RUNNING', started_at__lte=now - STALE_RUNNING_AFTER, attempts__gte=F('max_attempts'),
+    ).update(status='FAILED', finished_at=now, error='Worker stopped during the last attempt')
+
+
+def _claim(job_id=None):
+    """Marks the next runnable job (or ``job_id``) as RUNNING; None if there is nothing to do."""
+    now = timezone.now()
+    fail_exhausted_jobs(now)
+    with transaction.atomic():
+        jobs = TrackJob.objects.select_for_update(skip_locked=True).filter(
+            status__in=('QUEUED', 'RUNNING'), run_after__lte=now, attempts__lt=F('max_attempts'),
+        ).exclude(status='RUNNING', started_at__gt=now - STALE_RUNNING_AFTER)
+        if job_id is not None:
+            jobs = jobs.filter(pk=job_id)
+        job = jobs.order_by('run_after', 'pk').first()
+        if job is None:
+            return None
+        job.status = 'RUNNING'
+        job.attempts += 1
+        job.started_at = now
+        job.save(update_fields=['status', 'attempts', 'started_at'])
+    return job
+
+
+def run_job(job):
+    """Processes a claimed job. Failures are retried with backoff until max_attempts is reached."""
+    try:
+        if job.source == 'GPX':
+            with job.gpx_file.open('rb') as f:
+                track = parse_gpx(f)
+        else:
+            track = _unpack_points(job.points, job.segment_starts)
+        with transaction.atomic():
+            # Stage row lock serializes jobs of the same stage; a newer finished upload wins
+            stage = Stage.objects.select_for_update().get(pk=job.stage_id)
+            superseded = TrackJob.objects.filter(stage_id=job.stage_id, pk__gt=job.pk, status='DONE').exists()
+            if not superseded:
+                # save_track() skips unchanged tracks (content hash), so a retried job does not rewrite anything
+                ingest_track(stage, track)
+    except Exception as e:
+        logger.exception("Track job %s failed (attempt %s)", job.pk, job.attempts)
+        job.error = str(e)
+        # An invalid file stays invalid; only unexpected errors (database, storage) are retried
+        if isinstance(e, GPXImportError) or job.attempts >= job.max_attempts:
+            job.status = 'FAILED'
+            job.finished_at = timezone.now()
+        else:
+            job.status = 'QUEUED'
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_BACKOFF_SECONDS * job.attempts)
+        job.save(update_fields=['status', 'error', 'run_after', 'finished_at'])
+        return False
+
+    job.status = 'CANCELLED' if superseded else 'DONE'
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.points = job.segment_starts = b''  # Payload no longer needed
+    job.save(update_fields=['status', 'error', 'finished_at', 'points', 'segment_starts'])
+    if job.gpx_file:
+        job.gpx_file.delete(save=True)
+    return True
+
+
+def run_pending_jobs(limit=None):
+    """Processes runnable jobs until none is left (or ``limit`` were run). Returns the count."""
+    count = 0
+    while limit is None or count < limit:
+        job = _claim()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        job = _claim(job_id)
+        if job is not None:
+            run_job(job)
+    finally:
+        close_old_connections()
+
+
+def _poll_once():
+    close_old_connections()
+    try:
+        run_pending_jobs()
+    except Exception:
+        logger.exception("Polling track jobs failed")
+    finally:
+        _poll_pending.clear()
+        close_old_connections()
+
+
+def _poll_loop(interval):
+    while True:
+        time.sleep(interval)
+        # Runnable retries and stale RUNNING jobs; skipped while the previous poll is still busy
+        if not _poll_pending.is_set():
+            _poll_pending.set()
+            _executor.submit(_poll_once)
+
+
+def _kick_worker(job_id):
+    """
+    Starts the job in the in-process pool (if enabled); otherwise run_track_jobs picks it up.
+    The first call also starts the poller that picks up retries and stale jobs later on.
+    """
+    global _executor
+    workers = getattr(settings, 'TRACK_JOB_WORKERS', 2)
+    if not workers:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='track-jobs')
+            interval = getattr(settings, 'TRACK_JOB_POLL_INTERVAL', 30)
+            if interval:
+                threading.Thread(target=_poll_loop, args=(interval,), name='track-jobs-poller', daemon=True).start()
+    _executor.submit(_run_in_thread, job_id)
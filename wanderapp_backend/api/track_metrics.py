@@ -0,0 +1,356 @@
+# api/track_metrics.py
+"""
+Vektorisierte Track-Berechnungen auf NumPy-Arrays (ein Durchlauf pro Track, keine Schleife pro Punkt).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000  # Mittlerer Erdradius, wie bisher in StageSerializer.get_track
+
+
+def haversine_distances(lon, lat):
+    """Great-circle distance in meters between consecutive points (length n-1)."""
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    dlon = np.diff(lon)
+    dlat = np.diff(lat)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def cumulative_distances(lon, lat, segment_starts=()):
+    """
+    Cumulative distance in meters along the track, starting at 0 (length n). The gap before
+    each index in ``segment_starts`` (start of a new GPX segment) does not count.
+    """
+    distances = np.zeros(len(lon), dtype=np.float64)
+    if len(lon) > 1:
+        steps = haversine_distances(lon, lat)
+        steps[np.asarray(segment_starts, dtype=np.intp) - 1] = 0.0
+        np.cumsum(steps, out=distances[1:])
+    return distances
+
+
+def segment_bounds(segment_starts, n):
+    """``(start, end)`` index ranges of the segments of an n-point track."""
+    bounds = [0, *(int(s) for s in segment_starts), n]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# --- Stage metrics (Länge, Höhenmeter, Dauer) ---
+# Gleiche Formeln wie gpxpy (geo.distance, calculate_uphill_downhill, get_duration, get_moving_data),
+# damit bestehende Werte vergleichbar bleiben, aber als ein vektorisierter Durchlauf über die Arrays.
+
+GPX_EARTH_RADIUS_M = 6378.137 * 1000
+ONE_DEGREE_M = (2 * np.pi * GPX_EARTH_RADIUS_M) / 360
+HAVERSINE_THRESHOLD_DEG = .2  # Weiter entfernte Punkte werden per Haversine gemessen
+STOPPED_SPEED_THRESHOLD_KMH = 1
+MAX_SPEED_WINDOW_SECONDS = 30  # Max speed is averaged over at least this long, single GPS jumps don't count
+PARALLEL_SEGMENT_POINTS = 200000  # Multi-segment tracks from this size compute their segments in threads
+SEGMENT_METRICS_WORKERS = 4
+
+_segment_executor = None
+_segment_executor_lock = threading.Lock()
+
+
+def _gpx_distances(lon, lat, ele=None):
+    """
+    Distance between consecutive points as gpxpy computes it: flat-earth approximation for
+    close points, haversine for points more than 0.2 degrees apart. With ``ele`` the distance
+    is 3D wherever both elevations are known.
+    """
+    dlat = lat[1:] - lat[:-1]
+    dlon = lon[1:] - lon[:-1]
+    coef = np.cos(np.radians(lat[1:]))
+    flat = np.sqrt(dlat * dlat + (dlon * coef) ** 2) * ONE_DEGREE_M
+    if ele is not None:
+        dele = ele[1:] - ele[:-1]
+        has_ele = ~np.isnan(dele)
+        flat = np.where(has_ele, np.sqrt(flat ** 2 + np.where(has_ele, dele, 0.0) ** 2), flat)
+
+    far = (np.abs(dlat) > HAVERSINE_THRESHOLD_DEG) | (np.abs(dlon) > HAVERSINE_THRESHOLD_DEG)
+    if not far.any():
+        return flat
+    rlat = np.radians(lat)
+    a = np.sin(np.radians(dlat) / 2) ** 2 + np.sin(np.radians(dlon) / 2) ** 2 * np.cos(rlat[:-1]) * np.cos(rlat[1:])
+    haversine = 2 * GPX_EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return np.where(far, haversine, flat)
+
+
+def uphill_downhill(ele):
+    """Smoothed elevation gain and loss in meters; unknown elevations are skipped."""
+    ele = ele[~np.isnan(ele)]
+    if len(ele) < 2:
+        return 0.0, 0.0
+    smoothed = ele.copy()
+    smoothed[1:-1] = ele[:-2] * .3 + ele[1:-1] * .4 + ele[2:] * .3
+    delta = np.diff(smoothed)
+    return float(delta[delta > 0].sum()), float(-delta[delta < 0].sum())
+
+
+def _window_speeds(time, distance):
+    """
+    Average speeds (m/s) from each point to the first point at least MAX_SPEED_WINDOW_SECONDS later
+    (``time`` ascending, ``distance`` cumulative). Also returns the index of the first point whose
+    window is still open, i.e. has no such later point yet.
+    """
+    ends = np.searchsorted(time, time + MAX_SPEED_WINDOW_SECONDS)
+    closed = np.flatnonzero(ends < len(time))
+    ends = ends[closed]
+    speeds = (distance[ends] - distance[closed]) / (time[ends] - time[closed])
+    return speeds, len(closed)
+
+
+def compute_track_metrics(lon, lat, ele=None, time=None, segment_starts=None):
+    """
+    Computes the stage metrics of a track from NumPy arrays (NaN = unknown elevation/time).
+
+    Returns a dict with ``length_2d`` and ``length_3d`` (meters), ``uphill`` and ``downhill``
+    (meters), ``duration`` (seconds between first and last timestamp, None without times),
+    ``moving_time``, ``stopped_time`` (seconds), ``moving_distance`` (meters) and ``max_speed``
+    (m/s over MAX_SPEED_WINDOW_SECONDS, None for shorter or untimed tracks).
+
+    With ``segment_starts`` (start indices of the GPX segments after the first) the metrics are
+    the combined metrics of the segments, see combine_metrics().
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    n = len(lon)
+    ele = np.full(n, np.nan) if ele is None else np.asarray(ele, dtype=np.float64)
+    time = np.full(n, np.nan) if time is None else np.asarray(time, dtype=np.float64)
+    if segment_starts is not None and len(segment_starts):
+        return combine_metrics(segment_metrics(lon, lat, ele, time, segment_starts))
+    return _segment_metrics(lon, lat, ele, time)
+
+
+def _segment_metrics(lon, lat, ele, time):
+    n = len(lon)
+    metrics = {
+        'length_2d': 0.0, 'length_3d': 0.0, 'uphill': 0.0, 'downhill': 0.0,
+        'duration': None, 'moving_time': 0.0, 'stopped_time': 0.0, 'moving_distance': 0.0,
+        'max_speed': None,
+    }
+    if n < 2:
+        metrics['duration'] = 0.0 if n else None
+        return metrics
+
+    distances_2d = _gpx_distances(lon, lat)
+    distances_3d = _gpx_distances(lon, lat, ele)
+    metrics['length_2d'] = float(distances_2d.sum())
+    metrics['length_3d'] = float(distances_3d.sum())
+    metrics['uphill'], metrics['downhill'] = uphill_downhill(ele)
+
+    timed = ~np.isnan(time)
+    if timed.any():
+        times = time[timed]
+        if times[-1] >= times[0]:
+            metrics['duration'] = float(times[-1] - times[0])
+
+        # Moving/stopped split per point pair (gpxpy: 3D only if both elevations are non-zero)
+        seconds = np.diff(time)
+        with_ele = (np.nan_to_num(ele[1:]) != 0) & (np.nan_to_num(ele[:-1]) != 0)
+        distance = np.where(with_ele, distances_3d, distances_2d)
+        path = np.concatenate(([0.0], np.cumsum(distance)))
+        speeds, _ = _window_speeds(np.maximum.accumulate(time[timed]), path[timed])
+        if len(speeds):
+            metrics['max_speed'] = float(speeds.max())
+        valid = ~np.isnan(seconds) & (seconds > 0) & (distance > 0)
+        seconds, distance = seconds[valid], distance[valid]
+        moving = (distance / 1000) / (seconds / 3600) > STOPPED_SPEED_THRESHOLD_KMH
+        metrics['moving_time'] = float(seconds[moving].sum())
+        metrics['stopped_time'] = float(seconds[~moving].sum())
+        metrics['moving_distance'] = float(distance[moving].sum())
+    return metrics
+
+
+def segment_metrics(lon, lat, ele, time, segment_starts):
+    """
+    compute_track_metrics() of each segment (list in track order). Large multi-segment tracks
+    (multi-day files) are split over a thread pool; the NumPy work releases the GIL.
+    """
+    global _segment_executor
+    bounds = segment_bounds(segment_starts, len(lon))
+    jobs = [(lon[a:b], lat[a:b], ele[a:b], time[a:b]) for a, b in bounds]
+    if len(jobs) < 2 or len(lon) < PARALLEL_SEGMENT_POINTS or (os.cpu_count() or 1) < 2:
+        return [_segment_metrics(*job) for job in jobs]
+    with _segment_executor_lock:
+        if _segment_executor is None:
+            _segment_executor = ThreadPoolExecutor(max_workers=SEGMENT_METRICS_WORKERS, thread_name_prefix='segment-metrics')
+    return list(_segment_executor.map(lambda job: _segment_metrics(*job), jobs))
+
+
+def combine_metrics(metrics_list):
+    """
+    Track metrics from the metrics of its segments, summed like gpxpy does for a multi-segment
+    track: the gaps between segments add neither distance nor time. ``duration`` is the sum of the
+    known segment durations (None if no segment has times), ``max_speed`` the highest of all segments.
+    """
+    combined = {
+        key: sum(m[key] for m in metrics_list)
+        for key in ('length_2d', 'length_3d', 'uphill', 'downhill', 'moving_time', 'stopped_time', 'moving_distance')
+    }
+    durations = [m['duration'] for m in metrics_list if m['duration'] is not None]
+    speeds = [m['max_speed'] for m in metrics_list if m['max_speed'] is not None]
+    combined['duration'] = sum(durations) if durations else None
+    combined['max_speed'] = max(speeds) if speeds else None
+    return combined
+
+
+# --- Laufende Summen für Live-Tracking ---
+# Der Zustand enthält nur Summen und die letzten Punkte; ein Append kostet O(Batch) statt O(Track)
+# und liefert dieselben Werte wie compute_track_metrics() über den ganzen Track.
+
+def _smoothed(window, offset, count):
+    """
+    Smoothed elevations (see uphill_downhill) of a window of known elevations starting at global
+    index ``offset`` of ``count`` known elevations. Endpoints of the whole track stay unsmoothed.
+    """
+    smoothed = window.copy()
+    for i in range(1, len(window) - 1):
+        smoothed[i] = window[i - 1] * .3 + window[i] * .4 + window[i + 1] * .3
+    if offset == 0:
+        smoothed[0] = window[0]
+    smoothed[-1] = window[-1]
+    return smoothed
+
+
+def update_running_metrics(state, lon, lat, ele=None, time=None):
+    """
+    Extends the running metrics ``state`` (None = empty track) by a batch of points and returns
+    the new JSON-serializable state. Use running_metrics() to read the totals; ``distance`` is
+    the last value of cumulative_distances().
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    n = len(lon)
+    ele = np.full(n, np.nan) if ele is None else np.asarray(ele, dtype=np.float64)
+    time = np.full(n, np.nan) if time is None else np.asarray(time, dtype=np.float64)
+    state = {
+        'point_count': 0, 'distance': 0.0, 'length_2d': 0.0, 'length_3d': 0.0,
+        'climb_up': 0.0, 'climb_down': 0.0, 'ele_count': 0, 'ele_tail': [],
+        'first_time': None, 'last_time': None,
+        'moving_time': 0.0, 'stopped_time': 0.0, 'moving_distance': 0.0,
+        'path': 0.0, 'speed_tail': [], 'max_speed': None,
+        'last_point': None,
+        **(state or {}),  # States stored before a key existed get its initial value
+    }
+    if not n:
+        return state
+
+    # Pairs between the previous last point and the batch
+    if state['last_point'] is not None:
+        last = [np.nan if v is None else v for v in state['last_point']]
+        lon, lat = np.insert(lon, 0, last[0]), np.insert(lat, 0, last[1])
+        ele, time = np.insert(ele, 0, last[2]), np.insert(time, 0, last[3])
+    if len(lon) > 1:
+        state['distance'] += float(haversine_distances(lon, lat).sum())
+        distances_2d = _gpx_distances(lon, lat)
+        distances_3d = _gpx_distances(lon, lat, ele)
+        state['length_2d'] += float(distances_2d.sum())
+        state['length_3d'] += float(distances_3d.sum())
+
+        seconds = np.diff(time)
+        with_ele = (np.nan_to_num(ele[1:]) != 0) & (np.nan_to_num(ele[:-1]) != 0)
+        distance = np.where(with_ele, distances_3d, distances_2d)
+        path = state['path'] + np.concatenate(([0.0], np.cumsum(distance)))
+        state['path'] = float(path[-1])
+        valid = ~np.isnan(seconds) & (seconds > 0) & (distance > 0)
+        seconds, distance = seconds[valid], distance[valid]
+        moving = (distance / 1000) / (seconds / 3600) > STOPPED_SPEED_THRESHOLD_KMH
+        state['moving_time'] += float(seconds[moving].sum())
+        state['stopped_time'] += float(seconds[~moving].sum())
+        state['moving_distance'] += float(distance[moving].sum())
+
+    # Elevation: climb_up/climb_down hold the deltas between smoothed values that can no longer
+    # change (all but the last known elevation); the last delta is added in running_metrics()
+    new_ele = ele[-n:][~np.isnan(ele[-n:])]
+    if len(new_ele):
+        tail = np.asarray(state['ele_tail'], dtype=np.float64)
+        count = state['ele_count'] + len(new_ele)
+        offset = state['ele_count'] - len(tail)
+        window = np.concatenate((tail, new_ele))
+        smoothed = _smoothed(window, offset, count)
+        # Final deltas end at global index max(old_count - 1, 1) .. count - 2
+        first = max(state['ele_count'] - 1, 1) - offset
+        delta = np.diff(smoothed[first - 1:-1])
+        state['climb_up'] += float(delta[delta > 0].sum())
+        state['climb_down'] += float(-delta[delta < 0].sum())
+        state['ele_count'] = count
+        state['ele_tail'] = window[-3:].tolist()
+
+    # Max speed: windows starting at the points of speed_tail are still open and may end in this batch
+    timed = ~np.isnan(time[-n:])
+    if timed.any():
+        path = path[-n:] if len(lon) > 1 else np.full(n, state['path'])
+        tail = np.asarray(state['speed_tail'], dtype=np.float64).reshape(-1, 2)
+        window_time = np.maximum.accumulate(np.concatenate((tail[:, 0], time[-n:][timed])))
+        window_path = np.concatenate((tail[:, 1], path[timed]))
+        speeds, open_from = _window_speeds(window_time, window_path)
+        if len(speeds):
+            state['max_speed'] = max(float(speeds.max()), state['max_speed'] or 0.0)
+        state['speed_tail'] = np.column_stack((window_time, window_path))[open_from:].tolist()
+
+    new_time = time[-n:][~np.isnan(time[-n:])]
+    if len(new_time):
+        if state['first_time'] is None:
+            state['first_time'] = float(new_time[0])
+        state['last_time'] = float(new_time[-1])
+
+    state['point_count'] += n
+    state['last_point'] = [None if np.isnan(v) else float(v) for v in (lon[-1], lat[-1], ele[-1], time[-1])]
+    return state
+
+
+def running_metrics(state):
+    """compute_track_metrics()-compatible totals of a running metrics state (None without points)."""
+    if not state or not state['point_count']:
+        return None
+    uphill, downhill = state['climb_up'], state['climb_down']
+    tail, count = np.asarray(state['ele_tail'], dtype=np.float64), state['ele_count']
+    if count >= 2:
+        smoothed = _smoothed(tail, count - len(tail), count)
+        last_delta = smoothed[-1] - smoothed[-2]
+        uphill += max(last_delta, 0.0)
+        downhill += max(-last_delta, 0.0)
+
+    duration = None
+    if state['first_time'] is not None and state['last_time'] >= state['first_time']:
+        duration = state['last_time'] - state['first_time']
+    elif state['point_count'] == 1:
+        duration = 0.0
+    metrics = {
+        'length_2d': state['length_2d'], 'length_3d': state['length_3d'],
+        'uphill': float(uphill), 'downhill': float(downhill), 'duration': duration,
+        'moving_time': state['moving_time'], 'stopped_time': state['stopped_time'],
+        'moving_distance': state['moving_distance'], 'max_speed': state['max_speed'],
+    }
+    if state.get('closed_metrics'):
+        # Multi-segment track: the state runs over the last segment, earlier segments are fixed
+        metrics = combine_metrics([state['closed_metrics'], metrics])
+    return metrics
+
+
+def stage_metric_fields(metrics):
+    """Maps compute_track_metrics() results onto the calculated_* fields of Stage (all None without a track)."""
+    if metrics is None:
+        return dict.fromkeys(('calculated_length_km', 'calculated_elevation_gain',
+                              'calculated_elevation_loss', 'calculated_duration',
+                              'calculated_moving_time', 'calculated_stopped_time',
+                              'calculated_avg_speed_kmh', 'calculated_max_speed_kmh'))
+    # Moving/stopped split and speeds need timestamps; without them they stay None like the duration
+    timed = metrics['duration'] is not None
+    moving_time = metrics['moving_time']
+    return {
+        'calculated_length_km': round(metrics['length_3d'] / 1000, 2),
+        'calculated_elevation_gain': round(metrics['uphill']),
+        'calculated_elevation_loss': round(metrics['downhill']),
+        'calculated_duration': timedelta(seconds=metrics['duration']) if metrics['duration'] else None,
+        'calculated_moving_time': timedelta(seconds=moving_time) if timed else None,
+        'calculated_stopped_time': timedelta(seconds=metrics['stopped_time']) if timed else None,
+        'calculated_avg_speed_kmh': round(metrics['moving_distance'] / moving_time * 3.6, 2) if moving_time else None,
+        'calculated_max_speed_kmh': round(metrics['max_speed'] * 3.6, 2) if metrics['max_speed'] is not None else None,
+    }
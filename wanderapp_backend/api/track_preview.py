@@ -0,0 +1,40 @@
+# api/track_preview.py
+"""
+Kurzlebiger Server-Cache für die GPX-Vorschau.
+
+``calculate-gpx`` legt den validierten Track gepackt im Django-Cache ab und gibt ein Token zurück;
+beim Erstellen/Bearbeiten der Etappe genügt dann ``track_token`` statt aller ``track_points``.
+Einträge laufen nach ``TRACK_PREVIEW_TIMEOUT`` ab bzw. werden vom Cache verdrängt – in dem Fall
+schickt das Frontend die Punkte wie bisher mit.
+"""
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .track_storage import FLOAT_DTYPE, PackedTrack, unpack_segment_starts
+
+
+def _cache_key(user, token):
+    # Bound to the user: tokens of other users are never found
+    return f'track-preview:{user.pk}:{token}'
+
+
+def store_preview_track(user, track):
+    """Caches ``track`` for ``user`` and returns the token."""
+    token = uuid.uuid4().hex
+    columns = np.vstack((track.lon, track.lat, track.ele, track.time)).astype(FLOAT_DTYPE).tobytes()
+    cache.set(_cache_key(user, token), (columns, track.segment_blob()),
+              timeout=getattr(settings, 'TRACK_PREVIEW_TIMEOUT', 1800))
+    return token
+
+
+def load_preview_track(user, token):
+    """PackedTrack for a preview token of ``user``; None if unknown or expired."""
+    cached = cache.get(_cache_key(user, token))
+    if cached is None:
+        return None
+    columns, segment_starts = cached
+    lon, lat, ele, time = np.frombuffer(columns, dtype=FLOAT_DTYPE).reshape(4, -1)
+    return PackedTrack(lon, lat, ele, time, segment_starts=unpack_segment_starts(segment_starts))
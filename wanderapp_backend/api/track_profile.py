@@ -0,0 +1,102 @@
+# api/track_profile.py
+"""
+Höhenprofil-Vorschau für ``GET /api/stages/{id}/elevation-profile/?points=N``.
+
+Ein Höhenprofil braucht nicht mehr Punkte als das Diagramm Pixel breit ist. Die Punkte werden mit
+Largest-Triangle-Three-Buckets (LTTB) ausgewählt, das Spitzen und Täler behält, wo gleichmässiges
+Ausdünnen sie verschlucken würde. Beim Import werden einige Auflösungen vorberechnet und in
+StageTrack.elevation_profiles abgelegt; Anfragen werden daraus bedient, ohne den Track zu laden.
+"""
+import numpy as np
+
+# Precomputed at ingest (number of points per profile)
+PROFILE_RESOLUTIONS = (250, 500, 1000, 2000)
+DEFAULT_PROFILE_POINTS = 500
+MAX_PROFILE_POINTS = 5000
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Indices of the ``threshold`` points chosen by Largest-Triangle-Three-Buckets for the series
+    ``(x, y)`` (x ascending). First and last point are always kept; all indices if the series is short.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        # No bucket between the endpoints
+        return np.array([0, n - 1][:max(threshold, 0)], dtype=np.intp)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Points 1..n-2 are split into threshold-2 buckets; one point is picked per bucket
+    every = (n - 2) / (threshold - 2)
+    bounds = (np.arange(threshold - 1) * every).astype(np.intp) + 1
+    bounds[-1] = n - 1
+    starts, ends = bounds[:-1], bounds[1:]
+
+    # Average of the following bucket (the last point for the last bucket), via prefix sums
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    avg_x = np.append((cum_x[ends] - cum_x[starts])[1:] / sizes[1:], x[-1])
+    avg_y = np.append((cum_y[ends] - cum_y[starts])[1:] / sizes[1:], y[-1])
+
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = starts[i], ends[i]
+        ax, ay = x[a], y[a]
+        # Twice the triangle area between the previous pick, each candidate and the next bucket average
+        areas = np.abs((ax - avg_x[i]) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y[i] - ay))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def lttb_profile(track, points):
+    """
+    Profile of a PackedTrack with at most ``points`` points: distances (m), elevations (m) and the
+    matching ``[lon, lat]`` coordinates for the map marker. Points without elevation are skipped.
+    """
+    valid = np.flatnonzero(~np.isnan(track.ele))
+    distances = track.distances[valid]
+    elevations = track.ele[valid]
+    keep = valid[lttb_indices(distances, elevations, points)]
+    return _profile_payload(track.distances[keep], track.ele[keep], track.lon[keep], track.lat[keep])
+
+
+def _profile_payload(distances, elevations, lon, lat):
+    return {
+        'distances': np.round(distances, 1).tolist(),
+        'elevations': np.round(elevations, 1).tolist(),
+        'coordinates': np.round(np.column_stack((lon, lat)), 6).tolist(),
+    }
+
+
+def precomputed_profiles(track):
+    """Profiles at every PROFILE_RESOLUTIONS level, stored in StageTrack.elevation_profiles (None without elevation)."""
+    if not track.has_elevation:
+        return None
+    return {str(resolution): lttb_profile(track, resolution) for resolution in PROFILE_RESOLUTIONS}
+
+
+def profile_from_precomputed(profiles, points):
+    """
+    Profile with at most ``points`` points from the stored levels: the smallest level with at least
+    ``points`` points is downsampled further. None if ``points`` exceeds every stored level.
+    """
+    for resolution in PROFILE_RESOLUTIONS:
+        profile = profiles.get(str(resolution))
+        if profile is None:
+            continue
+        if resolution >= points or len(profile['distances']) < resolution:
+            # A level shorter than its resolution already holds every point of the track
+            break
+    else:
+        return None
+    if len(profile['distances']) <= points:
+        return profile
+    keep = lttb_indices(profile['distances'], profile['elevations'], points)
+    return {key: [values[i] for i in keep] for key, values in profile.items()}
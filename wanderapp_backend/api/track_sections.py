@@ -0,0 +1,159 @@
+# api/track_sections.py
+"""
+Kilometer-Splits und Anstiege/Abstiege einer Etappe.
+
+Beide werden beim Track-Import einmal aus den gepackten Arrays abgeleitet und als wenige
+TrackSection-Zeilen gespeichert. Höhenmeter stammen aus denselben geglätteten Höhen wie
+calculated_elevation_gain, die Splits summieren sich also zu den Werten der Etappe.
+"""
+from datetime import timedelta
+from functools import partial
+
+import numpy as np
+
+from .models import TrackSection
+
+SPLIT_DISTANCE_M = 1000
+CLIMB_REVERSAL_M = 20  # Counter-movement that ends a climb/descent; smaller dips are part of it
+CLIMB_MIN_ELEVATION_M = 50
+CLIMB_MIN_GRADE = 3.0  # Percent
+
+
+def _smoothed_elevation(ele):
+    """Smoothing of track_metrics.uphill_downhill() on the known elevations."""
+    smoothed = ele.copy()
+    if len(ele) > 2:
+        smoothed[1:-1] = ele[:-2] * .3 + ele[1:-1] * .4 + ele[2:] * .3
+    return smoothed
+
+
+def _turning_points(ele, reversal):
+    """
+    Indices of the elevation extremes between which the profile moves by more than ``reversal``
+    meters in one direction (zig-zag filter), including first and last index.
+    """
+    # Only local extremes can become turning points, so the loop runs over those
+    steps = np.flatnonzero(np.diff(ele))
+    turns = np.flatnonzero(np.diff(np.sign(np.diff(ele)[steps])))
+    candidates = np.append(steps[turns] + 1, len(ele) - 1)
+
+    pivots = [0]
+    direction, low, high = 0, 0, 0
+    for i in candidates.tolist():
+        value = ele[i]
+        if direction == 0:
+            # No direction yet: the first move by more than ``reversal`` starts at the extreme before it
+            if value < ele[low]:
+                low = i
+            if value > ele[high]:
+                high = i
+            if ele[high] - ele[low] >= reversal:
+                direction = 1 if high > low else -1
+                start = low if direction == 1 else high
+                if start:
+                    pivots.append(start)
+                low = high = i
+        elif direction == 1:
+            if value >= ele[high]:
+                high = i
+            elif ele[high] - value >= reversal:
+                pivots.append(high)
+                direction, low = -1, i
+        else:
+            if value <= ele[low]:
+                low = i
+            elif value - ele[low] >= reversal:
+                pivots.append(low)
+                direction, high = 1, i
+    # The last climb/descent ends at its extreme, not at a smaller counter-movement after it
+    last = high if direction == 1 else low if direction == -1 else None
+    for i in (last, len(ele) - 1):
+        if i is not None and i != pivots[-1]:
+            pivots.append(i)
+    return np.asarray(pivots, dtype=np.intp)
+
+
+def _section(kind, position, start, end, gain_at, loss_at, ele_at, time_at):
+    elevation_change = ele_at(end) - ele_at(start)
+    seconds = time_at(end) - time_at(start) if time_at is not None else None
+    return TrackSection(
+        kind=kind, position=position,
+        start_distance=round(float(start), 1), end_distance=round(float(end), 1),
+        elevation_gain=round(float(gain_at(end) - gain_at(start)), 1),
+        elevation_loss=round(float(loss_at(end) - loss_at(start)), 1),
+        average_grade=round(float(elevation_change / (end - start) * 100), 1) if end > start else 0.0,
+        duration=timedelta(seconds=float(seconds)) if seconds is not None else None,
+    )
+
+
+def _segment_time(track, timed):
+    """
+    Monotonic timestamps of the ``timed`` points without the gaps between GPX segments, which
+    compute_track_metrics() leaves out of the duration as well (a night between two days).
+    """
+    time = np.maximum.accumulate(track.time[timed])
+    segment = np.zeros(len(track), dtype=np.intp)
+    segment[track.segment_starts] = 1
+    segment = np.cumsum(segment)[timed]
+    gaps = np.zeros(len(time))
+    gaps[1:] = np.where(np.diff(segment) > 0, np.diff(time), 0.0)
+    return time - np.cumsum(gaps)
+
+
+def compute_track_sections(track):
+    """
+    Unsaved TrackSection instances (without stage) for a PackedTrack: one SPLIT per started
+    kilometer and the CLIMB/DESCENT sections with at least CLIMB_MIN_ELEVATION_M meters
+    and CLIMB_MIN_GRADE percent average grade. Distances are the cumulative track distances.
+    """
+    if len(track) < 2:
+        return []
+    distances = track.distances
+    known = ~np.isnan(track.ele)
+    timed = ~np.isnan(track.time)
+
+    # Cumulative gain/loss of the smoothed elevations, interpolated at any distance
+    if known.sum() >= 2:
+        ele_distances, smoothed = distances[known], _smoothed_elevation(track.ele[known])
+        profile = smoothed
+    else:
+        ele_distances, smoothed = distances[[0, -1]], None
+        profile = np.zeros(2)
+    delta = np.diff(profile)
+    gain_at = partial(np.interp, xp=ele_distances, fp=np.concatenate(([0.0], np.cumsum(np.maximum(delta, 0.0)))))
+    loss_at = partial(np.interp, xp=ele_distances, fp=np.concatenate(([0.0], np.cumsum(np.maximum(-delta, 0.0)))))
+    ele_at = partial(np.interp, xp=ele_distances, fp=profile)
+    time_at = None
+    if timed.sum() >= 2:
+        time_at = partial(np.interp, xp=distances[timed], fp=_segment_time(track, timed))
+
+    total = float(distances[-1])
+    bounds = np.append(np.arange(0, total, SPLIT_DISTANCE_M), total)
+    sections = [
+        _section(TrackSection.SPLIT, i, start, end, gain_at, loss_at, ele_at, time_at)
+        for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+
+    if smoothed is not None:
+        pivots = _turning_points(smoothed, CLIMB_REVERSAL_M)
+        position = {TrackSection.CLIMB: 0, TrackSection.DESCENT: 0}
+        for start, end in zip(pivots[:-1], pivots[1:]):
+            change = smoothed[end] - smoothed[start]
+            length = ele_distances[end] - ele_distances[start]
+            if abs(change) < CLIMB_MIN_ELEVATION_M or not length or abs(change) / length * 100 < CLIMB_MIN_GRADE:
+                continue
+            kind = TrackSection.CLIMB if change > 0 else TrackSection.DESCENT
+            sections.append(_section(kind, position[kind], ele_distances[start], ele_distances[end],
+                                     gain_at, loss_at, ele_at, time_at))
+            position[kind] += 1
+    return sections
+
+
+def replace_track_sections(stage, track):
+    """Replaces the stored sections of a stage with those of ``track`` (None = delete them)."""
+    TrackSection.objects.filter(stage=stage).delete()
+    sections = compute_track_sections(track) if track is not None else []
+    for section in sections:
+        section.stage = stage
+    TrackSection.objects.bulk_create(sections)
+    return sections
@@ -0,0 +1,80 @@
+# api/track_simplification.py
+"""
+Douglas-Peucker-Pyramide für Etappen-Tracks.
+
+Statt für jede Toleranz eine eigene vereinfachte Kopie zu speichern, wird beim Import einmal pro
+Punkt seine "Signifikanz" berechnet: die Toleranz in Metern, bis zu der Douglas-Peucker den Punkt
+behält. Jede Detailstufe ist danach nur noch eine Maske ``significance > tolerance``.
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
+
+# Named detail levels for ?lod= (tolerance in meters; 0 = every point)
+LOD_TOLERANCES = {
+    'full': 0,
+    'high': 5,
+    'medium': 25,
+    'low': 100,
+}
+
+
+def _project(lon, lat):
+    """Local equirectangular projection to meters around the mean latitude."""
+    coef = np.cos(np.radians(np.mean(lat)))
+    return np.radians(lon) * coef * EARTH_RADIUS_M, np.radians(lat) * EARTH_RADIUS_M
+
+
+def _segment_distances(x, y, start, end):
+    """Distances in meters of the points between start and end to the segment start-end."""
+    px, py = x[start + 1:end], y[start + 1:end]
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return np.hypot(px - x[start], py - y[start])
+    t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length_sq, 0.0, 1.0)
+    return np.hypot(px - (x[start] + t * dx), py - (y[start] + t * dy))
+
+
+def douglas_peucker_significance(lon, lat):
+    """
+    Per-point tolerance (meters) up to which Douglas-Peucker keeps the point. Endpoints are inf.
+    A point's value never exceeds the value of the split point above it, so
+    ``significance > tolerance`` yields exactly the Douglas-Peucker simplification at that tolerance.
+    """
+    n = len(lon)
+    significance = np.full(n, np.inf, dtype=np.float64)
+    if n < 3:
+        return significance
+    x, y = _project(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        start, end, parent = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _segment_distances(x, y, start, end)
+        split = int(np.argmax(distances))
+        value = min(float(distances[split]), parent)
+        split += start + 1
+        significance[split] = value
+        stack.append((start, split, value))
+        stack.append((split, end, value))
+    return significance
+
+
+def resolve_tolerance(lod=None, tolerance=None):
+    """
+    Tolerance in meters for the ``lod``/``tolerance`` query parameters (None = full track).
+    Raises ValueError for unknown levels or invalid numbers.
+    """
+    if tolerance not in (None, ''):
+        value = float(tolerance)
+        if not np.isfinite(value) or value < 0:
+            raise ValueError("tolerance must be a non-negative number of meters")
+        return value or None
+    if lod not in (None, ''):
+        if lod not in LOD_TOLERANCES:
+            raise ValueError(f"lod must be one of: {', '.join(LOD_TOLERANCES)}")
+        return LOD_TOLERANCES[lod] or None
+    return None
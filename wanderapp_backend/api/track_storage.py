@@ -0,0 +1,591 @@
+# api/track_storage.py
+"""
+Kompakte Track-Speicherung pro Etappe.
+
+Ein Track wird spaltenweise als NumPy-Arrays gehalten (lon, lat, ele, time) und als
+gepackte Little-Endian-Blobs in einer einzigen StageTrack-Zeile gespeichert. Lesen und
+Schreiben kommen ohne eine Model-Instanz pro GPS-Punkt aus.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import LineString, Point, Polygon
+from django.contrib.gis.db.models import BinaryField, F, Func, LineStringField, Value
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Stage, StageTrack, TrackPoint, TrackSection
+from .track_metrics import (
+    combine_metrics, compute_track_metrics, cumulative_distances, running_metrics, segment_bounds, segment_metrics,
+    stage_metric_fields, update_running_metrics,
+)
+from .track_binary import encode_track
+from .track_profile import precomputed_profiles
+from .track_sections import replace_track_sections
+from .track_simplification import douglas_peucker_significance
+
+FLOAT_DTYPE = np.dtype('<f8')
+INDEX_DTYPE = np.dtype('<u4')
+
+# Result of save_track()
+TRACK_UNCHANGED = 'unchanged'
+TRACK_APPENDED = 'appended'
+TRACK_REPLACED = 'replaced'
+TRACK_CLEARED = 'cleared'
+
+
+def track_content_hash(coordinates, elevations, timestamps, segment_starts=b''):
+    """
+    SHA-256 over the packed coordinate, elevation and timestamp blobs of a track, plus the
+    segment starts of multi-segment tracks (single-segment hashes stay the same as before).
+    """
+    digest = hashlib.sha256()
+    for blob in (coordinates, elevations, timestamps, segment_starts):
+        digest.update(bytes(blob))
+    return digest.hexdigest()
+
+
+def pack_segment_starts(segment_starts):
+    return np.asarray(segment_starts).astype(INDEX_DTYPE).tobytes()
+
+
+def unpack_segment_starts(data):
+    return np.frombuffer(data or b'', dtype=INDEX_DTYPE).astype(np.intp)
+
+
+class PackedTrack:
+    """
+    Column-oriented track: longitude, latitude, elevation (NaN = unknown) and
+    Unix timestamp in seconds (NaN = unknown) as float64 arrays of equal length.
+    ``segment_starts`` holds the indices where a new GPX segment (``trkseg``) begins, without
+    the first one; it is empty for single-segment tracks.
+    Cumulative distances and Douglas-Peucker significances are computed once on demand
+    and persisted with the track.
+    """
+    __slots__ = ('lon', 'lat', 'ele', 'time', 'segment_starts', '_distances', '_significance')
+
+    def __init__(self, lon, lat, ele=None, time=None, distances=None, significance=None, segment_starts=None):
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        n = len(self.lon)
+        self.ele = np.full(n, np.nan) if ele is None else np.asarray(ele, dtype=np.float64)
+        self.time = np.full(n, np.nan) if time is None else np.asarray(time, dtype=np.float64)
+        starts = np.unique(np.asarray(segment_starts if segment_starts is not None else (), dtype=np.intp))
+        self.segment_starts = starts[(starts > 0) & (starts < n)]
+        self._distances = distances if distances is not None and len(distances) == n else None
+        self._significance = significance if significance is not None and len(significance) == n else None
+
+    def __len__(self):
+        return len(self.lon)
+
+    @classmethod
+    def from_points(cls, points):
+        """
+        Build from ``{lat, lon, ele, time, segment}`` dicts, either validated by TrackPointCreateSerializer
+        or raw request JSON (time as ISO 8601 string). A new segment starts wherever ``segment`` changes.
+        """
+        n = len(points)
+        lon = np.fromiter((p['lon'] for p in points), dtype=np.float64, count=n)
+        lat = np.fromiter((p['lat'] for p in points), dtype=np.float64, count=n)
+        ele = np.fromiter(
+            (np.nan if p.get('ele') is None else p['ele'] for p in points), dtype=np.float64, count=n
+        )
+        time = np.fromiter((_timestamp(p.get('time')) for p in points), dtype=np.float64, count=n)
+        segments = np.fromiter((p.get('segment') or 0 for p in points), dtype=np.int64, count=n)
+        return cls(lon, lat, ele, time, segment_starts=np.flatnonzero(np.diff(segments)) + 1)
+
+    @classmethod
+    def from_model(cls, packed):
+        """Unpacks the blobs of a StageTrack row (zero-copy views on the buffers)."""
+        coords = np.frombuffer(packed.coordinates, dtype=FLOAT_DTYPE).reshape(-1, 2)
+        return cls(
+            coords[:, 0], coords[:, 1],
+            np.frombuffer(packed.elevations, dtype=FLOAT_DTYPE),
+            np.frombuffer(packed.timestamps, dtype=FLOAT_DTYPE),
+            np.frombuffer(packed.distances or b'', dtype=FLOAT_DTYPE),
+            np.frombuffer(packed.significance or b'', dtype=FLOAT_DTYPE),
+            unpack_segment_starts(packed.segment_starts),
+        )
+
+    def packed_blobs(self):
+        """``(coordinates, elevations, timestamps)`` as packed little-endian bytes."""
+        coords = np.column_stack((self.lon, self.lat)).astype(FLOAT_DTYPE, copy=False)
+        return (
+            coords.tobytes(),
+            self.ele.astype(FLOAT_DTYPE, copy=False).tobytes(),
+            self.time.astype(FLOAT_DTYPE, copy=False).tobytes(),
+        )
+
+    def concat(self, other, new_segment=False):
+        """New track with the points of ``other`` appended (continuing the last segment unless ``new_segment``)."""
+        starts = other.segment_starts + len(self)
+        if new_segment:
+            starts = np.insert(starts, 0, len(self))
+        return PackedTrack(
+            np.concatenate((self.lon, other.lon)), np.concatenate((self.lat, other.lat)),
+            np.concatenate((self.ele, other.ele)), np.concatenate((self.time, other.time)),
+            segment_starts=np.concatenate((self.segment_starts, starts)),
+        )
+
+    def running_metrics_state(self, state=None):
+        """
+        update_running_metrics() state after appending this track to ``state``. For a multi-segment
+        track without ``state`` the running totals cover the last segment; the metrics of the earlier
+        segments are kept as ``closed_metrics``, since live points only ever extend the last segment.
+        """
+        if state is not None or not len(self.segment_starts):
+            return update_running_metrics(state, self.lon, self.lat, self.ele, self.time)
+        last = int(self.segment_starts[-1])
+        state = update_running_metrics(None, self.lon[last:], self.lat[last:], self.ele[last:], self.time[last:])
+        state['closed_metrics'] = combine_metrics(self.segment_metrics()[:-1])
+        state['distance'] += float(self.distances[last])
+        return state
+
+    def segment_blob(self):
+        """Segment starts as packed uint32 (empty for single-segment tracks)."""
+        return pack_segment_starts(self.segment_starts)
+
+    def segments(self):
+        """``(start, end)`` index ranges of the segments."""
+        return segment_bounds(self.segment_starts, len(self))
+
+    def content_hash(self):
+        return track_content_hash(*self.packed_blobs(), self.segment_blob())
+
+    def to_model_fields(self):
+        """Field values of the StageTrack row for this track."""
+        coordinates, elevations, timestamps = self.packed_blobs()
+        segment_starts = self.segment_blob()
+        return {
+            'point_count': len(self),
+            'coordinates': coordinates,
+            'elevations': elevations,
+            'timestamps': timestamps,
+            'segment_starts': segment_starts,
+            'segment_metrics': self.segment_summaries() if len(self.segment_starts) else None,
+            'content_hash': track_content_hash(coordinates, elevations, timestamps, segment_starts),
+            'metrics_state': None,
+            'elevation_profiles': precomputed_profiles(self),
+            'distances': self.distances.astype(FLOAT_DTYPE, copy=False).tobytes(),
+            'significance': self.significance.astype(FLOAT_DTYPE, copy=False).tobytes(),
+            'geometry': self.linestring(),
+        }
+
+    def starts_with(self, other):
+        """True if ``other`` is a strict prefix of this track (same points and segments, in order)."""
+        n = len(other)
+        return 0 < n < len(self) and np.array_equal(self.segment_starts[self.segment_starts < n], other.segment_starts) and all(
+            np.array_equal(mine[:n], theirs, equal_nan=True)
+            for mine, theirs in ((self.lon, other.lon), (self.lat, other.lat), (self.ele, other.ele), (self.time, other.time))
+        )
+
+    def extend_distances(self, prefix):
+        """Reuses the cumulative distances of ``prefix`` and only computes the appended part."""
+        n = len(prefix)
+        starts = self.segment_starts[self.segment_starts >= n] - (n - 1)
+        tail = cumulative_distances(self.lon[n - 1:], self.lat[n - 1:], starts)[1:] + prefix.distances[-1]
+        self._distances = np.concatenate((prefix.distances, tail))
+
+    def tail(self, start):
+        """Track of the points from index ``start`` on."""
+        return PackedTrack(self.lon[start:], self.lat[start:], self.ele[start:], self.time[start:])
+
+    @property
+    def distances(self):
+        """Cumulative distance in meters from the first point."""
+        if self._distances is None:
+            self._distances = cumulative_distances(self.lon, self.lat, self.segment_starts)
+        return self._distances
+
+    @property
+    def significance(self):
+        """
+        Douglas-Peucker tolerance in meters up to which each point is kept (inf = endpoint).
+        Segments are simplified separately, so their endpoints are kept at every tolerance.
+        """
+        if self._significance is None:
+            if not len(self.segment_starts):
+                self._significance = douglas_peucker_significance(self.lon, self.lat)
+            else:
+                self._significance = np.concatenate([
+                    douglas_peucker_significance(self.lon[a:b], self.lat[a:b]) for a, b in self.segments()
+                ])
+        return self._significance
+
+    @property
+    def has_elevation(self):
+        return bool(len(self)) and not np.isnan(self.ele).all()
+
+    @property
+    def has_time(self):
+        return bool(len(self)) and not np.isnan(self.time).all()
+
+    def linestring(self):
+        """PostGIS LineString of the track (None for fewer than two points)."""
+        if len(self) < 2:
+            return None
+        return LineString(np.column_stack((self.lon, self.lat)), srid=4326)
+
+    def stage_geometry_fields(self):
+        """Values for the materialized Stage.track_envelope/track_start/track_end columns."""
+        if not len(self):
+            return {'track_envelope': None, 'track_start': None, 'track_end': None}
+        envelope = Polygon.from_bbox((self.lon.min(), self.lat.min(), self.lon.max(), self.lat.max()))
+        envelope.srid = 4326
+        return {
+            'track_envelope': envelope,
+            'track_start': Point(self.lon[0], self.lat[0], srid=4326),
+            'track_end': Point(self.lon[-1], self.lat[-1], srid=4326),
+        }
+
+    def metrics(self):
+        """Length, elevation gain/loss and durations, see track_metrics.compute_track_metrics()."""
+        return compute_track_metrics(self.lon, self.lat, self.ele, self.time, self.segment_starts)
+
+    def segment_metrics(self):
+        """compute_track_metrics() of each segment, in track order."""
+        return segment_metrics(self.lon, self.lat, self.ele, self.time, self.segment_starts)
+
+    def segment_summaries(self):
+        """Per-segment metrics as stored in StageTrack.segment_metrics, see segment_summary()."""
+        return [
+            segment_summary(start, end - start, self.distances[start], metrics)
+            for (start, end), metrics in zip(self.segments(), self.segment_metrics())
+        ]
+
+    def simplified_mask(self, tolerance=None):
+        """Boolean mask of the points kept at the given tolerance in meters (None = all points)."""
+        if not tolerance:
+            return np.ones(len(self), dtype=bool)
+        return self.significance > tolerance
+
+    def to_payload(self, tolerance=None):
+        """
+        The ``track`` payload of StageSerializer: GeoJSON LineString plus elevation/distance arrays,
+        optionally simplified to ``tolerance`` meters. Distances stay the ones of the full track.
+        ``segment_starts`` are indices into the returned coordinates (empty for a single segment).
+        """
+        mask = self.simplified_mask(tolerance)
+        ele = self.ele[mask]
+        return {
+            'type': 'LineString',
+            'coordinates': np.column_stack((self.lon[mask], self.lat[mask])).tolist(),
+            'elevations': np.where(np.isnan(ele), None, ele).tolist(),
+            'distances': np.round(self.distances[mask], 2).tolist(),
+            'segment_starts': self._masked_segment_starts(mask).tolist(),
+        }
+
+    def to_binary(self, tolerance=None):
+        """Binary representation of the (optionally simplified) track, see api.track_binary."""
+        mask = self.simplified_mask(tolerance)
+        return encode_track(self.lon[mask], self.lat[mask], self.ele[mask], self.distances[mask],
+                            self._masked_segment_starts(mask))
+
+    def _masked_segment_starts(self, mask):
+        # Segment starts have significance inf and are therefore always part of the mask
+        return np.searchsorted(np.flatnonzero(mask), self.segment_starts)
+
+    def datetimes(self):
+        """Timestamps as aware UTC datetimes (None where unknown)."""
+        return [None if np.isnan(t) else datetime.fromtimestamp(t, tz=dt_timezone.utc) for t in self.time]
+
+    def iter_points(self):
+        """Yield ``(lon, lat, ele, datetime)`` tuples; only meant for legacy/export paths."""
+        eles = [None if np.isnan(e) else float(e) for e in self.ele]
+        return zip(self.lon.tolist(), self.lat.tolist(), eles, self.datetimes())
+
+
+def segment_summary(start, point_count, start_distance, metrics):
+    """JSON summary of one segment: position in the track plus its stage_metric_fields() (durations in seconds)."""
+    fields = stage_metric_fields(metrics)
+    timed = metrics['duration'] is not None
+    return {
+        'start_index': int(start),
+        'point_count': int(point_count),
+        'start_distance': round(float(start_distance), 1),
+        'length_km': fields['calculated_length_km'],
+        'elevation_gain': fields['calculated_elevation_gain'],
+        'elevation_loss': fields['calculated_elevation_loss'],
+        'duration': metrics['duration'],
+        'moving_time': metrics['moving_time'] if timed else None,
+        'avg_speed_kmh': fields['calculated_avg_speed_kmh'],
+        'max_speed_kmh': fields['calculated_max_speed_kmh'],
+    }
+
+
+def _timestamp(value):
+    """Unix seconds of a datetime or ISO 8601 string; NaN if missing. Naive values are UTC."""
+    if not value:
+        return np.nan
+    if isinstance(value, str):
+        value = parse_datetime(value)
+        if value is None:
+            raise ValueError("Invalid track point time")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value.timestamp()
+
+
+def load_track(stage):
+    """
+    Returns the PackedTrack of a stage or None. Stages that were not migrated yet
+    fall back to their legacy TrackPoint rows.
+    """
+    try:
+        packed = stage.packed_track
+    except StageTrack.DoesNotExist:
+        packed = None
+    if packed is not None:
+        if not packed.point_count:
+            return None
+        return PackedTrack.from_model(packed)
+    return load_legacy_track(stage)
+
+
+def load_legacy_track(stage):
+    rows = list(
+        TrackPoint.objects.filter(stage=stage).order_by('timestamp', 'id')
+        .values_list('location', 'elevation', 'timestamp')
+    )
+    if not rows:
+        return None
+    return PackedTrack(
+        [loc.x for loc, _, _ in rows],
+        [loc.y for loc, _, _ in rows],
+        [np.nan if ele is None else ele for _, ele, _ in rows],
+        [np.nan if ts is None else ts.timestamp() for _, _, ts in rows],
+    )
+
+
+def _stored_track(stage):
+    try:
+        packed = stage.packed_track
+    except StageTrack.DoesNotExist:
+        return None
+    return packed
+
+
+def _write_legacy_points(stage, track):
+    TrackPoint.objects.bulk_create(
+        (
+            TrackPoint(stage=stage, location=Point(lon, lat, srid=4326), elevation=ele, timestamp=ts)
+            for lon, lat, ele, ts in track.iter_points()
+        ),
+        batch_size=2000,
+    )
+
+
+@transaction.atomic
+def save_track(stage, track):
+    """
+    Stores ``track`` as the track of a stage (None/empty clears it) and returns what happened:
+    TRACK_UNCHANGED if the content hash matches the stored track, TRACK_APPENDED if the stored
+    track is a prefix of the new one (only the new points are written), otherwise TRACK_REPLACED
+    or TRACK_CLEARED. Legacy TrackPoint rows are only written when TRACKPOINT_LEGACY_ROWS is enabled.
+    """
+    legacy_rows = getattr(settings, 'TRACKPOINT_LEGACY_ROWS', False)
+    if track is None or not len(track):
+        TrackPoint.objects.filter(stage=stage).delete()
+        StageTrack.objects.filter(stage=stage).delete()
+        stage._state.fields_cache.pop('packed_track', None)
+        update_stage_geometry(stage, None)
+        replace_track_sections(stage, None)
+        return TRACK_CLEARED
+
+    packed = _stored_track(stage)
+    if packed is not None and packed.point_count:
+        if packed.content_hash and packed.content_hash == track.content_hash():
+            return TRACK_UNCHANGED
+        stored = PackedTrack.from_model(packed)
+        if track.starts_with(stored):
+            track.extend_distances(stored)
+            write_packed_track(stage, track)
+            if legacy_rows:
+                _write_legacy_points(stage, track.tail(len(stored)))
+            return TRACK_APPENDED
+
+    TrackPoint.objects.filter(stage=stage).delete()
+    write_packed_track(stage, track)
+    if legacy_rows:
+        _write_legacy_points(stage, track)
+    return TRACK_REPLACED
+
+
+def write_packed_track(stage, track):
+    """Creates or updates the StageTrack row and the derived TrackSection rows; TrackPoint rows are left untouched."""
+    packed, _ = StageTrack.objects.update_or_create(stage=stage, defaults=track.to_model_fields())
+    stage.packed_track = packed
+    update_stage_geometry(stage, track)
+    replace_track_sections(stage, track)
+    return packed
+
+
+def update_stage_geometry(stage, track):
+    """Writes envelope/start/end of ``track`` (None = clear) to the stage row and instance."""
+    fields = (track if track is not None else PackedTrack([], [])).stage_geometry_fields()
+    Stage.objects.filter(pk=stage.pk).update(**fields)
+    for field, value in fields.items():
+        setattr(stage, field, value)
+
+
+def _append_blob(field, data):
+    # bytea concatenation in the database; the stored blob never travels to Python
+    return Func(F(field), Value(data, output_field=BinaryField()), template='(%(expressions)s)',
+                arg_joiner=' || ', output_field=BinaryField())
+
+
+@transaction.atomic
+def append_track(stage, batch, first_segment=None, last_segment=None):
+    """
+    Appends a batch of live-tracking points to the stage track and updates the calculated_* fields
+    from running totals (StageTrack.metrics_state). Cost is O(batch): the blobs are extended
+    in the database and no stored point is read. Appended points get significance inf, so they
+    are kept at every detail level until the next full write recomputes the pyramid. Until then the
+    elevation profile is computed from the full track, and splits/climbs (TrackSection) are missing.
+
+    ``first_segment``/``last_segment`` are the ``segment`` values of the first and last point of the
+    batch (see PackedTrack.from_points); a batch whose first value differs from the last appended
+    one starts a new segment.
+    """
+    # Only the fields the incremental path needs; the blobs stay in the database
+    packed = (
+        StageTrack.objects.select_for_update().filter(stage=stage)
+        .only('pk', 'point_count', 'metrics_state', 'segment_metrics').first()
+    )
+    stage._state.fields_cache.pop('packed_track', None)
+    state = packed.metrics_state if packed is not None else None
+    new_segment = (
+        first_segment is not None and state is not None
+        and state.get('last_segment') is not None and state['last_segment'] != first_segment
+    )
+
+    if packed is None or packed.point_count < 2 or state is None:
+        # Empty, single-point or pre-existing track: one full write, from then on incremental
+        stored = None
+        if packed is not None and packed.point_count:
+            stored = PackedTrack.from_model(StageTrack.objects.get(pk=packed.pk))
+        if stored is None and packed is None:
+            stored = load_legacy_track(stage)
+        track = stored.concat(batch, new_segment) if stored is not None else batch
+        state = track.running_metrics_state()
+        state.update(last_segment=last_segment, track_point_count=len(track))
+        save_track(stage, track)
+        StageTrack.objects.filter(stage=stage).update(metrics_state=state)
+    else:
+        point_count = packed.point_count
+        last_lon, last_lat = state['last_point'][:2]
+        # Index 0 is the last stored point; a segment start there drops the step across the gap
+        starts = batch.segment_starts + 1
+        if new_segment:
+            starts = np.insert(starts, 0, 1)
+        distances = cumulative_distances(
+            np.insert(batch.lon, 0, last_lon), np.insert(batch.lat, 0, last_lat), starts,
+        )[1:]
+        distances += state['distance']
+        coordinates, elevations, timestamps = batch.packed_blobs()
+        line = LineString([(last_lon, last_lat)] + list(zip(batch.lon.tolist(), batch.lat.tolist())), srid=4326)
+        state, segments = _append_running_metrics(
+            state, packed.segment_metrics, batch, point_count, starts - 1,
+        )
+        # ``point_count`` of the state only counts the running (last) segment
+        state.update(last_segment=last_segment, track_point_count=point_count + len(batch))
+        blobs = {}
+        if len(starts):
+            blobs['segment_starts'] = _append_blob('segment_starts', pack_segment_starts(starts - 1 + point_count))
+        StageTrack.objects.filter(pk=packed.pk).update(
+            point_count=F('point_count') + len(batch),
+            coordinates=_append_blob('coordinates', coordinates),
+            elevations=_append_blob('elevations', elevations),
+            timestamps=_append_blob('timestamps', timestamps),
+            distances=_append_blob('distances', distances.astype(FLOAT_DTYPE).tobytes()),
+            significance=_append_blob('significance', np.full(len(batch), np.inf, dtype=FLOAT_DTYPE).tobytes()),
+            geometry=Func(F('geometry'), Value(line, output_field=LineStringField(srid=4326)),
+                          function='ST_MakeLine', output_field=LineStringField(srid=4326)),
+            content_hash='',
+            metrics_state=state,
+            elevation_profiles=None,
+            segment_metrics=segments,
+            updated_at=timezone.now(),
+            **blobs,
+        )
+        TrackSection.objects.filter(stage=stage).delete()
+        if getattr(settings, 'TRACKPOINT_LEGACY_ROWS', False):
+            _write_legacy_points(stage, batch)
+
+        # Envelope grows by the batch, the start point stays
+        fields = batch.stage_geometry_fields()
+        if stage.track_envelope is not None:
+            fields['track_envelope'] = _bbox_union(stage.track_envelope, fields['track_envelope'])
+        if stage.track_start is not None:
+            del fields['track_start']
+        Stage.objects.filter(pk=stage.pk).update(**fields)
+        for field, value in fields.items():
+            setattr(stage, field, value)
+
+    metric_fields = stage_metric_fields(running_metrics(state))
+    Stage.objects.filter(pk=stage.pk).update(**metric_fields)
+    for field, value in metric_fields.items():
+        setattr(stage, field, value)
+    return state
+
+
+def _append_running_metrics(state, segments, batch, point_count, starts):
+    """
+    Running state and segment_metrics after appending ``batch`` to a stored track of ``point_count``
+    points. ``starts`` are the batch indices where a new segment begins (0 = right at the batch start).
+    Each new segment closes the running totals into ``closed_metrics`` and starts fresh ones, so the
+    state ends up as PackedTrack.running_metrics_state() of the whole track would.
+    """
+    if segments:
+        last = segments[-1]
+        closed, start_index, start_distance = segments[:-1], last['start_index'], last['start_distance']
+    else:
+        closed, start_index, start_distance = [], 0, 0.0
+    bounds = [0, *(int(start) for start in starts), len(batch)]
+    for index, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if index:
+            # Segment boundary before ``begin``
+            closed.append(segment_summary(
+                start_index, point_count + begin - start_index, start_distance,
+                running_metrics({**state, 'closed_metrics': None}),
+            ))
+            start_index, start_distance = point_count + begin, state['distance']
+            state = {'distance': state['distance'], 'closed_metrics': running_metrics(state)}
+        if end > begin:
+            state = update_running_metrics(state, batch.lon[begin:end], batch.lat[begin:end],
+                                           batch.ele[begin:end], batch.time[begin:end])
+    if not closed:
+        return state, None
+    return state, closed + [segment_summary(
+        start_index, point_count + len(batch) - start_index, start_distance,
+        running_metrics({**state, 'closed_metrics': None}),
+    )]
+
+
+def _bbox_union(a, b):
+    (a_min_lon, a_min_lat, a_max_lon, a_max_lat), (b_min_lon, b_min_lat, b_max_lon, b_max_lat) = a.extent, b.extent
+    envelope = Polygon.from_bbox((min(a_min_lon, b_min_lon), min(a_min_lat, b_min_lat),
+                                  max(a_max_lon, b_max_lon), max(a_max_lat, b_max_lat)))
+    envelope.srid = 4326
+    return envelope
+
+
+def ingest_track(stage, track):
+    """
+    Stores a new track for a stage and updates its calculated_* fields in one go.
+    Shared by the JSON (track_points) and the GPX upload path. Returns the save_track() result.
+    """
+    result = save_track(stage, track)
+    if result == TRACK_UNCHANGED:
+        # Same points re-sent with an edit of other stage fields: metrics are still valid
+        return result
+    # Vectorized metrics on the packed arrays instead of a gpxpy object graph per point
+    fields = stage_metric_fields(track.metrics() if track is not None and len(track) else None)
+    for field, value in fields.items():
+        setattr(stage, field, value)
+    # Only the computed fields: runs in a track job, concurrent edits of the stage must survive
+    stage.save(update_fields=list(fields))
+    return result
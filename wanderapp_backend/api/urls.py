@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TripViewSet, StageViewSet, UserStatsView, CommentViewSet, HutViewSet, UserViewSet, DashboardDataView, DashboardOverviewView, PhotoViewSet, SurfboardViewSet, SurfSpotViewSet, CountriesAPIView, search_suggestions, calculate_gpx_metrics
+from .views import TripViewSet, StageViewSet, UserStatsView, CommentViewSet, HutViewSet, UserViewSet, DashboardDataView, DashboardOverviewView, PhotoViewSet, SurfboardViewSet, SurfSpotViewSet, CountriesAPIView, TrackTileView, search_suggestions, calculate_gpx_metrics, calculate_gpx_metrics_batch, stage_live_stream, trip_live_stream
 
 router = DefaultRouter()
 router.register(r'trips', TripViewSet, basename='trip')
@@ -27,4 +27,10 @@ urlpatterns = [
     path('search-suggestions/', search_suggestions, name='search-suggestions'),
     # GPX calculations API
     path('calculate-gpx/', calculate_gpx_metrics, name='calculate-gpx'),
+    path('calculate-gpx/batch/', calculate_gpx_metrics_batch, name='calculate-gpx-batch'),
+    # Live tracking streams (SSE)
+    path('stages/<int:pk>/live/', stage_live_stream, name='stage-live'),
+    path('trips/<int:pk>/live/', trip_live_stream, name='trip-live'),
+    # Vector tiles with all stage tracks
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', TrackTileView.as_view(), name='track-tiles'),
 ]
\ No newline at end of file
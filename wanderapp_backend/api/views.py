@@ -6,18 +6,37 @@ from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.db.models import Sum, Count, Value, FloatField, DurationField, Q, Case, When, Avg, Min, Max, Subquery, OuterRef
-from django.db.models.functions import Coalesce
+from rest_framework.settings import api_settings
+from django.db.models import Sum, Count, Value, FloatField, DurationField, Q, Case, When, Avg, Min, Max, Subquery, OuterRef, F
+from django.db.models.functions import Coalesce, Extract
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from datetime import timedelta
-from .models import Trip, Stage, Comment, TrackPoint, Hut, User, Photo, Surfboard, SurfSpot
+from .models import Trip, Stage, StageTrack, TrackSection, Comment, TrackPoint, Hut, User, Photo, Surfboard, SurfSpot
 from django_countries import countries
+from PIL import UnidentifiedImageError
 
 # WICHTIG: Die korrekten Serializer für Liste/Detail importieren
-from .serializers import TripListSerializer, TripDetailSerializer, StageSerializer, CommentSerializer, HutSerializer, UserSerializer, PartnerStatSerializer, PhotoSerializer, SurfboardSerializer, SurfSpotSerializer
+from .serializers import TripListSerializer, TripDetailSerializer, StageSerializer, TrackPointCreateSerializer, TrackSectionSerializer, CommentSerializer, HutSerializer, UserSerializer, PartnerStatSerializer, PhotoSerializer, SurfboardSerializer, SurfSpotSerializer
 from .pagination import StandardResultsSetPagination # Unser Paginierungs-Modul
 from .permissions import IsCreatorOrReadOnly, IsAuthorOrStageCreatorOrAdmin
-from .filters import TripFilter
-from .image_processing import process_and_save_photo
+from .filters import TripFilter, StageFilter
+from .renderers import TrackBinaryRenderer
+from .image_processing import store_uploaded_photo
+from .photo_jobs import process_uploaded_photos
+from .photo_variants import CONTENT_TYPES, delete_variants, formats, get_variant, negotiate_format, variant_box
+from .track_storage import PackedTrack, append_track, load_track
+from .track_jobs import enqueue_track, has_pending_job, latest_job_prefetch, latest_job_status
+from .track_preview import store_preview_track
+from .track_profile import DEFAULT_PROFILE_POINTS, MAX_PROFILE_POINTS, lttb_profile, profile_from_precomputed
+from .gpx_batch import BatchError, batch_previews, json_items, preview_metrics, zip_items
+from .track_export import export_response
+from .tiles import render_tile
+from .live import event_stream, publish_track_update, stage_group, trip_group
 
 
 class TripViewSet(viewsets.ModelViewSet):
@@ -71,6 +90,10 @@ class TripViewSet(viewsets.ModelViewSet):
                 ).values('count')[:1]
             )
         ).prefetch_related('participants', 'creator', 'huts')
+        if self.action not in ('list', 'export'):
+            # Detail serializer renders every stage track; fetch the packed tracks in one query
+            queryset = queryset.prefetch_related('stages__packed_track', 'stages__track_sections',
+                                                 latest_job_prefetch('stages__track_jobs'))
         return queryset.order_by('-start_date')
 
     # This method correctly chooses the serializer for the view
@@ -82,24 +105,142 @@ class TripViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    @action(detail=True, methods=['get'], url_path=r'export\.(?P<fmt>gpx|geojson)')
+    def export(self, request, pk=None, fmt=None):
+        """Streams the tracks of all stages of the trip as GPX or GeoJSON download."""
+        trip = self.get_object()
+        stages = trip.stages.order_by('date', 'id').iterator(chunk_size=50)
+        return export_response(stages, trip.name, fmt)
+
 class StageViewSet(viewsets.ModelViewSet):
-    queryset = Stage.objects.all()
+    queryset = Stage.objects.select_related('packed_track').prefetch_related('track_sections')
     serializer_class = StageSerializer
     permission_classes = [IsCreatorOrReadOnly]
+    filterset_class = StageFilter
+
+    def get_queryset(self):
+        if self.action in ('elevation_profile', 'append_track'):
+            # Served from StageTrack.elevation_profiles resp. appended in the database, the track blobs are not needed
+            return Stage.objects.all()
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # track_job of every serialized stage in one query
+            queryset = queryset.prefetch_related(latest_job_prefetch())
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    @action(detail=True, methods=['get'], renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES, TrackBinaryRenderer])
+    def track(self, request, pk=None):
+        """
+        Only the track payload of a stage (without comments/photos).
+        Supports ?lod=full|high|medium|low or ?tolerance=<meters> for simplified overview maps.
+        With 'Accept: application/vnd.wanderapp.track' (or ?format=bin) the track is returned
+        in the binary layout of api.track_binary instead of JSON lists.
+        """
+        stage = self.get_object()
+        serializer = self.get_serializer(stage)
+        if isinstance(request.accepted_renderer, TrackBinaryRenderer):
+            track = load_track(stage)
+            if track is None:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            return Response(track.to_binary(serializer.get_track_tolerance()))
+        return Response(serializer.get_track(stage))
+
+    @action(detail=True, methods=['get'], url_path='elevation-profile')
+    def elevation_profile(self, request, pk=None):
+        """
+        Elevation profile downsampled with LTTB to at most ?points=N points (default 500),
+        as distances/elevations/coordinates arrays like the track payload.
+        """
+        try:
+            points = int(request.query_params.get('points', DEFAULT_PROFILE_POINTS))
+        except ValueError:
+            return Response({'error': 'points must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 2 <= points <= MAX_PROFILE_POINTS:
+            return Response({'error': f'points must be between 2 and {MAX_PROFILE_POINTS}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        stage = self.get_object()
+        profiles = StageTrack.objects.filter(stage=stage).values_list('elevation_profiles', flat=True).first()
+        profile = profile_from_precomputed(profiles, points) if profiles else None
+        if profile is None:
+            # Live-tracked, legacy or more points than precomputed: downsample the full track
+            track = load_track(stage)
+            if track is None or not track.has_elevation:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+            profile = lttb_profile(track, points)
+        return Response({'points': len(profile['distances']), **profile})
+
+    @action(detail=True, methods=['get'], url_path=r'export\.(?P<fmt>gpx|geojson)')
+    def export(self, request, pk=None, fmt=None):
+        """Streams the stage track as GPX or GeoJSON download."""
+        stage = self.get_object()
+        return export_response([stage], stage.name, fmt)
+
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser], url_path='gpx')
+    def upload_gpx(self, request, pk=None):
+        """
+        Replaces the stage track with a raw GPX file (multipart field 'gpx'). The file is parsed
+        and ingested by a background job; poll the stage's track_job for the result.
+        """
+        stage = self.get_object()
+        if stage.creator != request.user and not request.user.is_staff:
+            return Response({'detail': 'You do not have permission.'}, status=status.HTTP_403_FORBIDDEN)
+
+        gpx_file = request.FILES.get('gpx')
+        if gpx_file is None:
+            return Response({'error': 'No GPX file provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        enqueue_track(stage, gpx_file=gpx_file)
+        return Response({'id': stage.id, 'track_job': latest_job_status(stage)}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['post'], url_path='track/append')
+    def append_track(self, request, pk=None):
+        """
+        Live tracking: appends a batch of points ({"points": [{lat, lon, ele, time, segment}, ...]}) to the
+        stage track. Length, elevation gain/loss and duration are updated from running totals. A change
+        of ``segment`` starts a new GPX segment. Rejected with 409 while a track upload is processed.
+        """
+        stage = self.get_object()
+        if stage.creator != request.user and not request.user.is_staff:
+            return Response({'detail': 'You do not have permission.'}, status=status.HTTP_403_FORBIDDEN)
+
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object with "points"'}, status=status.HTTP_400_BAD_REQUEST)
+        if has_pending_job(stage):
+            # The job would replace the track and drop the appended points
+            return Response({'error': 'A track upload of this stage is still being processed',
+                             'track_job': latest_job_status(stage)}, status=status.HTTP_409_CONFLICT)
+
+        serializer = TrackPointCreateSerializer(data=request.data.get('points'), many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        points = serializer.validated_data
+        batch = PackedTrack.from_points(points)
+        state = append_track(stage, batch, points[0].get('segment') or 0, points[-1].get('segment') or 0)
+        publish_track_update(stage, batch, state)
+
+        last_lon, last_lat, last_ele, last_time = state['last_point']
+        return Response({
+            'id': stage.id,
+            'point_count': state['track_point_count'],
+            'calculated_length_km': stage.calculated_length_km,
+            'calculated_elevation_gain': stage.calculated_elevation_gain,
+            'calculated_elevation_loss': stage.calculated_elevation_loss,
+            'calculated_duration': stage.calculated_duration.total_seconds() if stage.calculated_duration else None,
+            'last_point': {'lat': last_lat, 'lon': last_lon, 'ele': last_ele, 'time': last_time},
+        })
+
     @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def upload_photos(self, request, pk=None):
         stage = self.get_object()
         if stage.creator != request.user and not request.user.is_staff:
             return Response({'detail': 'You do not have permission.'}, status=status.HTTP_403_FORBIDDEN)
         
-        uploaded_photos_data = []
-        for file in request.FILES.getlist('photos'):
-            photo = process_and_save_photo(file, stage, request.user)
-            uploaded_photos_data.append(PhotoSerializer(photo, context={'request': request}).data)
+        # Only the originals are stored here; derivatives follow in the background (processing_status)
+        photos = [store_uploaded_photo(file, stage, request.user) for file in request.FILES.getlist('photos')]
+        photos = process_uploaded_photos(photos)
+        uploaded_photos_data = [PhotoSerializer(photo, context={'request': request}).data for photo in photos]
         
         return Response(uploaded_photos_data, status=status.HTTP_201_CREATED)
 
@@ -151,6 +292,7 @@ class PhotoViewSet(viewsets.ModelViewSet):
         instance.thumbnail.delete(save=False)
         instance.display_webp.delete(save=False)
         instance.thumbnail_webp.delete(save=False)
+        delete_variants(instance.pk)
         instance.delete()
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
@@ -209,6 +351,41 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(users, many=True)
         return Response({'users': serializer.data})
 
+def _moving_aggregates():
+    """Aggregates for the moving-time totals of _moving_stats(), computed from the calculated_* stage fields."""
+    return {
+        'moving_time': Sum('calculated_moving_time'),
+        'stopped_time': Sum('calculated_stopped_time'),
+        # Distance covered while moving (avg speed = moving distance / moving time), so pauses
+        # and stages without a timed track do not dilute the average speed
+        'moving_km': Sum(
+            F('calculated_avg_speed_kmh') * Extract('calculated_moving_time', 'epoch', output_field=FloatField()) / 3600,
+            output_field=FloatField(),
+        ),
+        'max_speed': Max('calculated_max_speed_kmh'),
+    }
+
+
+def _moving_stats(stats):
+    moving_seconds = (stats.get('moving_time') or timedelta(0)).total_seconds()
+    return {
+        'total_moving_time': moving_seconds,
+        'total_stopped_time': (stats.get('stopped_time') or timedelta(0)).total_seconds(),
+        'avg_moving_speed_kmh': round(stats['moving_km'] / (moving_seconds / 3600), 2) if moving_seconds and stats.get('moving_km') else None,
+        'max_speed_kmh': stats.get('max_speed'),
+    }
+
+def _biggest_climb(stages):
+    """Largest climb (TrackSection) of the given stages as a dashboard record; None without climbs."""
+    climb = (
+        TrackSection.objects.filter(stage__in=stages, kind=TrackSection.CLIMB)
+        .select_related('stage').order_by('-elevation_gain').first()
+    )
+    if climb is None:
+        return None
+    return {**TrackSectionSerializer(climb).data, 'stage_id': climb.stage_id, 'stage_name': climb.stage.name, 'trip': climb.stage.trip_id}
+
+
 class UserStatsView(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request, pk=None, *args, **kwargs):
@@ -256,7 +433,8 @@ class UserStatsView(APIView):
             total_km=Sum(Coalesce('calculated_length_km', 'manual_length_km', Value(0.0))),
             total_elevation=Sum(Coalesce('calculated_elevation_gain', 'manual_elevation_gain', Value(0))),
             total_loss=Sum(Coalesce('calculated_elevation_loss', Value(0))),
-            total_duration=Sum(Coalesce('calculated_duration', 'manual_duration', Value(timedelta(0))))
+            total_duration=Sum(Coalesce('calculated_duration', 'manual_duration', Value(timedelta(0)))),
+            **_moving_aggregates()
         )
         
         # Activity-specific stats
@@ -270,7 +448,8 @@ class UserStatsView(APIView):
             total_km=Sum(Coalesce('calculated_length_km', 'manual_length_km', Value(0.0))),
             total_elevation=Sum(Coalesce('calculated_elevation_gain', 'manual_elevation_gain', Value(0))),
             total_loss=Sum(Coalesce('calculated_elevation_loss', Value(0))),
-            total_duration=Sum(Coalesce('calculated_duration', 'manual_duration', Value(timedelta(0))))
+            total_duration=Sum(Coalesce('calculated_duration', 'manual_duration', Value(timedelta(0)))),
+            **_moving_aggregates()
         )
 
         surfing_stats = surfing_stages.aggregate(
@@ -329,6 +508,7 @@ class UserStatsView(APIView):
             'total_elevation': stats.get('total_elevation') or 0,
             'total_loss': stats.get('total_loss') or 0,
             'total_duration': (stats.get('total_duration') or timedelta(0)).total_seconds(),
+            **_moving_stats(stats),
             
             # Activity-specific stats
             'hiking': {
@@ -339,6 +519,7 @@ class UserStatsView(APIView):
                 'total_elevation': hiking_stats.get('total_elevation') or 0,
                 'total_loss': hiking_stats.get('total_loss') or 0,
                 'total_duration': (hiking_stats.get('total_duration') or timedelta(0)).total_seconds(),
+                **_moving_stats(hiking_stats),
             },
             'surfing': {
                 'trip_count': surfing_trips.count(),
@@ -453,12 +634,14 @@ class DashboardDataView(APIView):
                 'longest_stage_by_km': StageSerializer(longest_stage_km, context={'request': request}).data if longest_stage_km else None,
                 'highest_stage_by_gain': StageSerializer(highest_stage_gain, context={'request': request}).data if highest_stage_gain else None,
                 'longest_stage_by_duration': StageSerializer(longest_stage_duration, context={'request': request}).data if longest_stage_duration else None,
+                'biggest_climb': _biggest_climb(user_stages),
                 
                 # Activity-specific records
                 'hiking_records': {
                     'longest_by_km': StageSerializer(longest_hike_km, context={'request': request}).data if longest_hike_km else None,
                     'highest_by_gain': StageSerializer(highest_hike_gain, context={'request': request}).data if highest_hike_gain else None,
                     'longest_by_duration': StageSerializer(longest_hike_duration, context={'request': request}).data if longest_hike_duration else None,
+                    'biggest_climb': _biggest_climb(hiking_stages),
                 },
                 'surfing_records': {
                     'longest_session': StageSerializer(longest_surf_session, context={'request': request}).data if longest_surf_session else None,
@@ -518,7 +701,8 @@ class DashboardOverviewView(APIView):
             total_km=Sum(Coalesce('calculated_length_km', 'manual_length_km', Value(0.0))),
             total_elevation=Sum(Coalesce('calculated_elevation_gain', 'manual_elevation_gain', Value(0))),
             total_loss=Sum(Coalesce('calculated_elevation_loss', Value(0))),
-            total_duration=Sum(Coalesce('calculated_duration', 'manual_duration', Value(timedelta(0))))
+            total_duration=Sum(Coalesce('calculated_duration', 'manual_duration', Value(timedelta(0)))),
+            **_moving_aggregates()
         )
 
         # Surfing stats
@@ -593,6 +777,8 @@ class DashboardOverviewView(APIView):
                 'manual_elevation_gain': stage.manual_elevation_gain,
                 'calculated_elevation_loss': stage.calculated_elevation_loss,
                 'calculated_duration': str(stage.calculated_duration) if stage.calculated_duration else None,
+                'calculated_moving_time': str(stage.calculated_moving_time) if stage.calculated_moving_time else None,
+                'calculated_max_speed_kmh': stage.calculated_max_speed_kmh,
                 'manual_duration': str(stage.manual_duration) if stage.manual_duration else None,
                 'time_in_water': str(stage.time_in_water) if stage.time_in_water else None,
                 'waves_caught': stage.waves_caught,
@@ -616,7 +802,8 @@ class DashboardOverviewView(APIView):
                     'total_km': round(hiking_stats.get('total_km') or 0, 2),
                     'total_elevation': hiking_stats.get('total_elevation') or 0,
                     'total_loss': hiking_stats.get('total_loss') or 0,
-                    'total_duration': (hiking_stats.get('total_duration') or timedelta(0)).total_seconds()
+                    'total_duration': (hiking_stats.get('total_duration') or timedelta(0)).total_seconds(),
+                    **_moving_stats(hiking_stats),
                 },
                 'surfing': {
                     'trip_count': surfing_trips.count(),
@@ -634,7 +821,8 @@ class DashboardOverviewView(APIView):
                 'hiking': {
                     'longest_km': serialize_record(longest_hike_km),
                     'highest_gain': serialize_record(highest_hike_gain),
-                    'longest_duration': serialize_record(longest_hike_duration)
+                    'longest_duration': serialize_record(longest_hike_duration),
+                    'biggest_climb': _biggest_climb(hiking_stages)
                 },
                 'surfing': {
                     'longest_session': serialize_record(longest_surf_session),
@@ -651,6 +839,30 @@ class DashboardOverviewView(APIView):
 
         return Response(data)
 
+class TrackTileView(APIView):
+    """
+    Mapbox Vector Tile with the tracks of all stages (layer 'tracks').
+    Optional filters: ?user=<id> (trips the user participated in), ?trip=<id>, ?activity_type=HIKING|SURFING.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, z, x, y):
+        if z > 22 or x >= 2 ** z or y >= 2 ** z:
+            return Response({'error': 'Invalid tile coordinates'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_id = int(request.GET['user']) if request.GET.get('user') else None
+            trip_id = int(request.GET['trip']) if request.GET.get('trip') else None
+        except ValueError:
+            return Response({'error': 'user and trip must be ids'}, status=status.HTTP_400_BAD_REQUEST)
+        activity_type = request.GET.get('activity_type') or None
+        if activity_type and activity_type not in dict(Stage.ACTIVITY_CHOICES):
+            return Response({'error': 'Invalid activity_type'}, status=status.HTTP_400_BAD_REQUEST)
+
+        tile = render_tile(z, x, y, user_id=user_id, trip_id=trip_id, activity_type=activity_type)
+        response = HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
+        response['Cache-Control'] = 'private, max-age=300'
+        return response
+
 class CountriesAPIView(APIView):
     """
     API endpoint to get country options for surf trips.
@@ -698,9 +910,9 @@ class CountriesAPIView(APIView):
             'all_countries': all_countries
         })
 
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
-import gpxpy
 from datetime import timedelta
 
 @api_view(['GET'])
@@ -777,56 +989,95 @@ def search_suggestions(request):
 @permission_classes([IsAuthenticated])
 def calculate_gpx_metrics(request):
     """
-    Calculate metrics from GPX file content using the same logic as the backend serializer
+    Calculate metrics from the parsed track points using the same logic as the backend serializer.
+    The validated track is cached server-side; the returned 'token' can be sent as 'track_token'
+    when creating/updating the stage instead of the track_points.
     """
+    serializer = TrackPointCreateSerializer(data=request.data.get('track_points'), many=True, allow_empty=False)
+    if not serializer.is_valid():
+        return Response({'error': 'No valid track points provided', 'details': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        gpx_content = request.data.get('gpx_content', '')
-        if not gpx_content:
-            return Response({'error': 'No GPX content provided'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Parse GPX content using gpxpy (same as in serializer)
-        gpx = gpxpy.gpx.GPX()
-        gpx_track = gpxpy.gpx.GPXTrack()
-        gpx.tracks.append(gpx_track)
-        gpx_segment = gpxpy.gpx.GPXTrackSegment()
-        gpx_track.segments.append(gpx_segment)
-
-        # Convert track points data to GPX points
-        track_points_data = request.data.get('track_points', [])
-        if not track_points_data:
-            return Response({'error': 'No track points provided'}, status=status.HTTP_400_BAD_REQUEST)
-
-        for point_data in track_points_data:
-            gpx_segment.points.append(gpxpy.gpx.GPXTrackPoint(
-                latitude=point_data['lat'],
-                longitude=point_data['lon'],
-                elevation=point_data.get('ele')
-            ))
-
-        # Calculate metrics using gpxpy (same as serializer)
-        calculated_length_km = round(gpx.length_3d() / 1000, 2)
-        uphill, downhill = gpx.get_uphill_downhill()
-        calculated_elevation_gain = round(uphill)
-        calculated_elevation_loss = round(downhill)
-
-        duration_in_seconds = gpx.get_duration()
-        calculated_duration = timedelta(seconds=duration_in_seconds) if duration_in_seconds else None
-
-        # Format duration for display
-        duration_formatted = ''
-        if calculated_duration:
-            total_seconds = int(calculated_duration.total_seconds())
-            hours = total_seconds // 3600
-            minutes = (total_seconds % 3600) // 60
-            duration_formatted = f"{hours:02d}:{minutes:02d}"
+        track = PackedTrack.from_points(serializer.validated_data)
+        # Calculate metrics with the shared vectorized engine (same as serializer)
+        metrics = preview_metrics(track)
+    except Exception as e:
+        return Response({'error': f'GPX calculation failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({**metrics, 'token': store_preview_track(request.user, track)})
 
-        return Response({
-            'length': calculated_length_km,
-            'elevationGain': calculated_elevation_gain,
-            'elevationLoss': calculated_elevation_loss,
-            'duration': total_seconds if calculated_duration else None,
-            'durationFormatted': duration_formatted
-        })
 
-    except Exception as e:
-        return Response({'error': f'GPX calculation failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, MultiPartParser])
+def calculate_gpx_metrics_batch(request):
+    """
+    Metrics previews for many tracks in one request, computed concurrently in a process pool.
+    Accepts JSON {"tracks": [{"name": ..., "track_points": [...]}, ...]} or multipart with
+    several 'gpx' files and/or a 'zip' of GPX files. Returns {"results": [...]} in input order.
+    """
+    try:
+        if 'tracks' in request.data:
+            items = json_items(request.data['tracks'])
+        else:
+            items = [(f.name, 'gpx', f.read()) for f in request.FILES.getlist('gpx')]
+            for uploaded_zip in request.FILES.getlist('zip'):
+                items.extend(zip_items(uploaded_zip))
+        return Response({'results': batch_previews(items)})
+    except (BatchError, ValueError, KeyError, TypeError, AttributeError) as e:
+        return Response({'error': f'GPX calculation failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+# ===================================================================
+# LIVE TRACKING STREAMS (Server-Sent Events, only useful under ASGI)
+# ===================================================================
+
+async def _jwt_user(request):
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+async def _live_response(request, model, pk, group):
+    if await _jwt_user(request) is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    if not await model.objects.filter(pk=pk).aexists():
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    response = StreamingHttpResponse(event_stream(group), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
+
+
+async def stage_live_stream(request, pk):
+    """GET /api/stages/{id}/live/ – appended points and totals of one stage as 'track' events."""
+    return await _live_response(request, Stage, pk, stage_group(pk))
+
+
+async def trip_live_stream(request, pk):
+    """GET /api/trips/{id}/live/ – 'track' events of all stages of a trip (TripDetail.vue)."""
+    return await _live_response(request, Trip, pk, trip_group(pk))
+
+
+def photo_variant(request, pk, variant, fmt=None):
+    """
+    GET /media/photos/{id}/{variant}.{fmt} – derivative rendered on first request and then served
+    from the variant cache (api.photo_variants). Public like the other files under /media/.
+    Without ``.{fmt}`` the format is picked from the Accept header (AVIF/WebP/JPEG).
+    """
+    negotiated = fmt is None
+    if negotiated:
+        fmt = negotiate_format(request.headers.get('Accept'))
+    if variant_box(variant) is None or fmt not in formats():
+        raise Http404("Unknown photo variant")
+    photo = get_object_or_404(Photo, pk=pk)
+    try:
+        content = open(get_variant(photo, variant, fmt), 'rb')
+    except (FileNotFoundError, UnidentifiedImageError):
+        raise Http404("Photo original not readable")
+    response = FileResponse(content, content_type=CONTENT_TYPES[fmt])
+    response['Cache-Control'] = 'public, max-age=604800'
+    if negotiated:
+        patch_vary_headers(response, ['Accept'])
+    return response
@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+The live tracking streams (/api/stages/{id}/live/, /api/trips/{id}/live/) are async views and
+only stream under this ASGI application, e.g.
+``gunicorn -k uvicorn.workers.UvicornWorker wanderapp_backend.asgi:application``.
 """
 
 import os
@@ -83,4 +83,67 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+# Track storage: packed StageTrack rows are the primary source. Enable to additionally
+# write one legacy TrackPoint row per GPS fix.
+TRACKPOINT_LEGACY_ROWS = config('TRACKPOINT_LEGACY_ROWS', default=False, cast=bool)
+
+# Cache shared by all web processes (GPX preview tokens, vector tiles); a per-process cache would
+# miss most preview tokens behind several workers. The database cache needs
+# 'python manage.py createcachetable'; CACHE_BACKEND/CACHE_LOCATION switch to e.g. Redis or Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='wanderapp_cache'),
+    }
+}
+
+# Vector tiles (/api/tiles/{z}/{x}/{y}.mvt) are cached in the default cache; the key version is derived
+# from the StageTrack rows, so track changes invalidate them in every process
+TILE_CACHE_TIMEOUT = config('TILE_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Live tracking (/api/stages/{id}/live/, /api/trips/{id}/live/): Server-Sent Events, served by the
+# ASGI application. The default channel layer only fans out within one worker process.
+LIVE_CHANNEL_LAYER = config('LIVE_CHANNEL_LAYER', default='api.live.InProcessChannelLayer')
+LIVE_STREAM_MAX_SECONDS = config('LIVE_STREAM_MAX_SECONDS', default=300, cast=int)
+
+# Track ingestion jobs (api.track_jobs): threads per web process that start new jobs right after
+# the request. Set to 0 to leave all jobs to 'python manage.py run_track_jobs'.
+TRACK_JOB_WORKERS = config('TRACK_JOB_WORKERS', default=2, cast=int)
+# Seconds between queue polls of those threads (retries after backoff, RUNNING jobs of crashed
+# workers); starts with the first job of the process. 0 = only 'run_track_jobs' polls.
+TRACK_JOB_POLL_INTERVAL = config('TRACK_JOB_POLL_INTERVAL', default=30, cast=int)
+
+# Process pool for /api/calculate-gpx/batch/ (None = one worker per CPU)
+GPX_BATCH_WORKERS = config('GPX_BATCH_WORKERS', default=None, cast=lambda v: int(v) if v else None)
+
+# Lifetime of cached GPX previews (/api/calculate-gpx/ token -> stage track_token), in seconds
+TRACK_PREVIEW_TIMEOUT = config('TRACK_PREVIEW_TIMEOUT', default=1800, cast=int)
+
+# Photo derivative generation (api.photo_jobs): threads per web process that process uploads right
+# after the request. Set to 0 to leave all photos to 'python manage.py run_photo_jobs'.
+PHOTO_WORKERS = config('PHOTO_WORKERS', default=2, cast=int)
+# Seconds between polls of those threads (retries of failed photos, PROCESSING photos of crashed
+# workers); starts with the first upload of the process. 0 = only 'run_photo_jobs' polls.
+PHOTO_POLL_INTERVAL = config('PHOTO_POLL_INTERVAL', default=30, cast=int)
+
+# Parallel photo processing (api.image_processing.process_photos): process pool size (None = one worker
+# per CPU, 0 = no pool), estimated decoded image memory in flight across the workers, and photos per
+# batch of run_photo_jobs. PHOTO_UPLOAD_SYNC processes uploads inside the request instead of the workers.
+PHOTO_PROCESS_WORKERS = config('PHOTO_PROCESS_WORKERS', default=None, cast=lambda v: int(v) if v else None)
+PHOTO_PROCESS_MEMORY_MB = config('PHOTO_PROCESS_MEMORY_MB', default=1024, cast=int)
+PHOTO_BATCH_SIZE = config('PHOTO_BATCH_SIZE', default=8, cast=int)
+PHOTO_UPLOAD_SYNC = config('PHOTO_UPLOAD_SYNC', default=False, cast=bool)
+
+# On-demand photo variants (/media/photos/{id}/{variant}.{fmt}, api.photo_variants): cache directory
+# (default MEDIA_ROOT/photos, so the web server can serve hits directly) and its size limit with LRU
+# eviction. With PHOTO_EAGER_DERIVATIVES off, uploads only get the normalized original and the
+# display/thumbnail fields stay empty.
+PHOTO_VARIANT_CACHE_DIR = config('PHOTO_VARIANT_CACHE_DIR', default='') or None
+PHOTO_VARIANT_CACHE_MB = config('PHOTO_VARIANT_CACHE_MB', default=1024, cast=int)
+PHOTO_EAGER_DERIVATIVES = config('PHOTO_EAGER_DERIVATIVES', default=True, cast=bool)
+
+# Responsive photos: widths of the srcset ladder (variants w{width}) and whether negotiated variant
+# URLs may answer with AVIF (only if Pillow is built with libavif)
+PHOTO_VARIANT_WIDTHS = config('PHOTO_VARIANT_WIDTHS', default='160,320,640,1280,2048', cast=lambda v: tuple(int(w) for w in v.split(',') if w.strip()))
+PHOTO_AVIF = config('PHOTO_AVIF', default=True, cast=bool)
@@ -8,6 +8,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from api.views import photo_variant
+
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -18,6 +20,9 @@ urlpatterns = [
     path('api/', include('api.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    # Foto-Varianten auf Abruf (api.photo_variants), auch ohne DEBUG; Cache-Treffer kann der Webserver direkt ausliefern
+    path('media/photos/<int:pk>/<slug:variant>.<slug:fmt>', photo_variant, name='photo-variant'),
+    path('media/photos/<int:pk>/<slug:variant>', photo_variant, name='photo-variant-negotiated'),
 ]
 
 # DIESER NEUE BLOCK IST DIE ENDGÜLTIGE LÖSUNG